@@ -0,0 +1,122 @@
+import argparse
+import queue
+import random
+import threading
+import time
+import grpc
+import myuber_pb2
+from bench_ride_state import Aborted, BenchContext
+from myuber_logger import logger
+from myuber_metrics import LatencyHistogram
+from myuber_server import MyUberServicer
+
+def run(args, max_pending, patience):
+    # Offer --overload times the fleet's capacity for --duration seconds and record what riders see
+    servicer = MyUberServicer(acceptance_timeout=args.acceptance_timeout, max_pending_rides=max_pending,
+                              max_ride_wait=0)
+    drivers = [f"admission-driver-{i}" for i in range(args.drivers)]
+    servicer.RegisterDrivers(myuber_pb2.RegisterDriversRequest(
+        drivers=[myuber_pb2.DriverRegistrationRequest(driver_id=driver_id) for driver_id in drivers]), BenchContext())
+    stop = threading.Event()
+    requested_at = {}
+    accept_latency = LatencyHistogram()
+    counts = {"requested": 0, "shed": 0, "accepted": 0}
+    peaks = {"pending": 0, "active_rides": 0}
+    lock = threading.Lock()
+
+    def driver(driver_id):
+        # Accept every offer after a short think time, then drive the trip
+        subscriber = servicer.events.subscribe(("driver", driver_id))
+        rng = random.Random(driver_id)
+        context = BenchContext()
+        while not stop.is_set():
+            try:
+                assignment = subscriber.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if assignment.status != myuber_pb2.DRIVER_ASSIGNED:
+                continue
+            time.sleep(rng.uniform(0, args.think_time))
+            try:
+                servicer.AcceptRide(myuber_pb2.AcceptRideRequest(ride_id=assignment.ride_id, driver_id=driver_id),
+                                    context)
+            except Aborted:
+                continue
+            accept_latency.record(time.monotonic() - requested_at[assignment.ride_id])
+            with lock:
+                counts["accepted"] += 1
+            time.sleep(rng.expovariate(1.0 / args.trip_time))
+            servicer.CompleteRide(myuber_pb2.RideCompletionRequest(ride_id=assignment.ride_id, driver_id=driver_id),
+                                  context)
+
+    def sample():
+        # Track the largest pending queue and number of live rides
+        while not stop.wait(0.05):
+            peaks["pending"] = max(peaks["pending"], servicer.dispatcher.pending_count())
+            peaks["active_rides"] = max(peaks["active_rides"], len(servicer.rides.active))
+
+    threads = [threading.Thread(target=driver, args=(driver_id,)) for driver_id in drivers]
+    threads.append(threading.Thread(target=sample))
+    for thread in threads:
+        thread.start()
+
+    capacity = args.drivers / (args.trip_time + args.think_time / 2)
+    rate = capacity * args.overload
+    rng = random.Random(args.seed)
+    start = time.monotonic()
+    next_arrival = start
+    while True:
+        next_arrival += rng.expovariate(rate)
+        if next_arrival - start > args.duration:
+            break
+        time.sleep(max(0.0, next_arrival - time.monotonic()))
+        counts["requested"] += 1
+        request_time = time.monotonic()
+        try:
+            response = servicer.RequestRide(myuber_pb2.RideRequest(rider_id=f"admission-rider-{counts['requested']}",
+                                                                   max_wait_seconds=patience),
+                                            BenchContext())
+        except Aborted as aborted:
+            assert aborted.args[0] == grpc.StatusCode.RESOURCE_EXHAUSTED
+            counts["shed"] += 1
+            continue
+        requested_at[response.ride_id] = request_time
+    # Let the backlog drain or expire
+    time.sleep(args.drain)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    with servicer.rides.lock:
+        expired = sum(1 for _, ride in servicer.rides.finished.values() if ride.status == myuber_pb2.EXPIRED)
+    waiting = servicer.dispatcher.pending_count()
+    return counts, peaks, expired, waiting, accept_latency.snapshot()
+
+def main():
+    parser = argparse.ArgumentParser(description="Ride admission under overload: unbounded queue vs bounded queue "
+                                                 "with rider deadlines")
+    parser.add_argument("--drivers", type=int, default=20)
+    parser.add_argument("--trip-time", type=float, default=1.0, help="Mean trip duration in seconds")
+    parser.add_argument("--think-time", type=float, default=0.2, help="Maximum seconds before a driver accepts")
+    parser.add_argument("--overload", type=float, default=3.0, help="Arrival rate as a multiple of fleet capacity")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of ride arrivals")
+    parser.add_argument("--drain", type=float, default=8.0, help="Seconds to wait after the last arrival")
+    parser.add_argument("--rider-patience", type=float, default=5.0, help="Rider deadline (max_wait_seconds)")
+    parser.add_argument("--max-pending", type=int, default=50, help="Pending queue bound for the bounded run")
+    parser.add_argument("--acceptance-timeout", type=float, default=3.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    logger.setLevel("ERROR")
+
+    print(f"{'admission':<22} {'requested':>9} {'shed':>6} {'expired':>8} {'accepted':>9} {'left':>5} "
+          f"{'peak queue':>11} {'peak rides':>11} {'accept p50 ms':>14} {'p99 ms':>8}")
+    # The first run is the old behaviour: every request is queued and waits until it gets a driver
+    for label, max_pending, patience in (("unbounded, no expiry", 0, 0),
+                                         (f"bound {args.max_pending}, deadlines", args.max_pending,
+                                          args.rider_patience)):
+        counts, peaks, expired, waiting, latency = run(args, max_pending, patience)
+        print(f"{label:<22} {counts['requested']:>9} {counts['shed']:>6} {expired:>8} {counts['accepted']:>9} "
+              f"{waiting:>5} {peaks['pending']:>11} {peaks['active_rides']:>11} "
+              f"{latency['p50'] * 1000:14.0f} {latency['p99'] * 1000:8.0f}")
+
+if __name__ == '__main__':
+    main()
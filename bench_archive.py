@@ -0,0 +1,177 @@
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import grpc
+from myuber_archive import DRIVER, RIDER, RideArchive
+from myuber_channels import ChannelPool
+from myuber_client import MyUberClient
+from myuber_driver import MyUberDriver
+from myuber_logger import logger
+from myuber_metrics import LatencyHistogram
+from myuber_pb2 import COMPLETED
+from myuber_ride_store import Ride
+
+# Archived pickups are spread over this box (about 10 x 10 km)
+CENTER_LAT, CENTER_LNG, SPREAD = 40.73, -73.99, 0.09
+# Rides appended per append_many call while filling the archive
+CHUNK = 100000
+
+def fill_archive(archive, args):
+    # Append synthetic completed rides, one per minute of simulated time, until the archive holds args.rides
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    added = 0
+    base = 1700000000000
+    while len(archive) < args.rides:
+        rows = []
+        for row in range(len(archive), min(len(archive) + CHUNK, args.rides)):
+            requested_at = base + row * 60000
+            pickup = (CENTER_LAT + rng.uniform(-SPREAD / 2, SPREAD / 2),
+                      CENTER_LNG + rng.uniform(-SPREAD / 2, SPREAD / 2))
+            ride = Ride(f"rider-{rng.randrange(args.riders)}", pickup, COMPLETED,
+                        f"driver-{rng.randrange(args.drivers)}", requested_at)
+            rows.append((rng.randbytes(16), ride, requested_at + rng.randrange(300000, 3600000)))
+        archive.append_many(rows)
+        added += len(rows)
+        print(f"\rarchived {len(archive)} rides", end="", flush=True)
+    elapsed = time.perf_counter() - start
+    if added:
+        print(f"\rarchived {added} rides in {elapsed:.0f}s ({added / elapsed:.0f} rides/s)")
+    else:
+        print(f"\rreusing {len(archive)} archived rides")
+    archive.flush()
+
+def disk_usage(directory):
+    # Bytes actually allocated on disk; the column files are sparse past the last row
+    return sum(os.stat(os.path.join(directory, name)).st_blocks * 512 for name in os.listdir(directory))
+
+def query(label, histogram, rides, elapsed):
+    stats = histogram.snapshot()
+    print(f"{label:<42} {stats['count']:>7} {stats['p50'] * 1000:9.3f} {stats['p99'] * 1000:9.3f} "
+          f"{rides / elapsed:12.0f}")
+
+def run_local(archive, args):
+    # Query the archive in this process: first pages, whole histories and a full scan for comparison
+    rng = random.Random(args.seed + 1)
+    print(f"\n{'in process':<42} {'queries':>7} {'p50 ms':>9} {'p99 ms':>9} {'rides/s':>12}")
+    for label, kind, owners, pages in [
+        (f"rider, first page of {args.page_size}", RIDER, args.riders, 1),
+        ("rider, whole history", RIDER, args.riders, None),
+        (f"driver, first page of {args.page_size}", DRIVER, args.drivers, 1),
+        ("driver, whole history", DRIVER, args.drivers, None),
+    ]:
+        latency = LatencyHistogram()
+        rides = 0
+        start = time.perf_counter()
+        for _ in range(args.queries):
+            owner_id = f"{kind}-{rng.randrange(owners)}"
+            query_start = time.perf_counter()
+            token = 0
+            for _ in range(pages or sys.maxsize):
+                page, token = archive.history(kind, owner_id, args.page_size, token)
+                rides += len(page)
+                if not token:
+                    break
+            latency.record(time.perf_counter() - query_start)
+        query("  " + label, latency, rides, time.perf_counter() - start)
+
+    # Without the offset index, a history means reading the owner column of every archived ride
+    latency = LatencyHistogram()
+    index = archive.owners[RIDER]
+    start = time.perf_counter()
+    rides = 0
+    for _ in range(args.scan_queries):
+        code = index.codes[f"rider-{rng.randrange(args.riders)}"]
+        query_start = time.perf_counter()
+        with archive.lock:
+            rows = [row for row, owner in enumerate(index.owner.items[:len(archive)]) if owner == code]
+        rides += len(rows)
+        latency.record(time.perf_counter() - query_start)
+    query("  rider, scan of the rider column", latency, rides, time.perf_counter() - start)
+
+def memory(pid):
+    # Anonymous (heap) and file-backed (mapped archive pages) resident memory of a process, in MB
+    fields = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            fields[name] = value.strip()
+    return int(fields["RssAnon"].split()[0]) // 1024, int(fields["RssFile"].split()[0]) // 1024
+
+def run_server(directory, args):
+    # Serve the archive and page through histories over gRPC with the client and driver classes
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "myuber_server.py"),
+               "--port", str(args.port), "--insecure", "--log-level", "WARNING", "--archive-dir", directory]
+    start = time.perf_counter()
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    target = f"localhost:{args.port}"
+    try:
+        with grpc.insecure_channel(target) as channel:
+            grpc.channel_ready_future(channel).result(timeout=600)
+        anon, mapped = memory(server.pid)
+        print(f"\nserver ready in {time.perf_counter() - start:.1f}s; RSS {anon} MB heap + {mapped} MB mapped")
+        rng = random.Random(args.seed + 2)
+        pool = ChannelPool(1)
+        client = MyUberClient(target, insecure=True, channel_pool=pool)
+        print(f"{'over gRPC':<42} {'queries':>7} {'p50 ms':>9} {'p99 ms':>9} {'rides/s':>12}")
+        for label, kind, owners, max_rides in [
+            (f"GetRiderHistory, first {args.page_size}", RIDER, args.riders, args.page_size),
+            ("GetRiderHistory, whole history", RIDER, args.riders, 0),
+            (f"GetDriverHistory, first {args.page_size}", DRIVER, args.drivers, args.page_size),
+            ("GetDriverHistory, whole history", DRIVER, args.drivers, 0),
+        ]:
+            latency = LatencyHistogram()
+            rides = 0
+            start = time.perf_counter()
+            for _ in range(args.queries):
+                owner_id = f"{kind}-{rng.randrange(owners)}"
+                query_start = time.perf_counter()
+                if kind == RIDER:
+                    history = client.get_rider_history(owner_id, max_rides, args.page_size)
+                else:
+                    driver = MyUberDriver(owner_id, target, insecure=True, channel_pool=pool)
+                    history = driver.get_driver_history(max_rides, args.page_size)
+                rides += sum(1 for _ in history)
+                latency.record(time.perf_counter() - query_start)
+            query("  " + label, latency, rides, time.perf_counter() - start)
+        pool.close()
+        anon, mapped = memory(server.pid)
+        print(f"server RSS after the queries: {anon} MB heap + {mapped} MB mapped")
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="Rider and driver history queries over a large ride archive")
+    parser.add_argument("--rides", type=int, default=20000000, help="Completed rides in the archive")
+    parser.add_argument("--riders", type=int, default=1000000)
+    parser.add_argument("--drivers", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=2000, help="Histories read per query kind")
+    parser.add_argument("--scan-queries", type=int, default=3, help="Histories found by scanning, for comparison")
+    parser.add_argument("--page-size", type=int, default=100, help="Rides per history page")
+    parser.add_argument("--dir", help="Archive directory, kept and reused across runs (default: a temporary one)")
+    parser.add_argument("--port", type=int, default=50093)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    logger.setLevel("ERROR")
+
+    directory = args.dir or tempfile.mkdtemp(prefix="myuber-archive-")
+    try:
+        archive = RideArchive(directory)
+        fill_archive(archive, args)
+        print(f"{len(archive)} rides of {archive.count(RIDER)} riders and {archive.count(DRIVER)} drivers, "
+              f"{disk_usage(directory) / 2 ** 20:.0f} MB on disk")
+        run_local(archive, args)
+        archive.close()
+        run_server(directory, args)
+    finally:
+        if not args.dir:
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
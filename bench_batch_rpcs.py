@@ -0,0 +1,66 @@
+import argparse
+import time
+import myuber_pb2
+from bench_server_modes import start_server
+from myuber_client import MyUberClient
+from myuber_driver import MyUberDriver
+from myuber_logger import logger
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def run_once(args):
+    # Request rides, look them up and register drivers, one RPC per item and then in batches.
+    # Drivers come last so the timed ride calls are not competing with assignments.
+    target = f"localhost:{args.port}"
+    client = MyUberClient(target, insecure=True)
+    fleet = MyUberDriver("fleet", target, insecure=True)
+    count, size = args.items, args.batch_size
+    rides = [(f"rider-{i}", (40.7, -74.0 + i * 1e-5)) for i in range(count)]
+    drivers = [(f"driver-{i}", (40.7 + i * 1e-5, -74.0)) for i in range(count)]
+    results = {}
+
+    ride_ids = []
+    results["RequestRide"] = timed(lambda: ride_ids.extend(client.request_ride(r, p).ride_id for r, p in rides))
+    results["RequestRides"] = timed(lambda: [client.request_rides(rides[i:i + size]) for i in range(0, count, size)])
+
+    results["GetRideStatus"] = timed(lambda: [client.get_ride_status(ride_id) for ride_id in ride_ids])
+    results["GetRideStatuses"] = timed(lambda: [client.get_ride_statuses(ride_ids[i:i + size])
+                                                for i in range(0, count, size)])
+
+    def register_one_by_one():
+        for driver_id, (latitude, longitude) in drivers:
+            request = myuber_pb2.DriverRegistrationRequest(driver_id=driver_id + "-single")
+            request.location.latitude, request.location.longitude = latitude, longitude
+            fleet.stub.RegisterDriver(request)
+    results["RegisterDriver"] = timed(register_one_by_one)
+    results["RegisterDrivers"] = timed(lambda: [fleet.register_drivers([(d + "-batch", l) for d, l in drivers[i:i + size]])
+                                                for i in range(0, count, size)])
+    client.close()
+    fleet.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Items per second with one RPC per item vs batch RPCs")
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--mode", choices=["threaded", "asyncio"], default="threaded")
+    parser.add_argument("--max-workers", type=int, default=10)
+    parser.add_argument("--port", type=int, default=50063)
+    args = parser.parse_args()
+    logger.setLevel("WARNING")
+
+    server = start_server(args.mode, args.port, args.max_workers)
+    try:
+        results = run_once(args)
+    finally:
+        server.terminate()
+        server.wait()
+    print(f"{'rpc':>16} {'items/s':>10}")
+    for method, seconds in results.items():
+        print(f"{method:>16} {args.items / seconds:10.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+import argparse
+import asyncio
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+import grpc
+import myuber_pb2
+import myuber_pb2_grpc
+from myuber_aio_client import AsyncMyUberClient, AsyncMyUberDriver
+from myuber_channels import AsyncChannelPool, ChannelPool
+from myuber_client import MyUberClient
+from myuber_logger import logger
+from myuber_metrics import LatencyHistogram
+
+# Simulated riders and drivers are spread over this box (about 10 x 10 km)
+CENTER_LAT, CENTER_LNG, SPREAD = 40.73, -73.99, 0.09
+
+def start_server(args):
+    # Launch an asyncio server, so thousands of watch streams do not need a thread each
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "myuber_server.py"),
+               "--mode", "asyncio", "--port", str(args.port), "--log-level", "WARNING",
+               "--max-pending-rides", "0", "--max-ride-wait", "0",
+               # Measure the clients, not offers withdrawn while a saturated server answers slowly
+               "--acceptance-timeout", "300"]
+    if not args.tls:
+        command.append("--insecure")
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    with legacy_channel(args) as channel:
+        grpc.channel_ready_future(channel).result(timeout=15)
+    return server
+
+def legacy_channel(args):
+    # How every client object connected before: read the certificates and open a channel of its own
+    target = f"localhost:{args.port}"
+    if not args.tls:
+        return grpc.insecure_channel(target)
+    with open('ca.crt', 'rb') as f:
+        root_certificates = f.read()
+    with open('client.key', 'rb') as f:
+        private_key = f.read()
+    with open('client.crt', 'rb') as f:
+        certificate_chain = f.read()
+    credentials = grpc.ssl_channel_credentials(root_certificates=root_certificates, private_key=private_key,
+                                               certificate_chain=certificate_chain)
+    return grpc.secure_channel(target, credentials)
+
+def open_fds():
+    return len(os.listdir("/proc/self/fd"))
+
+def gateway(args, label, make_client):
+    # A gateway creating one client object per incoming request: build it, make one call, keep it around
+    fds = open_fds()
+    latency = LatencyHistogram()
+    clients = []
+    start = time.perf_counter()
+    for _ in range(args.objects):
+        call_start = time.perf_counter()
+        stub, close = make_client()
+        stub.GetStats(myuber_pb2.StatsRequest())
+        latency.record(time.perf_counter() - call_start)
+        clients.append(close)
+    elapsed = time.perf_counter() - start
+    stats = latency.snapshot()
+    print(f"{label:<30} {args.objects / elapsed:10.0f} {stats['p50'] * 1000:9.2f} {stats['p99'] * 1000:9.2f} "
+          f"{open_fds() - fds:>9}")
+    for close in clients:
+        close()
+    # Let the closed connections go before the next measurement counts descriptors
+    time.sleep(1.0)
+
+def run_gateway(args):
+    print(f"{'client objects':<30} {'objects/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'new fds':>9}")
+    target = f"localhost:{args.port}"
+
+    def legacy():
+        channel = legacy_channel(args)
+        return myuber_pb2_grpc.RideSharingStub(channel), channel.close
+
+    def private():
+        client = MyUberClient(target, insecure=not args.tls)
+        return client.stub, client.close
+
+    pool = ChannelPool(args.pool_channels)
+
+    def pooled():
+        client = MyUberClient(target, insecure=not args.tls, channel_pool=pool)
+        return client.stub, client.close
+
+    gateway(args, "own channel, reads certs", legacy)
+    gateway(args, "own channel, cached certs", private)
+    gateway(args, f"shared pool of {args.pool_channels}", pooled)
+    pool.close()
+
+async def run_fleet(args):
+    # One event loop drives every rider and driver through a shared pool of grpc.aio channels
+    target = f"localhost:{args.port}"
+    pool = AsyncChannelPool(args.pool_channels, args.max_in_flight)
+    rng = random.Random(args.seed)
+    request_latency = LatencyHistogram()
+    ride_latency = LatencyHistogram()
+    counts = {"completed": 0, "errors": 0}
+
+    def random_point():
+        return (CENTER_LAT + rng.uniform(-SPREAD / 2, SPREAD / 2), CENTER_LNG + rng.uniform(-SPREAD / 2, SPREAD / 2))
+
+    async def driver(index, ready):
+        client = AsyncMyUberDriver(f"pool-driver-{index}", target, insecure=not args.tls, channel_pool=pool)
+        if await client.register_driver(random_point()) is None:
+            counts["errors"] += 1
+            ready.set()
+            return
+        ready.set()
+        async for assignment in client.watch_assignments():
+            if assignment.status != myuber_pb2.DRIVER_ASSIGNED:
+                continue
+            if await client.accept_ride(assignment.ride_id) is not None:
+                await client.complete_ride()
+
+    async def rider(index):
+        client = AsyncMyUberClient(target, insecure=not args.tls, channel_pool=pool)
+        start = time.perf_counter()
+        response = await client.request_ride(f"pool-rider-{index}", random_point())
+        if response is None:
+            counts["errors"] += 1
+            return
+        request_latency.record(time.perf_counter() - start)
+        async for status in client.watch_ride(response.ride_id):
+            if status.status == myuber_pb2.COMPLETED:
+                ride_latency.record(time.perf_counter() - start)
+                counts["completed"] += 1
+                break
+
+    readiness = [asyncio.Event() for _ in range(args.drivers)]
+    drivers = [asyncio.ensure_future(driver(i, ready)) for i, ready in enumerate(readiness)]
+    for ready in readiness:
+        await ready.wait()
+    start = time.perf_counter()
+    riders = asyncio.gather(*(rider(i) for i in range(args.riders)))
+    try:
+        await asyncio.wait_for(riders, args.timeout)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - start
+    for task in drivers:
+        task.cancel()
+    await asyncio.gather(*drivers, return_exceptions=True)
+    await pool.close()
+    return counts, elapsed, request_latency.snapshot(), ride_latency.snapshot()
+
+def main():
+    parser = argparse.ArgumentParser(description="Client object cost with and without the shared channel pool, and "
+                                                 "one asyncio process driving many riders and drivers")
+    parser.add_argument("--objects", type=int, default=1000, help="Client objects the gateway creates")
+    parser.add_argument("--riders", type=int, default=20000, help="Concurrent asyncio riders")
+    parser.add_argument("--drivers", type=int, default=2000, help="Concurrent asyncio drivers")
+    parser.add_argument("--pool-channels", type=int, default=4, help="Channels per server in the shared pool")
+    parser.add_argument("--max-in-flight", type=int, default=512,
+                        help="Unary calls the asyncio pool lets wait for an answer at once (0: no limit)")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Longest time for the riders to finish")
+    parser.add_argument("--tls", action="store_true", help="Use TLS (needs the certificates in the working "
+                                                           "directory); plaintext otherwise")
+    parser.add_argument("--port", type=int, default=50091)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    logger.setLevel("ERROR")
+
+    server = start_server(args)
+    try:
+        run_gateway(args)
+        counts, elapsed, requests, rides = asyncio.run(run_fleet(args))
+    finally:
+        server.terminate()
+        server.wait()
+    print(f"\nasyncio fleet: {args.riders} riders, {args.drivers} drivers, {args.pool_channels} channels, one process")
+    print(f"completed {counts['completed']} rides in {elapsed:.1f}s ({counts['completed'] / elapsed:.0f}/s), "
+          f"{counts['errors']} errors")
+    print(f"RequestRide ms: p50 {requests['p50'] * 1000:.1f}  p99 {requests['p99'] * 1000:.1f}; "
+          f"request to COMPLETED ms: p50 {rides['p50'] * 1000:.0f}  p99 {rides['p99'] * 1000:.0f}")
+    print(f"client peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+import argparse
+import heapq
+import queue
+import random
+import threading
+import time
+from myuber_dispatcher import Dispatcher
+from myuber_metrics import LatencyHistogram
+from myuber_server import DriverManager
+
+class DriverReleaser:
+    def __init__(self, release):
+        # Single thread that hands drivers back once their simulated trip is over
+        self.release = release
+        self.heap = []
+        self.condition = threading.Condition()
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def schedule(self, driver_id, delay):
+        with self.condition:
+            heapq.heappush(self.heap, (time.monotonic() + delay, driver_id))
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.heap:
+                    self.condition.wait()
+                due, driver_id = self.heap[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self.condition.wait(wait)
+                    continue
+                heapq.heappop(self.heap)
+            self.release(driver_id)
+
+def run_legacy(args, latency):
+    # The original allocator: one ride at a time, sleeping 1 s while no driver is free
+    driver_manager = DriverManager()
+    ride_queue = queue.Queue()
+    releaser = DriverReleaser(driver_manager.add_available_driver)
+    done = threading.Semaphore(0)
+
+    def allocate_rides():
+        while True:
+            ride_id, enqueued_at = ride_queue.get()
+            while True:
+                driver_id = driver_manager.assign_driver()
+                if driver_id:
+                    latency.record(time.monotonic() - enqueued_at)
+                    releaser.schedule(driver_id, random.expovariate(1.0 / args.trip_time))
+                    done.release()
+                    break
+                time.sleep(1)
+
+    thread = threading.Thread(target=allocate_rides)
+    thread.daemon = True
+    thread.start()
+    return driver_manager.add_available_driver, lambda ride_id: ride_queue.put((ride_id, time.monotonic())), done
+
+def run_event_driven(args, latency):
+    # The event-driven allocator used by MyUberServicer
+    dispatcher = Dispatcher(DriverManager())
+    dispatcher.assignment_latency = latency
+    releaser = DriverReleaser(dispatcher.add_driver)
+    done = threading.Semaphore(0)
+
+    def allocate_rides():
+        while True:
+            for _, driver_id in dispatcher.next_batch():
+                releaser.schedule(driver_id, random.expovariate(1.0 / args.trip_time))
+                done.release()
+
+    thread = threading.Thread(target=allocate_rides)
+    thread.daemon = True
+    thread.start()
+    return dispatcher.add_driver, dispatcher.add_ride, done
+
+def simulate(name, setup, args):
+    # Feed rides at a fixed Poisson rate and wait until all of them are assigned
+    random.seed(args.seed)
+    latency = LatencyHistogram()
+    add_driver, add_ride, done = setup(args, latency)
+    for i in range(args.drivers):
+        add_driver(f"driver-{i}")
+    start = time.monotonic()
+    for i in range(args.rides):
+        add_ride(f"ride-{i}")
+        time.sleep(random.expovariate(args.rate))
+    for _ in range(args.rides):
+        done.acquire()
+    elapsed = time.monotonic() - start
+    stats = latency.snapshot()
+    print(f"{name:>13} {stats['count']:>7} {stats['p50'] * 1000:10.2f} {stats['p90'] * 1000:10.2f} "
+          f"{stats['p99'] * 1000:10.2f} {stats['max'] * 1000:10.2f} {elapsed:9.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Request-to-assignment latency of the ride allocators")
+    parser.add_argument("--rides", type=int, default=400)
+    parser.add_argument("--drivers", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=100.0, help="Ride arrivals per second")
+    parser.add_argument("--trip-time", type=float, default=0.2, help="Mean seconds a driver stays busy")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'allocator':>13} {'rides':>7} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10} {'max ms':>10} {'elapsed s':>9}")
+    simulate("legacy", run_legacy, args)
+    simulate("event-driven", run_event_driven, args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+import argparse
+import queue
+import random
+import threading
+import time
+import myuber_pb2
+from bench_ride_state import Aborted, BenchContext
+from myuber_logger import logger
+from myuber_metrics import LatencyHistogram
+from myuber_server import MyUberServicer
+
+def run(args, lease):
+    # Drivers answer offers until part of them silently goes away at --fail-at; returns the outcome
+    servicer = MyUberServicer(acceptance_timeout=args.acceptance_timeout, driver_lease=lease)
+    rng = random.Random(args.seed)
+    drivers = [f"presence-driver-{i}" for i in range(args.drivers)]
+    servicer.RegisterDrivers(myuber_pb2.RegisterDriversRequest(
+        drivers=[myuber_pb2.DriverRegistrationRequest(driver_id=driver_id) for driver_id in drivers]), BenchContext())
+    dead = set(rng.sample(drivers, int(args.drivers * args.dead_fraction)))
+    start = time.monotonic()
+    failed = threading.Event()
+    stop = threading.Event()
+    requested_at = {}
+    accept_latency = LatencyHistogram()
+    counts = {"offers": 0, "offers_to_dead": 0, "accepted": 0}
+    lock = threading.Lock()
+
+    def count(name):
+        with lock:
+            counts[name] += 1
+
+    def driver(driver_id):
+        # Accept every offer after a short think time; dead drivers stop answering at --fail-at
+        subscriber = servicer.events.subscribe(("driver", driver_id))
+        driver_rng = random.Random(driver_id)
+        context = BenchContext()
+        while not stop.is_set():
+            try:
+                assignment = subscriber.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if assignment.status != myuber_pb2.DRIVER_ASSIGNED:
+                continue
+            count("offers")
+            if driver_id in dead and failed.is_set():
+                count("offers_to_dead")
+                continue
+            time.sleep(driver_rng.uniform(0, args.think_time))
+            try:
+                servicer.AcceptRide(myuber_pb2.AcceptRideRequest(ride_id=assignment.ride_id, driver_id=driver_id),
+                                    context)
+            except Aborted:
+                continue
+            accept_latency.record(time.monotonic() - requested_at[assignment.ride_id])
+            count("accepted")
+            time.sleep(driver_rng.expovariate(1.0 / args.trip_time))
+            servicer.CompleteRide(myuber_pb2.RideCompletionRequest(ride_id=assignment.ride_id, driver_id=driver_id),
+                                  context)
+
+    def heartbeats():
+        # Every live driver renews its lease; dead drivers stop after --fail-at
+        while not stop.wait(lease / 3 if lease < args.duration else 1.0):
+            if not failed.is_set() and time.monotonic() - start >= args.fail_at:
+                failed.set()
+            for driver_id in drivers:
+                if not (failed.is_set() and driver_id in dead):
+                    servicer.Heartbeat(myuber_pb2.HeartbeatRequest(driver_id=driver_id), BenchContext())
+
+    threads = [threading.Thread(target=driver, args=(driver_id,)) for driver_id in drivers]
+    threads.append(threading.Thread(target=heartbeats))
+    for thread in threads:
+        thread.start()
+
+    # Poisson ride arrivals
+    rides = 0
+    next_arrival = start
+    while True:
+        next_arrival += rng.expovariate(args.arrival_rate)
+        if next_arrival - start > args.duration:
+            break
+        time.sleep(max(0.0, next_arrival - time.monotonic()))
+        if not failed.is_set() and time.monotonic() - start >= args.fail_at:
+            failed.set()
+        ride_time = time.monotonic()
+        response = servicer.RequestRide(myuber_pb2.RideRequest(rider_id=f"presence-rider-{rides}"), BenchContext())
+        requested_at[response.ride_id] = ride_time
+        rides += 1
+    # Give the last rides time to be accepted
+    time.sleep(args.drain)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return rides, counts, accept_latency.snapshot()
+
+def main():
+    parser = argparse.ArgumentParser(description="Offers wasted on vanished drivers and time to accept, with and "
+                                                 "without presence leases")
+    parser.add_argument("--drivers", type=int, default=100)
+    parser.add_argument("--dead-fraction", type=float, default=0.3, help="Drivers that silently go away")
+    parser.add_argument("--fail-at", type=float, default=2.0, help="Seconds into the run when they go away")
+    parser.add_argument("--arrival-rate", type=float, default=20.0, help="Ride requests per second")
+    parser.add_argument("--duration", type=float, default=15.0, help="Seconds of ride arrivals")
+    parser.add_argument("--drain", type=float, default=5.0, help="Seconds to wait for the last rides")
+    parser.add_argument("--think-time", type=float, default=0.2, help="Maximum seconds before a driver accepts")
+    parser.add_argument("--trip-time", type=float, default=1.0, help="Mean trip duration in seconds")
+    parser.add_argument("--acceptance-timeout", type=float, default=3.0)
+    parser.add_argument("--lease", type=float, default=1.0, help="Driver lease in seconds for the leased run")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    logger.setLevel("ERROR")
+
+    print(f"{'presence':<14} {'rides':>6} {'accepted':>9} {'offers':>7} {'to dead':>8} "
+          f"{'accept p50 ms':>14} {'p90 ms':>8} {'p99 ms':>8}")
+    # A lease longer than the run never expires, which is how drivers behaved before leases
+    for label, lease in (("no expiry", args.duration * 1000), (f"lease {args.lease:g}s", args.lease)):
+        rides, counts, latency = run(args, lease)
+        print(f"{label:<14} {rides:>6} {counts['accepted']:>9} {counts['offers']:>7} {counts['offers_to_dead']:>8} "
+              f"{latency['p50'] * 1000:14.0f} {latency['p90'] * 1000:8.0f} {latency['p99'] * 1000:8.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import argparse
+import random
+import time
+from myuber_geo import GridIndex, distance_km
+
+def nearest_scan(positions, lat, lng):
+    # Linear scan over every driver
+    return min((distance_km(lat, lng, d_lat, d_lng), driver_id) for driver_id, (d_lat, d_lng) in positions.items())
+
+def main():
+    parser = argparse.ArgumentParser(description="Nearest-driver lookup: grid index vs linear scan")
+    parser.add_argument("--drivers", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--cell-size", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    # Spread drivers over a 50 x 50 km city
+    center_lat, center_lng, spread = 40.73, -73.99, 0.45
+    positions = {}
+    index = GridIndex(args.cell_size)
+    start = time.perf_counter()
+    for i in range(args.drivers):
+        lat = center_lat + random.uniform(-spread / 2, spread / 2)
+        lng = center_lng + random.uniform(-spread / 2, spread / 2)
+        positions[f"driver-{i}"] = (lat, lng)
+        index.update(f"driver-{i}", lat, lng)
+    build_time = time.perf_counter() - start
+
+    queries = [(center_lat + random.uniform(-spread / 2, spread / 2),
+                center_lng + random.uniform(-spread / 2, spread / 2)) for _ in range(args.queries)]
+
+    start = time.perf_counter()
+    grid_results = [index.nearest(lat, lng, k=1)[0] for lat, lng in queries]
+    grid_time = time.perf_counter() - start
+
+    scan_queries = queries[:max(1, args.queries // 20)]
+    start = time.perf_counter()
+    scan_results = [nearest_scan(positions, lat, lng) for lat, lng in scan_queries]
+    scan_time = time.perf_counter() - start
+
+    # Both must find a driver at the same distance
+    mismatches = sum(1 for grid, scan in zip(grid_results, scan_results) if abs(grid[0] - scan[0]) > 1e-9)
+
+    start = time.perf_counter()
+    for i in range(args.queries):
+        driver_id = f"driver-{i}"
+        lat, lng = positions[driver_id]
+        index.update(driver_id, lat + random.uniform(-0.001, 0.001), lng + random.uniform(-0.001, 0.001))
+    update_time = time.perf_counter() - start
+
+    print(f"drivers:            {args.drivers}")
+    print(f"index build:        {build_time:.2f} s")
+    print(f"grid nearest:       {grid_time / len(queries) * 1e6:10.1f} us/query")
+    print(f"linear scan:        {scan_time / len(scan_queries) * 1e6:10.1f} us/query")
+    print(f"speedup:            {(scan_time / len(scan_queries)) / (grid_time / len(queries)):10.0f}x")
+    print(f"position update:    {update_time / args.queries * 1e6:10.1f} us/update")
+    print(f"result mismatches:  {mismatches}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+from concurrent import futures
+import grpc
+import myuber_pb2
+from myuber_channels import create_channel
+from myuber_client import MyUberClient
+from myuber_driver import MyUberDriver
+from myuber_logger import logger
+from myuber_metrics import LatencyHistogram
+
+# Simulated riders and drivers are spread over this box (about 20 x 20 km)
+AREA = ((40.70, 40.88), (-74.02, -73.84))
+
+def random_location(rng):
+    (lat_low, lat_high), (lng_low, lng_high) = AREA
+    return (rng.uniform(lat_low, lat_high), rng.uniform(lng_low, lng_high))
+
+def start_server(args):
+    # Launch the server in its own process and wait until it answers
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "myuber_server.py"),
+               "--mode", args.server_mode, "--port", str(args.port), "--max-workers", str(args.max_workers),
+               "--acceptance-timeout", str(args.acceptance_timeout), "--dispatch-mode", args.dispatch_mode,
+               "--log-level", "WARNING"]
+    if not args.tls:
+        command.append("--insecure")
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    with create_channel(f"localhost:{args.port}", insecure=not args.tls) as channel:
+        grpc.channel_ready_future(channel).result(timeout=15)
+    return server
+
+def process_usage(pid):
+    # CPU seconds and peak RSS (MB) of another process, from /proc; None where unavailable
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        with open(f"/proc/{pid}/status") as f:
+            status = dict(line.split(":", 1) for line in f)
+        peak_rss = int(status["VmHWM"].split()[0]) / 1024
+        return cpu, peak_rss
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+class LoadCounters:
+    def __init__(self):
+        # Outcomes of one load process, merged across processes at the end
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.request_to_accept = LatencyHistogram()
+        self.request_ride = LatencyHistogram()
+
+    def add(self, name, value=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+def run_driver(driver, rng, args, counters, stop):
+    # Scripted driver: accept, reject or ignore each offer with the configured probabilities
+    counters.add("rpcs")
+    try:
+        for assignment in driver.watch_assignments():
+            if assignment.status != myuber_pb2.DRIVER_ASSIGNED:
+                continue
+            roll = rng.random()
+            if roll < args.accept_probability:
+                if stop.wait(rng.uniform(0, args.think_time)):
+                    return
+                counters.add("rpcs")
+                if driver.accept_ride(assignment.ride_id) is None:
+                    counters.add("rpc_errors")
+                    continue
+                counters.add("accepted_offers")
+                if stop.wait(rng.expovariate(1.0 / args.trip_time)):
+                    return
+                counters.add("rpcs")
+                if driver.complete_ride() is None:
+                    counters.add("rpc_errors")
+                else:
+                    counters.add("completed")
+            elif roll < args.accept_probability + args.reject_probability:
+                counters.add("rpcs")
+                if driver.reject_ride(assignment.ride_id) is None:
+                    counters.add("rpc_errors")
+                counters.add("rejected_offers")
+            else:
+                # Let the acceptance timeout expire
+                counters.add("ignored_offers")
+    except ValueError:
+        # The channel was closed at the end of the run while an RPC was being started
+        pass
+
+def run_rider(client, rider_id, pickup, args, counters):
+    # Request a ride and follow it until a driver accepts or the rider gives up
+    counters.add("requested")
+    start = time.perf_counter()
+    counters.add("rpcs")
+    response = client.request_ride(rider_id, pickup, max_wait=args.rider_patience)
+    if response is None:
+        counters.add("rpc_errors")
+        return
+    counters.request_ride.record(time.perf_counter() - start)
+    counters.add("rpcs")
+    for status in client.watch_ride(response.ride_id, timeout=args.rider_patience):
+        if status.status == myuber_pb2.ACCEPTED:
+            counters.request_to_accept.record(time.perf_counter() - start)
+            counters.add("served")
+            return
+        if status.status == myuber_pb2.EXPIRED:
+            break
+    counters.add("unserved")
+
+def load_process(index, args):
+    # One load process: its share of the drivers plus a Poisson stream of riders
+    logger.setLevel("CRITICAL")
+    rng = random.Random(args.seed + index)
+    target = args.target or f"localhost:{args.port}"
+    insecure = not args.tls
+    counters = LoadCounters()
+    stop = threading.Event()
+
+    drivers = []
+    for i in range(index, args.drivers, args.processes):
+        driver = MyUberDriver(f"load-driver-{i}", target, insecure)
+        counters.add("rpcs")
+        if driver.register_driver(random_location(rng)) is None:
+            counters.add("rpc_errors")
+            continue
+        drivers.append(driver)
+    driver_threads = [threading.Thread(target=run_driver, args=(driver, random.Random(rng.random()), args, counters, stop))
+                      for driver in drivers]
+    for thread in driver_threads:
+        thread.daemon = True
+        thread.start()
+
+    # Riders share a few client channels, like users behind one frontend
+    clients = [MyUberClient(target, insecure) for _ in range(args.rider_channels)]
+    rate = args.arrival_rate / args.processes
+    riders = futures.ThreadPoolExecutor(max_workers=args.max_riders)
+    load_start = time.monotonic()
+    next_arrival = load_start
+    count = 0
+    while True:
+        next_arrival += rng.expovariate(rate)
+        if next_arrival - load_start > args.duration:
+            break
+        time.sleep(max(0.0, next_arrival - time.monotonic()))
+        riders.submit(run_rider, clients[count % len(clients)], f"load-rider-{index}-{count}",
+                      random_location(rng), args, counters)
+        count += 1
+    riders.shutdown(wait=True)
+    elapsed = time.monotonic() - load_start
+
+    stop.set()
+    for driver in drivers:
+        driver.close()
+    for client in clients:
+        client.close()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        "counts": counters.counts,
+        "request_to_accept": counters.request_to_accept,
+        "request_ride": counters.request_ride,
+        "elapsed": elapsed,
+        "cpu_seconds": usage.ru_utime + usage.ru_stime,
+        "peak_rss_mb": usage.ru_maxrss / 1024,
+    }
+
+def milliseconds(snapshot):
+    # Latency summary in milliseconds, for the report
+    return {key: (value * 1000 if key != "count" else value) for key, value in snapshot.items()}
+
+def server_stats(args):
+    # Total server-side RPC calls per method, from GetStats
+    client = MyUberClient(args.target or f"localhost:{args.port}", not args.tls)
+    stats = client.get_stats()
+    client.close()
+    if stats is None:
+        return {}
+    return {method.method: method.calls for method in stats.methods}
+
+def run(args):
+    server = None if args.target else start_server(args)
+    try:
+        calls_before = server_stats(args)
+        cpu_before = process_usage(server.pid)[0] if server else None
+        with multiprocessing.Pool(args.processes) as pool:
+            results = pool.starmap(load_process, [(i, args) for i in range(args.processes)])
+        cpu_after, server_rss = process_usage(server.pid) if server else (None, None)
+        calls_after = server_stats(args)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    counts = {}
+    request_to_accept = LatencyHistogram()
+    request_ride = LatencyHistogram()
+    for result in results:
+        for name, value in result["counts"].items():
+            counts[name] = counts.get(name, 0) + value
+        request_to_accept.merge(result["request_to_accept"])
+        request_ride.merge(result["request_ride"])
+    elapsed = max(result["elapsed"] for result in results)
+    server_calls = {method: calls - calls_before.get(method, 0) for method, calls in calls_after.items()}
+    server_cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+    return {
+        "config": vars(args),
+        "duration_seconds": elapsed,
+        "riders": {name: counts.get(name, 0) for name in ("requested", "served", "unserved")},
+        "driver_actions": {name: counts.get(name, 0) for name in
+                           ("accepted_offers", "rejected_offers", "ignored_offers", "completed")},
+        "request_to_accept_ms": milliseconds(request_to_accept.snapshot()),
+        "request_ride_ms": milliseconds(request_ride.snapshot()),
+        "rpc": {
+            "client_calls": counts.get("rpcs", 0),
+            "client_errors": counts.get("rpc_errors", 0),
+            "server_calls": server_calls,
+            "server_calls_per_second": sum(server_calls.values()) / elapsed,
+        },
+        "cpu": {
+            "server_seconds": server_cpu,
+            "server_utilization": server_cpu / elapsed if server_cpu is not None else None,
+            "client_seconds": sum(result["cpu_seconds"] for result in results),
+        },
+        "memory": {
+            "server_peak_rss_mb": server_rss,
+            "client_peak_rss_mb": max(result["peak_rss_mb"] for result in results),
+        },
+    }
+
+def print_report(report):
+    riders = report["riders"]
+    latency = report["request_to_accept_ms"]
+    print(f"riders: {riders['requested']} requested, {riders['served']} accepted, {riders['unserved']} gave up")
+    print("driver actions: " + ", ".join(f"{name} {count}" for name, count in report["driver_actions"].items()))
+    print(f"RequestRide -> ACCEPTED ms: p50 {latency['p50']:.1f}  p90 {latency['p90']:.1f}  "
+          f"p99 {latency['p99']:.1f}  max {latency['max']:.1f}")
+    print(f"RequestRide RPC ms: p50 {report['request_ride_ms']['p50']:.2f}  p99 {report['request_ride_ms']['p99']:.2f}")
+    rpc = report["rpc"]
+    print(f"RPCs: {rpc['client_calls']} client calls, {rpc['client_errors']} errors, "
+          f"{rpc['server_calls_per_second']:.0f} server calls/s")
+    cpu, memory = report["cpu"], report["memory"]
+    if cpu["server_seconds"] is not None:
+        print(f"server: {cpu['server_seconds']:.1f} CPU s ({cpu['server_utilization'] * 100:.0f}% of one core), "
+              f"peak RSS {memory['server_peak_rss_mb']:.0f} MB")
+    print(f"load generators: {cpu['client_seconds']:.1f} CPU s, peak RSS {memory['client_peak_rss_mb']:.0f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate riders and drivers against a MyUber server")
+    parser.add_argument("--drivers", type=int, default=200)
+    parser.add_argument("--arrival-rate", type=float, default=20.0, help="Ride requests per second, Poisson arrivals")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of rider arrivals")
+    parser.add_argument("--accept-probability", type=float, default=0.8)
+    parser.add_argument("--reject-probability", type=float, default=0.1,
+                        help="The remaining offers are ignored and hit the acceptance timeout")
+    parser.add_argument("--think-time", type=float, default=0.5, help="Maximum seconds before a driver answers")
+    parser.add_argument("--trip-time", type=float, default=5.0, help="Mean trip duration in seconds")
+    parser.add_argument("--rider-patience", type=float, default=30.0, help="Seconds a rider waits for a driver")
+    parser.add_argument("--max-riders", type=int, default=1000, help="Concurrent riders per load process")
+    parser.add_argument("--rider-channels", type=int, default=4, help="Client channels shared by riders per process")
+    parser.add_argument("--processes", type=int, default=1, help="Load generator processes")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--target", help="Use a running server instead of starting one")
+    parser.add_argument("--tls", action="store_true",
+                        help="Use mutual TLS (certificates in the current directory) instead of plaintext")
+    parser.add_argument("--server-mode", choices=["threaded", "asyncio"], default="asyncio")
+    parser.add_argument("--max-workers", type=int, default=1000,
+                        help="Threaded mode pool size; every driver and waiting rider holds a stream")
+    parser.add_argument("--acceptance-timeout", type=float, default=2.0)
+    parser.add_argument("--dispatch-mode", choices=["greedy", "batch"], default="greedy")
+    parser.add_argument("--port", type=int, default=50062)
+    parser.add_argument("--json", help="Write the results as JSON to this file ('-' for stdout)")
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+    if args.json == "-":
+        print(json.dumps(report, indent=2))
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
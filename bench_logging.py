@@ -0,0 +1,75 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+import myuber_pb2
+from myuber_interceptors import log_under_method
+from myuber_logger import configure_logging, dropped_log_records, flush_logging, logger
+from myuber_metrics import LatencyHistogram
+from myuber_server import MyUberServicer
+
+METHOD = "/myuber.RideSharing/GetRideStatus"
+
+CONFIGURATIONS = [
+    # (label, configure_logging keyword arguments)
+    ("sync", {"mode": "sync"}),
+    ("async", {"mode": "async"}),
+    ("async json", {"mode": "async", "structured": True}),
+    ("async sampled 1%", {"mode": "async", "sample_rates": {METHOD: 0.01}}),
+    ("async 1000/s limit", {"mode": "async", "rate_limit": 1000}),
+]
+
+def run(servicer, ride_ids, calls, threads):
+    # Call GetRideStatus the way the logging interceptor would and record per-call latency
+    handler = log_under_method(servicer.GetRideStatus, METHOD)
+    histogram = LatencyHistogram()
+    per_thread = calls // threads
+
+    def worker(index):
+        local = LatencyHistogram()
+        for i in range(per_thread):
+            request = myuber_pb2.RideStatusRequest(ride_id=ride_ids[(index + i) % len(ride_ids)])
+            start = time.perf_counter()
+            logger.info("Received request: %s", METHOD, extra={"method": METHOD})
+            handler(request, None)
+            local.record(time.perf_counter() - start)
+        histogram.merge(local)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads / elapsed, histogram.snapshot()
+
+def main():
+    parser = argparse.ArgumentParser(description="GetRideStatus handler latency under each logging configuration")
+    parser.add_argument("--calls", type=int, default=100000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--rides", type=int, default=1000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="myuber-log-")
+    # Console output goes to /dev/null so the terminal does not become the bottleneck
+    devnull = open(os.devnull, "w")
+    configure_logging(log_file=os.path.join(directory, "setup.log"), stream=devnull)
+    servicer = MyUberServicer()
+    ride_ids = [servicer.RequestRide(myuber_pb2.RideRequest(rider_id=f"rider-{i}"), None).ride_id
+                for i in range(args.rides)]
+    print(f"{'logging':>20} {'calls/s':>10} {'mean us':>9} {'p50 us':>8} {'p99 us':>8} {'max us':>9} {'log MB':>7} {'dropped':>8}")
+    for label, options in CONFIGURATIONS:
+        log_file = os.path.join(directory, label.replace(" ", "_").replace("/", "_") + ".log")
+        configure_logging(log_file=log_file, stream=devnull, **options)
+        rate, stats = run(servicer, ride_ids, args.calls, args.threads)
+        flush_logging()
+        dropped = dropped_log_records()
+        size = os.path.getsize(log_file) / 1e6
+        print(f"{label:>20} {rate:10.0f} {stats['mean'] * 1e6:9.1f} {stats['p50'] * 1e6:8.1f} "
+              f"{stats['p99'] * 1e6:8.1f} {stats['max'] * 1e6:9.0f} {size:7.1f} {dropped:8}")
+    configure_logging(mode="sync", log_file=os.path.join(directory, "done.log"), stream=devnull)
+
+if __name__ == '__main__':
+    main()
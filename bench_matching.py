@@ -0,0 +1,124 @@
+import argparse
+import heapq
+import random
+import time
+from myuber_geo import distance_km
+from myuber_matching import build_cost_matrix, solve_assignment
+from myuber_server import DriverManager
+
+# Simulated city: a square of about 10 x 10 km
+CENTER_LAT, CENTER_LNG, SPREAD = 40.73, -73.99, 0.09
+
+def random_point(rng):
+    return (CENTER_LAT + rng.uniform(-SPREAD / 2, SPREAD / 2),
+            CENTER_LNG + rng.uniform(-SPREAD / 2, SPREAD / 2))
+
+def match_greedy(driver_manager, pending, now):
+    # Current path: rides in arrival order each take the nearest free driver
+    pairs = []
+    while pending:
+        ride = pending[0]
+        driver_id = driver_manager.assign_driver(ride["pickup"])
+        if driver_id is None:
+            break
+        pending.pop(0)
+        pairs.append((ride, driver_id))
+    return pairs
+
+def match_batch(driver_manager, pending, now, wait_penalty, max_optimal_batch):
+    # Batch path: one cost matrix over every pending ride and free driver
+    drivers = driver_manager.available_driver_locations()
+    if not pending or not drivers:
+        return []
+    cost = build_cost_matrix([ride["pickup"] for ride in pending], [location for _, location in drivers],
+                             [now - ride["requested_at"] for ride in pending], wait_penalty=wait_penalty)
+    pairs = []
+    matched = set()
+    for ride_index, driver_index in solve_assignment(cost, max_optimal_batch):
+        driver_id = drivers[driver_index][0]
+        driver_manager.take_driver(driver_id)
+        matched.add(ride_index)
+        pairs.append((pending[ride_index], driver_id))
+    pending[:] = [ride for index, ride in enumerate(pending) if index not in matched]
+    return pairs
+
+def simulate(name, args, batch):
+    # Discrete-event simulation in simulated seconds; matching cost is measured in wall time
+    rng = random.Random(args.seed)
+    driver_manager = DriverManager()
+    for i in range(args.drivers):
+        driver_manager.register_driver(f"driver-{i}", random_point(rng))
+
+    events = []  # (time, sequence, kind, payload)
+    sequence = 0
+    t = 0.0
+    total_rides = 0
+    while t < args.duration:
+        # Demand spike: arrivals at `rate` rides/s
+        t += rng.expovariate(args.rate)
+        events.append((t, sequence, "ride", {"pickup": random_point(rng), "requested_at": t}))
+        sequence += 1
+        total_rides += 1
+    if batch:
+        tick = args.window
+        while tick < args.duration * 3:
+            events.append((tick, sequence, "tick", None))
+            sequence += 1
+            tick += args.window
+    heapq.heapify(events)
+
+    pending = []
+    pickup_distances = []
+    waits = []
+    match_time = 0.0
+    while events and len(pickup_distances) < total_rides:
+        now, _, kind, payload = heapq.heappop(events)
+        if kind == "ride":
+            pending.append(payload)
+        elif kind == "release":
+            driver_id, location = payload
+            driver_manager.update_location(driver_id, *location)
+            driver_manager.add_available_driver(driver_id)
+        if batch and kind != "tick":
+            continue
+        start = time.perf_counter()
+        if batch:
+            pairs = match_batch(driver_manager, pending, now, args.wait_penalty, args.max_optimal_batch)
+        else:
+            pairs = match_greedy(driver_manager, pending, now)
+        match_time += time.perf_counter() - start
+        for ride, driver_id in pairs:
+            location = driver_manager.driver_locations[driver_id]
+            distance = distance_km(location[0], location[1], *ride["pickup"])
+            pickup_distances.append(distance)
+            waits.append(now - ride["requested_at"])
+            # Drive to the pickup, do the trip, reappear somewhere else
+            busy = distance / args.speed * 3600 + rng.expovariate(1.0 / args.trip_time)
+            heapq.heappush(events, (now + busy, sequence, "release", (driver_id, random_point(rng))))
+            sequence += 1
+
+    waits.sort()
+    assigned = len(pickup_distances)
+    print(f"{name:>8} {assigned:>9} {sum(pickup_distances) / max(1, assigned):12.3f} "
+          f"{sum(waits) / max(1, assigned):10.2f} {waits[int(len(waits) * 0.99)] if waits else 0:10.2f} "
+          f"{assigned / max(match_time, 1e-9):14.0f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Pickup distance and matching throughput, greedy FIFO vs batch")
+    parser.add_argument("--drivers", type=int, default=300)
+    parser.add_argument("--rate", type=float, default=60.0, help="Ride arrivals per simulated second")
+    parser.add_argument("--duration", type=float, default=30.0, help="Simulated seconds of arrivals")
+    parser.add_argument("--trip-time", type=float, default=5.0, help="Mean simulated trip seconds")
+    parser.add_argument("--speed", type=float, default=3600.0, help="Simulated km/h, scaled with trip time")
+    parser.add_argument("--window", type=float, default=0.2, help="Batch window in simulated seconds")
+    parser.add_argument("--wait-penalty", type=float, default=0.1)
+    parser.add_argument("--max-optimal-batch", type=int, default=400)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'mode':>8} {'assigned':>9} {'pickup km':>12} {'wait s':>10} {'p99 wait':>10} {'assignments/s':>14}")
+    simulate("greedy", args, batch=False)
+    simulate("batch", args, batch=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+import argparse
+import shutil
+import tempfile
+import threading
+import time
+import myuber_pb2
+from myuber_logger import logger
+from myuber_persistence import RideJournal
+from myuber_server import MyUberServicer
+
+def request_rides(servicer, total, threads):
+    # Call RequestRide from several threads, like concurrent RPC workers, and return rides/s
+    per_thread = total // threads
+
+    def worker(index):
+        for i in range(per_thread):
+            servicer.RequestRide(myuber_pb2.RideRequest(rider_id=f"rider-{index}-{i}"), None)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return per_thread * threads / (time.perf_counter() - start)
+
+def measure_throughput(args):
+    print(f"{'persistence':>22} {'RequestRide/s':>14}")
+    # No drivers register, so every ride stays pending; admission control would shed most of them
+    rate = request_rides(MyUberServicer(max_pending_rides=0), args.requests, args.threads)
+    print(f"{'off':>22} {rate:14.0f}")
+    for name, group_commit in (("fsync per record", False), ("group commit", True)):
+        directory = tempfile.mkdtemp(prefix="myuber-wal-")
+        try:
+            journal = RideJournal(directory, group_commit=group_commit, snapshot_every=10 ** 9)
+            rate = request_rides(MyUberServicer(journal=journal, max_pending_rides=0), args.requests, args.threads)
+            journal.close()
+        finally:
+            shutil.rmtree(directory)
+        print(f"{name:>22} {rate:14.0f}")
+
+def measure_restart(args):
+    # Fill a journal, then time how long a new server takes to recover from it
+    print(f"\n{'restart from':>22} {'rides':>10} {'seconds':>9}")
+    for with_snapshot in (False, True):
+        directory = tempfile.mkdtemp(prefix="myuber-wal-")
+        try:
+            journal = RideJournal(directory, snapshot_every=10 ** 9)
+            servicer = MyUberServicer(journal=journal, max_pending_rides=0)
+            request_rides(servicer, args.rides, args.threads)
+            # Churn: every ride is rewritten a few times, as assignment, reject and accept would
+            with servicer.rides.lock:
+                ride_ids = list(servicer.rides.active)
+            for _ in range(args.churn):
+                for ride_id in ride_ids:
+                    servicer.log_transition("Churn", ride_id)
+            journal.wait_durable(journal.last_lsn)
+            if with_snapshot:
+                journal.snapshot()
+            journal.close()
+
+            start = time.perf_counter()
+            recovered = MyUberServicer(journal=RideJournal(directory))
+            elapsed = time.perf_counter() - start
+            recovered.journal.close()
+        finally:
+            shutil.rmtree(directory)
+        label = "snapshot + log tail" if with_snapshot else "full log"
+        print(f"{label:>22} {len(recovered.rides):>10} {elapsed:9.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="RequestRide throughput and restart time with the write-ahead log")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--rides", type=int, default=100000, help="Rides in the journal for the restart test")
+    parser.add_argument("--churn", type=int, default=3, help="Extra log records per ride for the restart test")
+    args = parser.parse_args()
+    logger.setLevel("WARNING")
+    measure_throughput(args)
+    measure_restart(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+import argparse
+import queue
+import random
+import threading
+import time
+import myuber_pb2
+from bench_ride_state import Aborted, BenchContext
+from myuber_logger import logger
+from myuber_metrics import LatencyHistogram
+from myuber_server import MyUberServicer
+
+# Simulated city: a square of about 10 x 10 km
+CENTER_LAT, CENTER_LNG, SPREAD = 40.73, -73.99, 0.09
+
+class FifoServicer(MyUberServicer):
+    # Dispatch as before priorities: a declined ride goes to the back of the queue as if it were new,
+    # and may be offered straight back to the driver who declined it
+    def requeue_ride(self, ride_id, ride):
+        self.dispatcher.add_ride(ride_id, ride.pickup, ride.deadline)
+
+def random_point(rng):
+    return (CENTER_LAT + rng.uniform(-SPREAD / 2, SPREAD / 2), CENTER_LNG + rng.uniform(-SPREAD / 2, SPREAD / 2))
+
+def run(args, servicer_class):
+    # Riders arrive at --arrival-rate; picky drivers decline most offers, the others a few, and some
+    # offers are ignored until the acceptance timeout. Returns the wait of every accepted ride.
+    servicer = servicer_class(acceptance_timeout=args.acceptance_timeout, max_pending_rides=0, max_ride_wait=0,
+                              requeue_boost=args.requeue_boost, decline_cooldown=args.decline_cooldown)
+    rng = random.Random(args.seed)
+    drivers = [f"priority-driver-{i}" for i in range(args.drivers)]
+    picky = set(rng.sample(drivers, int(args.drivers * args.picky_fraction)))
+    request = myuber_pb2.RegisterDriversRequest()
+    for driver_id in drivers:
+        registration = request.drivers.add(driver_id=driver_id)
+        registration.location.latitude, registration.location.longitude = random_point(rng)
+    servicer.RegisterDrivers(request, BenchContext())
+    stop = threading.Event()
+    requested_at = {}
+    declined_by = {}  # ride_id -> drivers who declined or ignored it
+    waits = []
+    counts = {"offers": 0, "repeat_offers": 0}
+    lock = threading.Lock()
+
+    def driver(driver_id):
+        subscriber = servicer.events.subscribe(("driver", driver_id))
+        driver_rng = random.Random(driver_id)
+        reject_probability = args.picky_reject if driver_id in picky else args.reject_probability
+        context = BenchContext()
+        while not stop.is_set():
+            try:
+                assignment = subscriber.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if assignment.status != myuber_pb2.DRIVER_ASSIGNED:
+                continue
+            ride_id = assignment.ride_id
+            with lock:
+                counts["offers"] += 1
+                if driver_id in declined_by.get(ride_id, ()):
+                    counts["repeat_offers"] += 1
+            time.sleep(driver_rng.uniform(0, args.think_time))
+            choice = driver_rng.random()
+            if choice < args.ignore_probability:
+                # Let the acceptance timeout take the ride back
+                with lock:
+                    declined_by.setdefault(ride_id, set()).add(driver_id)
+                continue
+            if choice < args.ignore_probability + reject_probability:
+                with lock:
+                    declined_by.setdefault(ride_id, set()).add(driver_id)
+                try:
+                    servicer.RejectRide(myuber_pb2.RejectRideRequest(ride_id=ride_id, driver_id=driver_id), context)
+                except Aborted:
+                    pass
+                continue
+            try:
+                servicer.AcceptRide(myuber_pb2.AcceptRideRequest(ride_id=ride_id, driver_id=driver_id), context)
+            except Aborted:
+                continue
+            with lock:
+                waits.append((time.monotonic() - requested_at[ride_id], ride_id in declined_by))
+            time.sleep(driver_rng.expovariate(1.0 / args.trip_time))
+            servicer.CompleteRide(myuber_pb2.RideCompletionRequest(ride_id=ride_id, driver_id=driver_id), context)
+
+    threads = [threading.Thread(target=driver, args=(driver_id,)) for driver_id in drivers]
+    for thread in threads:
+        thread.start()
+
+    # Poisson ride arrivals
+    rides = 0
+    start = time.monotonic()
+    next_arrival = start
+    while True:
+        next_arrival += rng.expovariate(args.arrival_rate)
+        if next_arrival - start > args.duration:
+            break
+        time.sleep(max(0.0, next_arrival - time.monotonic()))
+        ride_request = myuber_pb2.RideRequest(rider_id=f"priority-rider-{rides}")
+        ride_request.pickup.latitude, ride_request.pickup.longitude = random_point(rng)
+        ride_time = time.monotonic()
+        response = servicer.RequestRide(ride_request, BenchContext())
+        with lock:
+            requested_at[response.ride_id] = ride_time
+        rides += 1
+    # Give the last rides time to be accepted
+    deadline = time.monotonic() + args.drain
+    while len(waits) < rides and time.monotonic() < deadline:
+        time.sleep(0.1)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    servicer.timeout_scheduler.close()
+    return rides, counts, waits
+
+def main():
+    parser = argparse.ArgumentParser(description="Rider wait until a driver accepts, FIFO re-queueing vs priority "
+                                                 "dispatch with aging and declined-driver exclusion")
+    parser.add_argument("--drivers", type=int, default=40)
+    parser.add_argument("--picky-fraction", type=float, default=0.25, help="Drivers who decline most offers")
+    parser.add_argument("--picky-reject", type=float, default=0.8, help="Probability a picky driver declines")
+    parser.add_argument("--reject-probability", type=float, default=0.05,
+                        help="Probability any other driver declines")
+    parser.add_argument("--ignore-probability", type=float, default=0.03,
+                        help="Probability a driver lets the offer time out")
+    parser.add_argument("--arrival-rate", type=float, default=20.0, help="Ride requests per second")
+    parser.add_argument("--duration", type=float, default=15.0, help="Seconds of ride arrivals")
+    parser.add_argument("--drain", type=float, default=30.0, help="Longest wait for the last rides, in seconds")
+    parser.add_argument("--think-time", type=float, default=0.3, help="Maximum seconds before a driver answers")
+    parser.add_argument("--trip-time", type=float, default=1.0, help="Mean trip duration in seconds")
+    parser.add_argument("--acceptance-timeout", type=float, default=2.0)
+    parser.add_argument("--requeue-boost", type=float, default=10.0)
+    parser.add_argument("--decline-cooldown", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    logger.setLevel("ERROR")
+
+    print(f"{'dispatch':<10} {'rides':>6} {'served':>7} {'offers':>7} {'repeats':>8} "
+          f"{'wait p50 ms':>12} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} {'declined p99 ms':>16}")
+    for label, servicer_class in (("fifo", FifoServicer), ("priority", MyUberServicer)):
+        rides, counts, waits = run(args, servicer_class)
+        latency = LatencyHistogram()
+        declined_latency = LatencyHistogram()
+        for wait, declined in waits:
+            latency.record(wait)
+            if declined:
+                declined_latency.record(wait)
+        snapshot = latency.snapshot()
+        longest = max((wait for wait, _ in waits), default=0.0)
+        print(f"{label:<10} {rides:>6} {len(waits):>7} {counts['offers']:>7} {counts['repeat_offers']:>8} "
+              f"{snapshot['p50'] * 1000:12.0f} {snapshot['p90'] * 1000:8.0f} {snapshot['p99'] * 1000:8.0f} "
+              f"{longest * 1000:8.0f} {declined_latency.snapshot()['p99'] * 1000:16.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+import argparse
+import gc
+import random
+import tracemalloc
+import uuid
+from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+import myuber_pb2
+from myuber_pb2 import ACCEPTED, DRIVER_ASSIGNED, PENDING
+from myuber_ride_store import Ride, RideStore
+
+def legacy_ride(i, args, rng):
+    # A ride as the server stored it before: UUID string key and a dict with string fields.
+    # IDs are built per ride, as parsing every request creates new string objects.
+    ride_id = str(uuid.uuid4())
+    return ride_id, {
+        "status": "ACCEPTED",
+        "rider_id": f"rider-{rng.randrange(args.riders)}",
+        "driver_id": f"driver-{rng.randrange(args.drivers)}",
+        "pickup": (rng.uniform(40.70, 40.88), rng.uniform(-74.02, -73.84)),
+    }
+
+def compact_ride(i, args, rng):
+    # The same ride as a slotted Ride record with a 16-byte key
+    return uuid.uuid4().bytes, Ride(f"rider-{rng.randrange(args.riders)}",
+                                    (rng.uniform(40.70, 40.88), rng.uniform(-74.02, -73.84)),
+                                    ACCEPTED, f"driver-{rng.randrange(args.drivers)}")
+
+def fill_dict(build, args):
+    rng = random.Random(args.seed)
+    rides = {}
+    for i in range(args.rides):
+        ride_id, ride = build(i, args, rng)
+        rides[ride_id] = ride
+    return rides
+
+def fill_store(build, args):
+    # Active rides in a RideStore, so the driver index is included
+    rng = random.Random(args.seed)
+    store = RideStore(finished_ttl=None, max_finished=None)
+    store.add_many(build(i, args, rng) for i in range(args.rides))
+    return store
+
+def bytes_per_ride(fill, build, args):
+    # Python heap allocated while building the rides, per ride
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    rides = fill(build, args)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del rides
+    gc.collect()
+    return (after - before) / args.rides
+
+def legacy_messages():
+    # Message classes with the old string ride_id and string status fields, built at runtime
+    # so the comparison does not need the old generated code
+    file_proto = descriptor_pb2.FileDescriptorProto(name="myuber_legacy.proto", package="myuber_legacy",
+                                                    syntax="proto3")
+    string = descriptor_pb2.FieldDescriptorProto.TYPE_STRING
+    optional = descriptor_pb2.FieldDescriptorProto.LABEL_OPTIONAL
+    for name, fields in (("RideStatusResponse", ("ride_id", "status", "driver_id")),
+                         ("RideAssignment", ("ride_id", "status")),
+                         ("AcceptRideRequest", ("ride_id", "driver_id"))):
+        message = file_proto.message_type.add(name=name)
+        for number, field in enumerate(fields, 1):
+            message.field.add(name=field, number=number, type=string, label=optional)
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(file_proto)
+    return {name: message_factory.GetMessageClass(pool.FindMessageTypeByName(f"myuber_legacy.{name}"))
+            for name in ("RideStatusResponse", "RideAssignment", "AcceptRideRequest")}
+
+def wire_sizes():
+    # Serialized size of typical messages, old string encoding vs bytes IDs and enum statuses
+    legacy = legacy_messages()
+    ride_id = uuid.uuid4()
+    rows = []
+    for label, status in (("RideStatusResponse (PENDING)", PENDING), ("RideStatusResponse (ACCEPTED)", ACCEPTED)):
+        driver_id = "driver-1234" if status == ACCEPTED else ""
+        old = legacy["RideStatusResponse"](ride_id=str(ride_id), status=myuber_pb2.RideStatus.Name(status),
+                                           driver_id=driver_id)
+        new = myuber_pb2.RideStatusResponse(ride_id=ride_id.bytes, status=status, driver_id=driver_id)
+        rows.append((label, old.ByteSize(), new.ByteSize()))
+    old = legacy["RideAssignment"](ride_id=str(ride_id), status="DRIVER_ASSIGNED")
+    new = myuber_pb2.RideAssignment(ride_id=ride_id.bytes, status=DRIVER_ASSIGNED)
+    rows.append(("RideAssignment", old.ByteSize(), new.ByteSize()))
+    old = legacy["AcceptRideRequest"](ride_id=str(ride_id), driver_id="driver-1234")
+    new = myuber_pb2.AcceptRideRequest(ride_id=ride_id.bytes, driver_id="driver-1234")
+    rows.append(("AcceptRideRequest", old.ByteSize(), new.ByteSize()))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory per ride and message sizes, old vs compact ride records")
+    parser.add_argument("--rides", type=int, default=1000000)
+    parser.add_argument("--riders", type=int, default=200000, help="Distinct riders the rides are spread over")
+    parser.add_argument("--drivers", type=int, default=20000, help="Distinct drivers the rides are spread over")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{args.rides} rides, {args.riders} riders, {args.drivers} drivers")
+    print(f"{'layout':<36} {'bytes/ride':>11}")
+    legacy = bytes_per_ride(fill_dict, legacy_ride, args)
+    print(f"{'dict records, UUID string keys':<36} {legacy:11.0f}")
+    compact = bytes_per_ride(fill_dict, compact_ride, args)
+    print(f"{'Ride records, 16-byte keys':<36} {compact:11.0f}  ({compact / legacy:.0%})")
+    store = bytes_per_ride(fill_store, compact_ride, args)
+    print(f"{'RideStore with driver index':<36} {store:11.0f}")
+
+    print(f"\n{'message':<32} {'old bytes':>10} {'new bytes':>10}")
+    for label, old, new in wire_sizes():
+        print(f"{label:<32} {old:>10} {new:>10}")
+
+if __name__ == '__main__':
+    main()
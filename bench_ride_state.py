@@ -0,0 +1,125 @@
+import argparse
+import sys
+import threading
+import time
+import myuber_pb2
+from myuber_logger import logger
+from myuber_server import MAX_BATCH_SIZE, MyUberServicer
+
+class Aborted(Exception):
+    pass
+
+class BenchContext:
+    # Minimal servicer context: abort raises like the real one
+    def abort(self, code, details):
+        raise Aborted(code, details)
+
+    def set_trailing_metadata(self, metadata):
+        self.trailing_metadata = metadata
+
+    def time_remaining(self):
+        return None
+
+def assigned_rides(servicer, count, prefix):
+    # Register `count` drivers, request as many rides and wait until every ride has a driver
+    servicer.driver_manager.register_drivers([(f"{prefix}-driver-{i}", None) for i in range(count)])
+    servicer.dispatcher.notify()
+    ride_ids = []
+    for first in range(0, count, MAX_BATCH_SIZE):
+        response = servicer.RequestRides(myuber_pb2.RequestRidesRequest(
+            requests=[myuber_pb2.RideRequest(rider_id=f"{prefix}-rider-{i}")
+                      for i in range(first, min(count, first + MAX_BATCH_SIZE))]), BenchContext())
+        ride_ids.extend(ride.ride_id for ride in response.rides)
+    while any(servicer.rides[ride_id].status != myuber_pb2.DRIVER_ASSIGNED for ride_id in ride_ids):
+        time.sleep(0.01)
+    return [(ride_id, servicer.rides[ride_id].driver_id) for ride_id in ride_ids]
+
+def race(args):
+    # Fire AcceptRide and the acceptance timeout for the same ride at the same moment and
+    # check that exactly one of them wins and the driver pool stays consistent
+    servicer = MyUberServicer(acceptance_timeout=3600.0, max_pending_rides=0)
+    rides = assigned_rides(servicer, args.rides, "race")
+    accepted = {}
+    # Switch threads very often so the interleavings a multi-core server sees actually happen
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    barrier = threading.Barrier(2)
+
+    def accept(ride_id, driver_id):
+        barrier.wait()
+        try:
+            servicer.AcceptRide(myuber_pb2.AcceptRideRequest(ride_id=ride_id, driver_id=driver_id), BenchContext())
+            accepted[ride_id] = True
+        except Aborted:
+            accepted[ride_id] = False
+
+    def timeout(ride_id, driver_id):
+        barrier.wait()
+        servicer.handle_ride_timeout(ride_id, driver_id)
+
+    for ride_id, driver_id in rides:
+        threads = [threading.Thread(target=accept, args=(ride_id, driver_id)),
+                   threading.Thread(target=timeout, args=(ride_id, driver_id))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    sys.setswitchinterval(switch_interval)
+    # Let the allocator hand timed-out rides back out
+    time.sleep(0.5)
+
+    violations = 0
+    for ride_id, driver_id in rides:
+        status = servicer.rides[ride_id].status
+        if accepted[ride_id] != (status == myuber_pb2.ACCEPTED):
+            violations += 1
+    # A driver is either free or bound to exactly one active ride, never both
+    with servicer.rides.lock:
+        busy = dict(servicer.rides.driver_index)
+    available = set(servicer.driver_manager.available_drivers)
+    violations += len(available & set(busy))
+    wins = sum(accepted.values())
+    print(f"race: {len(rides)} rides, accept won {wins}, timeout won {len(rides) - wins}, "
+          f"violations {violations}")
+    return violations
+
+def throughput(args):
+    # Accept + complete cycles per second from several threads, with one lock stripe
+    # (every ride shares a lock) and with the default striping
+    print(f"\n{'stripes':>8} {'threads':>8} {'cycles/s':>10}")
+    for stripes in (1, 64):
+        for threads in (1, 2, 4, 8):
+            servicer = MyUberServicer(acceptance_timeout=3600.0, max_pending_rides=0)
+            servicer.rides.ride_locks = servicer.rides.ride_locks[:stripes]
+            rides = assigned_rides(servicer, args.cycles, f"t{stripes}-{threads}")
+            chunks = [rides[i::threads] for i in range(threads)]
+
+            def worker(chunk):
+                context = BenchContext()
+                for ride_id, driver_id in chunk:
+                    servicer.AcceptRide(myuber_pb2.AcceptRideRequest(ride_id=ride_id, driver_id=driver_id), context)
+                    servicer.CompleteRide(myuber_pb2.RideCompletionRequest(ride_id=ride_id, driver_id=driver_id),
+                                          context)
+
+            workers = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+            start = time.perf_counter()
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+            rate = len(rides) / (time.perf_counter() - start)
+            print(f"{stripes:>8} {threads:>8} {rate:10.0f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Accept/timeout races and transition throughput of the ride state machine")
+    parser.add_argument("--rides", type=int, default=2000, help="Rides raced between AcceptRide and the timeout")
+    parser.add_argument("--cycles", type=int, default=20000, help="Accept + complete cycles per throughput run")
+    args = parser.parse_args()
+    logger.setLevel("ERROR")
+    violations = race(args)
+    throughput(args)
+    if violations:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+import argparse
+import time
+import uuid
+from myuber_pb2 import COMPLETED, DRIVER_ASSIGNED
+from myuber_ride_store import Ride, RideStore
+
+def check_for_ride_scan(rides, driver_id):
+    # The original CheckForRide: scan every ride ever created
+    for ride_id, ride in rides.items():
+        if ride.status == DRIVER_ASSIGNED and ride.driver_id == driver_id:
+            return ride_id
+    return None
+
+def check_for_ride_indexed(store, driver_id):
+    # CheckForRide backed by the driver -> ride index
+    ride_id = store.active_ride_for_driver(driver_id)
+    ride = store.get(ride_id)
+    if ride is not None and ride.status == DRIVER_ASSIGNED:
+        return ride_id
+    return None
+
+def fill(store, plain, total_rides, drivers, keep_plain):
+    # Create rides that all end up completed except the last one per driver
+    for i in range(total_rides):
+        ride_id = uuid.uuid4().bytes
+        driver_id = f"driver-{i % drivers}"
+        ride = Ride(f"rider-{i}")
+        store.add(ride_id, ride)
+        store.update(ride_id, status=DRIVER_ASSIGNED, driver_id=driver_id)
+        if i < total_rides - drivers:
+            store.update(ride_id, status=COMPLETED)
+        if keep_plain:
+            plain[ride_id] = ride.copy()
+
+def measure(fn, container, drivers, lookups):
+    # Return the mean lookup latency in microseconds
+    start = time.perf_counter()
+    for i in range(lookups):
+        fn(container, f"driver-{i % drivers}")
+    return (time.perf_counter() - start) / lookups * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="CheckForRide latency as the number of rides grows")
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000,2000000")
+    parser.add_argument("--drivers", type=int, default=1000)
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--max-scan-size", type=int, default=100000,
+                        help="Largest ride count to run the linear scan on")
+    parser.add_argument("--max-finished", type=int, default=100000)
+    args = parser.parse_args()
+
+    print(f"{'rides':>10} {'hot rides':>10} {'indexed us':>12} {'scan us':>12}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        store = RideStore(finished_ttl=None, max_finished=args.max_finished)
+        plain = {}
+        keep_plain = size <= args.max_scan_size
+        fill(store, plain, size, args.drivers, keep_plain)
+        indexed = measure(check_for_ride_indexed, store, args.drivers, args.lookups)
+        if keep_plain:
+            scan = measure(check_for_ride_scan, plain, args.drivers, max(1, args.lookups // 100))
+            scan_text = f"{scan:12.2f}"
+        else:
+            scan_text = f"{'skipped':>12}"
+        print(f"{size:>10} {len(store.active):>10} {indexed:12.2f} {scan_text}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import argparse
+import random
+import sys
+import threading
+import time
+from myuber_scheduler import TimeoutScheduler
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress test of the acceptance timeout scheduler")
+    parser.add_argument("--timers", type=int, default=100000)
+    parser.add_argument("--max-delay", type=float, default=3.0)
+    parser.add_argument("--cancel-ratio", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    scheduler = TimeoutScheduler()
+    fired = []
+    lateness = []
+    lock = threading.Lock()
+
+    def on_timeout(index, due_at):
+        # Record which timer fired and how late it was
+        now = time.monotonic()
+        with lock:
+            fired.append(index)
+            lateness.append(now - due_at)
+
+    threads_before = threading.active_count()
+    start = time.perf_counter()
+    handles = []
+    for i in range(args.timers):
+        delay = random.uniform(0.1, args.max_delay)
+        handles.append(scheduler.schedule(delay, on_timeout, i, time.monotonic() + delay))
+    schedule_time = time.perf_counter() - start
+    threads_during = threading.active_count()
+    outstanding = scheduler.pending_count()
+
+    start = time.perf_counter()
+    cancelled = set()
+    for i in random.sample(range(args.timers), int(args.timers * args.cancel_ratio)):
+        if scheduler.cancel(handles[i]):
+            cancelled.add(i)
+    cancel_time = time.perf_counter() - start
+
+    # Wait for every remaining timer to fire
+    deadline = time.monotonic() + args.max_delay + 5.0
+    while scheduler.pending_count() and time.monotonic() < deadline:
+        time.sleep(0.1)
+    time.sleep(0.2)
+    scheduler.close()
+
+    expected = set(range(args.timers)) - cancelled
+    lateness.sort()
+    print(f"timers scheduled:     {args.timers} ({outstanding} outstanding at peak)")
+    print(f"threads:              {threads_before} before, {threads_during} with all timers outstanding")
+    print(f"schedule:             {schedule_time / args.timers * 1e6:.2f} us/op")
+    print(f"cancel:               {cancel_time / max(1, len(cancelled)) * 1e6:.2f} us/op")
+    print(f"fired:                {len(fired)} (expected {len(expected)})")
+    if lateness:
+        print(f"lateness p50/p99/max: {lateness[len(lateness) // 2] * 1000:.1f} / "
+              f"{lateness[int(len(lateness) * 0.99)] * 1000:.1f} / {lateness[-1] * 1000:.1f} ms")
+
+    if set(fired) != expected or len(fired) != len(expected):
+        print("FAILED: fired timers do not match the timers that were not cancelled")
+        sys.exit(1)
+    print("OK")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+import grpc
+import myuber_pb2
+import myuber_pb2_grpc
+from myuber_metrics import LatencyHistogram
+from myuber_server import DEFAULT_MAX_WORKERS
+
+def start_server(mode, port, max_workers):
+    # Launch the server in its own process on a plaintext loopback port
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "myuber_server.py"),
+               "--mode", mode, "--port", str(port), "--insecure",
+               "--max-workers", str(max_workers), "--log-level", "WARNING",
+               # Rides pile up without drivers; measure the RPC path rather than load shedding
+               "--max-pending-rides", "0"]
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    with grpc.insecure_channel(f"localhost:{port}") as channel:
+        grpc.channel_ready_future(channel).result(timeout=15)
+    return server
+
+async def run_clients(target, clients, duration, watchers, channels_per_process, rpc_timeout):
+    # Each simulated client requests a ride and then polls its status until time runs out
+    channels = [grpc.aio.insecure_channel(target) for _ in range(channels_per_process)]
+    stubs = [myuber_pb2_grpc.RideSharingStub(channel) for channel in channels]
+    latency = LatencyHistogram()
+    errors = [0]
+    deadline = time.monotonic() + duration
+
+    async def client(index):
+        stub = stubs[index % len(stubs)]
+        call = None
+        try:
+            start = time.perf_counter()
+            response = await stub.RequestRide(myuber_pb2.RideRequest(rider_id=f"rider-{os.getpid()}-{index}"),
+                                              timeout=rpc_timeout)
+            latency.record(time.perf_counter() - start)
+            if index < watchers:
+                # Watchers hold a WatchRide stream open for the whole run
+                call = stub.WatchRide(myuber_pb2.RideStatusRequest(ride_id=response.ride_id))
+                await call.read()
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                await stub.GetRideStatus(myuber_pb2.RideStatusRequest(ride_id=response.ride_id),
+                                         timeout=rpc_timeout)
+                latency.record(time.perf_counter() - start)
+        except grpc.RpcError:
+            errors[0] += 1
+        finally:
+            if call is not None:
+                call.cancel()
+
+    await asyncio.gather(*(client(i) for i in range(clients)))
+    for channel in channels:
+        await channel.close()
+    return latency, errors[0]
+
+def client_process(target, clients, duration, watchers, channels_per_process, rpc_timeout):
+    return asyncio.run(run_clients(target, clients, duration, watchers, channels_per_process, rpc_timeout))
+
+def measure(mode, args, clients):
+    # Run one server mode against `clients` concurrent clients and print RPS and latency
+    server = start_server(mode, args.port, args.max_workers)
+    try:
+        per_process = [clients // args.processes + (1 if i < clients % args.processes else 0)
+                       for i in range(args.processes)]
+        watchers = [args.watchers if i == 0 else 0 for i in range(args.processes)]
+        start = time.monotonic()
+        with multiprocessing.Pool(args.processes) as pool:
+            results = pool.starmap(client_process, [
+                (f"localhost:{args.port}", count, args.duration, watchers[i], args.channels, args.rpc_timeout)
+                for i, count in enumerate(per_process)])
+        elapsed = time.monotonic() - start
+    finally:
+        server.terminate()
+        server.wait()
+    latency = LatencyHistogram()
+    errors = 0
+    for histogram, process_errors in results:
+        latency.merge(histogram)
+        errors += process_errors
+    stats = latency.snapshot()
+    print(f"{mode:>9} {clients:>8} {stats['count'] / elapsed:10.0f} {stats['p50'] * 1000:9.2f} "
+          f"{stats['p99'] * 1000:9.2f} {errors:>7}")
+
+def main():
+    parser = argparse.ArgumentParser(description="RPS and latency of the threaded and asyncio server modes")
+    parser.add_argument("--clients", default="1000,10000", help="Comma-separated concurrent client counts")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--processes", type=int, default=4, help="Client processes generating load")
+    parser.add_argument("--channels", type=int, default=4, help="Channels per client process")
+    parser.add_argument("--rpc-timeout", type=float, default=15.0, help="Deadline of each RPC; misses count as errors")
+    parser.add_argument("--watchers", type=int, default=0, help="Clients that also hold a WatchRide stream")
+    parser.add_argument("--max-workers", type=int, default=DEFAULT_MAX_WORKERS,
+                        help="Thread pool size of the threaded mode (default: the server's)")
+    parser.add_argument("--port", type=int, default=50061)
+    parser.add_argument("--modes", default="threaded,asyncio")
+    args = parser.parse_args()
+
+    # Watch streams each hold a threaded-mode worker, so the result depends on the pool size
+    print(f"threaded mode: {args.max_workers} workers, {args.watchers} watch streams")
+    print(f"{'mode':>9} {'clients':>8} {'rps':>10} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for clients in [int(c) for c in args.clients.split(",")]:
+        for mode in args.modes.split(","):
+            measure(mode, args, clients)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+import grpc
+import myuber_pb2
+import myuber_pb2_grpc
+from myuber_metrics import LatencyHistogram
+from myuber_sharding import ShardRouter
+
+# Rides are spread over a square of --area degrees around this point, covering many regions
+CENTER_LAT, CENTER_LNG = 40.73, -73.99
+
+def start_shards(count, args):
+    # Launch one server process per shard on consecutive plaintext loopback ports
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "myuber_server.py")
+    servers = []
+    targets = []
+    for shard in range(count):
+        port = args.port + shard
+        servers.append(subprocess.Popen(
+            [sys.executable, script, "--mode", args.server_mode, "--port", str(port), "--insecure",
+             "--shard-id", str(shard), "--log-level", "WARNING",
+             # Rides pile up without drivers; measure the RPC path rather than load shedding
+             "--max-pending-rides", "0"], stdout=subprocess.DEVNULL))
+        targets.append(f"localhost:{port}")
+    for target in targets:
+        with grpc.insecure_channel(target) as channel:
+            grpc.channel_ready_future(channel).result(timeout=15)
+    return servers, targets
+
+async def run_clients(targets, clients, duration, area, rpc_timeout, seed):
+    # Each simulated rider requests a ride in a random region, then polls its status until time runs out;
+    # the router sends both to the owning shard
+    router = ShardRouter(targets, grpc.aio.insecure_channel)
+    rng = random.Random(seed)
+    latency = LatencyHistogram()
+    errors = [0]
+    deadline = time.monotonic() + duration
+
+    async def client(index):
+        pickup = (CENTER_LAT + rng.uniform(-area / 2, area / 2), CENTER_LNG + rng.uniform(-area / 2, area / 2))
+        rider_id = f"rider-{os.getpid()}-{index}"
+        request = myuber_pb2.RideRequest(rider_id=rider_id)
+        request.pickup.latitude, request.pickup.longitude = pickup
+        try:
+            start = time.perf_counter()
+            response = await router.for_location(pickup, rider_id).RequestRide(request, timeout=rpc_timeout)
+            latency.record(time.perf_counter() - start)
+            stub = router.for_ride(response.ride_id)
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                await stub.GetRideStatus(myuber_pb2.RideStatusRequest(ride_id=response.ride_id), timeout=rpc_timeout)
+                latency.record(time.perf_counter() - start)
+        except grpc.RpcError:
+            errors[0] += 1
+
+    await asyncio.gather(*(client(i) for i in range(clients)))
+    for channel in router.channels:
+        await channel.close()
+    return latency, errors[0]
+
+def client_process(targets, clients, duration, area, rpc_timeout, seed):
+    return asyncio.run(run_clients(targets, clients, duration, area, rpc_timeout, seed))
+
+def measure(shards, args):
+    # Run `shards` server processes against the same client load and print aggregate RPS and latency
+    servers, targets = start_shards(shards, args)
+    try:
+        per_process = [args.clients // args.processes + (1 if i < args.clients % args.processes else 0)
+                       for i in range(args.processes)]
+        start = time.monotonic()
+        with multiprocessing.Pool(args.processes) as pool:
+            results = pool.starmap(client_process, [
+                (targets, count, args.duration, args.area, args.rpc_timeout, args.seed + i)
+                for i, count in enumerate(per_process)])
+        elapsed = time.monotonic() - start
+        # Rides held by each shard, to show how evenly the regions are spread
+        rides = []
+        for target in targets:
+            with grpc.insecure_channel(target) as channel:
+                stats = myuber_pb2_grpc.RideSharingStub(channel).GetStats(myuber_pb2.StatsRequest())
+                rides.append(stats.pending_rides)
+    finally:
+        for server in servers:
+            server.terminate()
+        for server in servers:
+            server.wait()
+    latency = LatencyHistogram()
+    errors = 0
+    for histogram, process_errors in results:
+        latency.merge(histogram)
+        errors += process_errors
+    stats = latency.snapshot()
+    print(f"{shards:>6} {stats['count'] / elapsed:10.0f} {stats['p50'] * 1000:9.2f} {stats['p99'] * 1000:9.2f} "
+          f"{errors:>7} {min(rides):>10} {max(rides):>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate RPS of 1, 2, 4, ... server shards behind the client router")
+    parser.add_argument("--shards", default="1,2,4", help="Comma-separated shard counts")
+    parser.add_argument("--clients", type=int, default=1000, help="Concurrent riders across all client processes")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--processes", type=int, default=4, help="Client processes generating load")
+    parser.add_argument("--area", type=float, default=1.0, help="Side of the square of pickups, in degrees")
+    parser.add_argument("--rpc-timeout", type=float, default=15.0, help="Deadline of each RPC; misses count as errors")
+    parser.add_argument("--server-mode", choices=["threaded", "asyncio"], default="asyncio")
+    parser.add_argument("--port", type=int, default=50071, help="Port of shard 0; shard i listens on port + i")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs; servers and {args.processes} client processes share them")
+    print(f"{'shards':>6} {'rps':>10} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7} {'min rides':>10} {'max rides':>10}")
+    for shards in [int(count) for count in args.shards.split(",")]:
+        measure(shards, args)
+
+if __name__ == '__main__':
+    main()
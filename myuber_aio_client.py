@@ -0,0 +1,233 @@
+import asyncio
+import grpc
+import myuber_pb2
+from myuber_client import (build_ride_batches, build_ride_request, build_status_batches, create_router,
+                           retry_delay)
+from myuber_driver import build_heartbeat, build_registration, build_registration_batches
+from myuber_logger import logger
+
+# grpc.aio versions of MyUberClient and MyUberDriver: every RPC is a coroutine, so one process can keep
+# tens of thousands of riders and drivers in flight. Create them, and any AsyncChannelPool they share,
+# on the event loop that runs them.
+
+class AsyncMyUberClient:
+    def __init__(self, target='localhost:50051', insecure=False, max_attempts=5, backoff_base=0.2,
+                 backoff_cap=10.0, channel_pool=None):
+        # One channel per shard when target lists several servers; pass an AsyncChannelPool to share
+        # connections between many client objects
+        self.router = create_router(target, insecure, channel_pool, aio=True)
+        # Retry policy for ride requests shed by an overloaded server
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+    async def close(self):
+        # Close the channels this client opened; pooled channels stay open for the other clients
+        if self.router.owns_channels:
+            for channel in self.router.channels:
+                await channel.close()
+
+    async def request_ride(self, rider_id, pickup=None, max_wait=None, timeout=None):
+        logger.info("Requesting ride for rider %s", rider_id)
+        request = build_ride_request(rider_id, pickup, max_wait)
+        stub = self.router.for_location(pickup, rider_id)
+        for attempt in range(self.max_attempts):
+            try:
+                return await stub.RequestRide(request, timeout=timeout)
+            except grpc.RpcError as e:
+                # Only shed requests are retried: the server created no ride, so a retry cannot duplicate it
+                if e.code() != grpc.StatusCode.RESOURCE_EXHAUSTED or attempt + 1 == self.max_attempts:
+                    logger.error("RPC error occurred: %s", e)
+                    return None
+                delay = retry_delay(e, attempt, self.backoff_base, self.backoff_cap)
+                logger.warning("Ride request shed by the server, retrying in %.2fs", delay)
+                await asyncio.sleep(delay)
+
+    async def get_ride_status(self, ride_id):
+        logger.info("Getting status for ride %s", ride_id.hex())
+        try:
+            return await self.router.for_ride(ride_id).GetRideStatus(myuber_pb2.RideStatusRequest(ride_id=ride_id))
+        except grpc.RpcError as e:
+            logger.error("RPC error occurred: %s", e)
+            return None
+
+    async def request_rides(self, rides):
+        # Request several (rider_id, pickup) rides, one RPC per shard sent concurrently; results in request order
+        logger.info("Requesting %s rides", len(rides))
+        batches = build_ride_batches(self.router, rides)
+        try:
+            responses = await asyncio.gather(*(self.router.stubs[shard].RequestRides(request)
+                                               for shard, _, request in batches))
+        except grpc.RpcError as e:
+            logger.error("RPC error occurred: %s", e)
+            return None
+        results = [None] * len(rides)
+        for (_, group, _), response in zip(batches, responses):
+            for (position, _), ride in zip(group, response.rides):
+                results[position] = ride
+        return results
+
+    async def get_ride_statuses(self, ride_ids):
+        # Look up several rides; returns a RideStatusResponse, or None if not found, per ride
+        batches = build_status_batches(self.router, ride_ids)
+        try:
+            responses = await asyncio.gather(*(self.router.stubs[shard].GetRideStatuses(request)
+                                               for shard, _, request in batches))
+        except grpc.RpcError as e:
+            logger.error("RPC error occurred: %s", e)
+            return None
+        results = [None] * len(ride_ids)
+        for (_, group, _), response in zip(batches, responses):
+            for (position, _), result in zip(group, response.results):
+                results[position] = result.status if result.found else None
+        return results
+
+    async def get_stats(self, shard=0):
+        # Fetch server metrics and gauges of one shard
+        try:
+            return await self.router.stubs[shard].GetStats(myuber_pb2.StatsRequest())
+        except grpc.RpcError as e:
+            logger.error("RPC error occurred: %s", e)
+            return None
+
+    async def watch_ride(self, ride_id, timeout=None):
+        # Yield every status change pushed by the server, until the optional deadline
+        logger.info("Watching ride %s", ride_id.hex())
+        call = self.router.for_ride(ride_id).WatchRide(myuber_pb2.RideStatusRequest(ride_id=ride_id),
+                                                       timeout=timeout)
+        try:
+            async for response in call:
+                yield response
+        except grpc.RpcError as e:
+            logger.error("RPC error occurred while watching ride: %s", e)
+        finally:
+            call.cancel()
+
+class AsyncMyUberDriver:
+    def __init__(self, driver_id, target='localhost:50051', insecure=False, channel_pool=None):
+        self.driver_id = driver_id
+        # One channel per shard when target lists several servers; pass an AsyncChannelPool to share
+        # connections between many driver objects
+        self.router = create_router(target, insecure, channel_pool, aio=True)
+        # Stub of the driver's home shard, chosen by the region it registers in
+        self.stub = self.router.for_location(None, driver_id)
+        self.current_ride_id = None
+
+    async def close(self):
+        # Close the channels this driver opened; pooled channels stay open for the other drivers
+        if self.router.owns_channels:
+            for channel in self.router.channels:
+                await channel.close()
+
+    async def register_driver(self, location=None):
+        logger.info("Registering driver %s", self.driver_id)
+        self.stub = self.router.for_location(location, self.driver_id)
+        try:
+            return await self.stub.RegisterDriver(build_registration(self.driver_id, location))
+        except grpc.RpcError as e:
+            logger.error("RPC error occurred: %s", e)
+            return None
+
+    async def register_drivers(self, drivers):
+        # Register a fleet of (driver_id, location) pairs, one RPC per shard sent concurrently
+        logger.info("Registering %s drivers", len(drivers))
+        batches = build_registration_batches(self.router, drivers)
+        try:
+            responses = await asyncio.gather(*(self.router.stubs[shard].RegisterDrivers(request)
+                                               for shard, _, request in batches))
+        except grpc.RpcError as e:
+            logger.error("RPC error occurred: %s", e)
+            return None
+        results = [None] * len(drivers)
+        for (_, group, _), response in zip(batches, responses):
+            for (position, _), result in zip(group, response.results):
+                results[position] = result
+        return results
+
+    async def heartbeat(self, location=None):
+        # Renew the driver's presence lease, optionally with its current (lat, lng) position
+        try:
+            return await self.stub.Heartbeat(build_heartbeat(self.driver_id, location))
+        except grpc.RpcError as e:
+            logger.error("RPC error occurred while sending heartbeat: %s", e)
+            return None
+
+    def start_heartbeats(self, interval=None):
+        # Send heartbeats from a task, by default three per lease period; cancel the task to stop
+        async def run():
+            delay = interval
+            while True:
+                response = await self.heartbeat()
+                if delay is None:
+                    delay = response.lease_seconds / 3 if response is not None and response.lease_seconds else 5.0
+                await asyncio.sleep(delay)
+
+        return asyncio.ensure_future(run())
+
+    async def update_location(self, latitude, longitude):
+        # Sent to the home shard, as MyUberDriver.update_location does
+        if self.router.for_location((latitude, longitude), self.driver_id) is not self.stub:
+            logger.warning("Driver %s moved to a region of another shard; register again to be offered its rides",
+                           self.driver_id)
+        request = myuber_pb2.DriverLocationUpdate(driver_id=self.driver_id)
+        request.location.latitude = latitude
+        request.location.longitude = longitude
+        try:
+            return await self.stub.UpdateDriverLocation(request)
+        except grpc.RpcError as e:
+            logger.error("RPC error occurred while updating location: %s", e)
+            return None
+
+    async def accept_ride(self, ride_id):
+        logger.info("Driver %s accepting ride %s", self.driver_id, ride_id.hex())
+        request = myuber_pb2.AcceptRideRequest(ride_id=ride_id, driver_id=self.driver_id)
+        try:
+            response = await self.router.for_ride(ride_id).AcceptRide(request)
+            self.current_ride_id = ride_id
+            return response
+        except grpc.RpcError as e:
+            logger.error("RPC error occurred: %s", e)
+            return None
+
+    async def reject_ride(self, ride_id):
+        logger.info("Driver %s rejecting ride %s", self.driver_id, ride_id.hex())
+        request = myuber_pb2.RejectRideRequest(ride_id=ride_id, driver_id=self.driver_id)
+        try:
+            return await self.router.for_ride(ride_id).RejectRide(request)
+        except grpc.RpcError as e:
+            logger.error("RPC error occurred: %s", e)
+            return None
+
+    async def complete_ride(self):
+        if not self.current_ride_id:
+            logger.warning("No ride assigned to complete")
+            return None
+        logger.info("Driver %s completing ride %s", self.driver_id, self.current_ride_id.hex())
+        request = myuber_pb2.RideCompletionRequest(ride_id=self.current_ride_id, driver_id=self.driver_id)
+        try:
+            response = await self.router.for_ride(self.current_ride_id).CompleteRide(request)
+            self.current_ride_id = None
+            return response
+        except grpc.RpcError as e:
+            logger.error("RPC error occurred: %s", e)
+            return None
+
+    async def check_for_ride(self):
+        try:
+            response = await self.stub.CheckForRide(myuber_pb2.CheckRideRequest(driver_id=self.driver_id))
+            return response.ride_id if response.has_ride else None
+        except grpc.RpcError as e:
+            logger.error("RPC error occurred while checking for ride: %s", e)
+            return None
+
+    async def watch_assignments(self):
+        # Yield every assignment change pushed by the server
+        logger.info("Driver %s watching for assignments", self.driver_id)
+        call = self.stub.WatchAssignments(myuber_pb2.WatchAssignmentsRequest(driver_id=self.driver_id))
+        try:
+            async for assignment in call:
+                yield assignment
+        except grpc.RpcError as e:
+            logger.error("RPC error occurred while watching for assignments: %s", e)
+        finally:
+            call.cancel()
@@ -0,0 +1,244 @@
+import asyncio
+import heapq
+import grpc
+import myuber_pb2_grpc
+from myuber_archive import DRIVER, RIDER
+from myuber_dispatcher import BATCH
+from myuber_interceptors import get_async_interceptors
+from myuber_logger import logger
+from myuber_metrics import start_metrics_http_server
+from myuber_ride_store import TERMINAL_STATUSES
+from myuber_scheduler import AsyncTimeoutScheduler
+from myuber_server import (SERVER_OPTIONS, MyUberServicer, durable_wait_timeout, load_server_credentials,
+                           servicer_options)
+
+class RideAbort(Exception):
+    def __init__(self, code, details):
+        super().__init__(details)
+        self.code = code
+        self.details = details
+
+class AbortCapturingContext:
+    def __init__(self, context):
+        # Lets the threaded handlers run unchanged on a grpc.aio context
+        self.context = context
+
+    def abort(self, code, details):
+        # grpc.aio aborts are coroutines, so raise and let the async handler await the abort
+        raise RideAbort(code, details)
+
+    def __getattr__(self, name):
+        return getattr(self.context, name)
+
+class AsyncMyUberServicer(MyUberServicer):
+    def __init__(self, **options):
+        # Everything runs on the event loop thread: timers use loop.call_later and
+        # the allocator is a task woken through an asyncio.Event
+        self.loop = asyncio.get_running_loop()
+        self.dispatch_wakeup = asyncio.Event()
+        # Handlers waiting for the fsync share one future per LSN, resolved on the loop when the
+        # journal reports the commit, instead of each blocking a thread
+        self.durable_waiters = {}  # LSN -> future
+        self.durable_heap = []  # LSNs of durable_waiters, lowest first
+        super().__init__(timeout_scheduler=AsyncTimeoutScheduler(self.loop), **options)
+        self.dispatcher.wakeup_callback = self.dispatch_wakeup.set
+        if self.journal is not None:
+            self.journal.durable_listeners.append(self.journal_committed)
+
+    def start_background_tasks(self):
+        # Run the allocator as a task instead of a daemon thread
+        self.ride_allocation_task = self.loop.create_task(self.allocate_rides_async())
+
+    async def allocate_rides_async(self):
+        # Wait until a ride or a driver shows up, then assign every match at once
+        while True:
+            await self.dispatch_wakeup.wait()
+            self.dispatch_wakeup.clear()
+            if not self.dispatcher.can_match():
+                continue
+            if self.dispatcher.mode == BATCH:
+                # Let the batch window fill up before matching
+                await asyncio.sleep(self.dispatcher.batch_window)
+            for ride_id, assigned_driver in self.dispatcher.match():
+                self.assign_ride(ride_id, assigned_driver)
+
+    def wait_durable(self, lsn, context=None):
+        # Blocking on the fsync would stall the loop; run_handler awaits it instead
+        pass
+
+    def journal_committed(self, lsn):
+        # Journal listener, called on the flusher thread
+        try:
+            self.loop.call_soon_threadsafe(self.resolve_durable, lsn)
+        except RuntimeError:
+            # The loop is closed; nobody is waiting any more
+            pass
+
+    def resolve_durable(self, lsn):
+        # Wake the handlers waiting for any LSN up to the one just made durable
+        while self.durable_heap and self.durable_heap[0] <= lsn:
+            self.durable_waiters.pop(heapq.heappop(self.durable_heap)).set_result(True)
+
+    def durable_future(self, lsn):
+        # Future resolved once the record with this LSN is on disk
+        future = self.durable_waiters.get(lsn)
+        if future is None:
+            future = self.loop.create_future()
+            # The journal updates durable_lsn before calling its listeners, so a commit that happens
+            # after this check still resolves the future
+            if self.journal.durable_lsn >= lsn:
+                future.set_result(True)
+                return future
+            self.durable_waiters[lsn] = future
+            heapq.heappush(self.durable_heap, lsn)
+        return future
+
+    async def run_handler(self, handler, request, context):
+        # Run a non-blocking threaded handler on the loop and translate its aborts
+        try:
+            response = handler(request, AbortCapturingContext(context))
+        except RideAbort as abort:
+            await context.abort(abort.code, abort.details)
+        # Answer only once the transitions logged so far are on disk, but not past the client's deadline
+        if self.journal is not None and self.journal.durable_lsn < self.journal.last_lsn:
+            # Shielded so a handler that times out leaves the shared future to the other waiters
+            durable = asyncio.shield(self.durable_future(self.journal.last_lsn))
+            try:
+                await asyncio.wait_for(durable, durable_wait_timeout(context))
+            except asyncio.TimeoutError:
+                await context.abort(grpc.StatusCode.DEADLINE_EXCEEDED,
+                                    "Deadline exceeded before the change was durable")
+        return response
+
+    async def stream_events_async(self, subscriber):
+        # Yield events from an asyncio.Queue subscriber until the stream is closed
+        while True:
+            event = await subscriber.get()
+            if event is None:
+                break
+            yield event
+
+    async def RequestRide(self, request, context):
+        return await self.run_handler(super().RequestRide, request, context)
+
+    async def GetRideStatus(self, request, context):
+        return await self.run_handler(super().GetRideStatus, request, context)
+
+    async def AcceptRide(self, request, context):
+        return await self.run_handler(super().AcceptRide, request, context)
+
+    async def RejectRide(self, request, context):
+        return await self.run_handler(super().RejectRide, request, context)
+
+    async def CheckForRide(self, request, context):
+        return await self.run_handler(super().CheckForRide, request, context)
+
+    async def CompleteRide(self, request, context):
+        return await self.run_handler(super().CompleteRide, request, context)
+
+    async def RegisterDriver(self, request, context):
+        return await self.run_handler(super().RegisterDriver, request, context)
+
+    async def UpdateDriverLocation(self, request, context):
+        return await self.run_handler(super().UpdateDriverLocation, request, context)
+
+    async def RequestRides(self, request, context):
+        return await self.run_handler(super().RequestRides, request, context)
+
+    async def GetRideStatuses(self, request, context):
+        return await self.run_handler(super().GetRideStatuses, request, context)
+
+    async def RegisterDrivers(self, request, context):
+        return await self.run_handler(super().RegisterDrivers, request, context)
+
+    async def GetStats(self, request, context):
+        return await self.run_handler(super().GetStats, request, context)
+
+    async def Heartbeat(self, request, context):
+        return await self.run_handler(super().Heartbeat, request, context)
+
+    async def WatchRide(self, request, context):
+        # Stream status changes of a ride until it is completed or expired
+        ride_id = request.ride_id
+        topic = ("ride", ride_id)
+        subscriber = self.events.subscribe(topic, asyncio.Queue())
+        # One lookup: the ride may be evicted between a membership test and a read
+        ride = self.rides.get(ride_id)
+        if ride is None:
+            self.events.unsubscribe(topic, subscriber)
+            logger.warning("Ride %s not found", ride_id.hex())
+            await context.abort(grpc.StatusCode.NOT_FOUND, "Ride not found")
+
+        logger.info("Rider watching ride %s", ride_id.hex())
+        try:
+            yield self.build_ride_status(ride_id, ride)
+            async for status in self.stream_events_async(subscriber):
+                yield status
+                if status.status in TERMINAL_STATUSES:
+                    break
+        finally:
+            # Also runs when the rider cancels the stream
+            self.events.unsubscribe(topic, subscriber)
+
+    async def WatchAssignments(self, request, context):
+        # Stream ride assignments for a driver as they happen
+        driver_id = request.driver_id
+        topic = ("driver", driver_id)
+        subscriber = self.events.subscribe(topic, asyncio.Queue())
+        logger.info("Driver %s watching for assignments", driver_id)
+        # An open assignment stream keeps the driver's lease alive
+        self.driver_manager.add_watcher(driver_id)
+        self.touch_driver(driver_id)
+        try:
+            initial = self.current_assignment(driver_id)
+            if initial is not None:
+                yield initial
+            async for assignment in self.stream_events_async(subscriber):
+                if initial is not None and assignment.ride_id == initial.ride_id:
+                    # Skip the offer if it was queued before the check above, as WatchAssignments does
+                    repeat = assignment.status == initial.status
+                    initial = None
+                    if repeat:
+                        continue
+                yield assignment
+        finally:
+            # Also runs when the driver cancels the stream
+            self.driver_manager.remove_watcher(driver_id)
+            self.events.unsubscribe(topic, subscriber)
+
+    async def history_pages_async(self, kind, request, context):
+        # Each page is a short read of the memory-mapped archive, so the threaded pager runs on the loop
+        try:
+            for page in self.history_pages(kind, request, AbortCapturingContext(context)):
+                yield page
+        except RideAbort as abort:
+            await context.abort(abort.code, abort.details)
+
+    async def GetRiderHistory(self, request, context):
+        async for page in self.history_pages_async(RIDER, request, context):
+            yield page
+
+    async def GetDriverHistory(self, request, context):
+        async for page in self.history_pages_async(DRIVER, request, context):
+            yield page
+
+async def serve_async(args):
+    # Create a grpc.aio server; every RPC is a coroutine on one event loop
+    servicer = AsyncMyUberServicer(**servicer_options(args))
+    if args.metrics_port:
+        start_metrics_http_server(args.metrics_port, servicer.render_metrics)
+    server = grpc.aio.server(interceptors=get_async_interceptors(servicer.metrics), options=SERVER_OPTIONS)
+    myuber_pb2_grpc.add_RideSharingServicer_to_server(servicer, server)
+    if args.insecure:
+        server.add_insecure_port(f'[::]:{args.port}')
+    else:
+        # Add a secure port with SSL credentials
+        server.add_secure_port(f'[::]:{args.port}', load_server_credentials())
+    await server.start()
+    print(f"MyUber Server started on port {args.port} ({'plaintext' if args.insecure else 'SSL enabled'}, asyncio)")
+    print("Press Ctrl+C to stop the server")
+    try:
+        await server.wait_for_termination()
+    finally:
+        # Stop the server when the loop is cancelled (Ctrl+C)
+        await server.stop(0)
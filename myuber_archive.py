@@ -0,0 +1,236 @@
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+from myuber_ride_store import now_ms
+
+# Owner kinds a history can be asked for
+RIDER = "rider"
+DRIVER = "driver"
+# Rows a new column file has room for; files double when they fill up and are sparse, so the
+# unused tail takes no disk space
+INITIAL_CAPACITY = 1 << 16
+RIDE_ID_BYTES = 16
+
+class MappedArray:
+    def __init__(self, path, typecode, count=1, capacity=INITIAL_CAPACITY):
+        # A file of fixed-width items (count values of one array typecode each), memory-mapped
+        # and read and written in place through a typed view; callers hold the archive lock
+        self.typecode = typecode
+        self.width = struct.calcsize(typecode) * count
+        self.file = open(path, "r+b" if os.path.exists(path) else "w+b")
+        self.map = None
+        self.items = None
+        self.capacity = 0
+        self.reserve(max(capacity, os.fstat(self.file.fileno()).st_size // self.width))
+
+    def reserve(self, capacity):
+        # Make room for at least `capacity` items, doubling the file so appends rarely remap it
+        if capacity <= self.capacity:
+            return
+        capacity = max(capacity, self.capacity * 2)
+        self.release()
+        self.file.truncate(capacity * self.width)
+        self.map = mmap.mmap(self.file.fileno(), capacity * self.width)
+        if hasattr(mmap, "MADV_RANDOM"):
+            # History reads jump between rows; without this every page fault also reads ahead
+            self.map.madvise(mmap.MADV_RANDOM)
+        self.items = memoryview(self.map).cast(self.typecode)
+        self.capacity = capacity
+
+    def release(self):
+        # The map can only be closed once no view of it is left
+        if self.map is not None:
+            self.items.release()
+            self.map.close()
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        self.release()
+        self.map = None
+        self.file.close()
+
+class OwnerIndex:
+    def __init__(self, directory, kind):
+        # Per-rider or per-driver offset index: the owner of every row as a dictionary code, a
+        # column linking each row to the owner's previous row and the newest row of every owner.
+        # Links and heads hold row + 1, so the zeros of a fresh file mean "none". Following the
+        # links pages through one owner's rides, newest first, without reading anyone else's.
+        self.names = []  # code -> rider or driver ID
+        self.codes = {}  # rider or driver ID -> code
+        path = os.path.join(directory, f"{kind}s.dict")
+        data = b""
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                data = f.read()
+        # One JSON string per line; a line cut short by a crash is dropped
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            self.add_name(json.loads(line))
+        self.dictionary = open(path, "ab")
+        self.dictionary.truncate(end)
+        self.owner = MappedArray(os.path.join(directory, f"{kind}.col"), "I")
+        self.previous = MappedArray(os.path.join(directory, f"{kind}_prev.col"), "q")
+        self.newest = MappedArray(os.path.join(directory, f"{kind}_newest.idx"), "q")
+
+    def add_name(self, owner_id):
+        code = len(self.names)
+        self.names.append(owner_id)
+        self.codes[owner_id] = code
+        return code
+
+    def code(self, owner_id):
+        # Dictionary code of an owner, added to the dictionary file on first use
+        code = self.codes.get(owner_id)
+        if code is None:
+            code = self.add_name(owner_id)
+            self.dictionary.write(json.dumps(owner_id).encode() + b"\n")
+            self.newest.reserve(code + 1)
+        return code
+
+    def link(self, row, code):
+        # Fill in a new row's owner and link it to the owner's previous ride
+        self.owner.reserve(row + 1)
+        self.previous.reserve(row + 1)
+        self.owner.items[row] = code
+        self.previous.items[row] = self.newest.items[code]
+
+    def rebuild(self, rows):
+        # Recompute the links and heads from the owner column, after a crash cut an append short
+        newest = self.newest.items
+        for code in range(len(self.names)):
+            newest[code] = 0
+        owner = self.owner.items
+        previous = self.previous.items
+        for row in range(rows):
+            code = owner[row]
+            previous[row] = newest[code]
+            newest[code] = row + 1
+
+    def files(self):
+        return (self.owner, self.previous, self.newest)
+
+    def close(self):
+        self.dictionary.close()
+        for column in self.files():
+            column.close()
+
+class RideArchive:
+    def __init__(self, directory):
+        # Append-only columnar store of completed rides: one memory-mapped file per fixed-width
+        # column, a row per ride in completion order, plus a rider and a driver OwnerIndex.
+        # Nothing but the rider and driver dictionaries is loaded into memory; reads touch only
+        # the pages of the rows they return. Writes go to the page cache: they survive a server
+        # crash, and flush() (called by close()) puts them on disk.
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.lock = threading.Lock()
+        # Committed row count; a row only counts once all of its columns are written
+        self.header = MappedArray(os.path.join(directory, "rows"), "q", capacity=1)
+        self.ride_ids = MappedArray(os.path.join(directory, "ride_id.col"), "B", RIDE_ID_BYTES)
+        self.requested_at = MappedArray(os.path.join(directory, "requested_at.col"), "q")
+        self.completed_at = MappedArray(os.path.join(directory, "completed_at.col"), "q")
+        # NaN when the rider sent no pickup
+        self.pickup_lat = MappedArray(os.path.join(directory, "pickup_lat.col"), "d")
+        self.pickup_lng = MappedArray(os.path.join(directory, "pickup_lng.col"), "d")
+        self.owners = {RIDER: OwnerIndex(directory, RIDER), DRIVER: OwnerIndex(directory, DRIVER)}
+        rows = len(self)
+        for index in self.owners.values():
+            # Rows are committed before the owner heads move, so only the newest row can be unlinked
+            if rows and index.newest.items[index.owner.items[rows - 1]] != rows:
+                index.rebuild(rows)
+
+    def __len__(self):
+        return self.header.items[0]
+
+    def append(self, ride_id, ride, completed_at=None):
+        # Archive a completed ride; returns its row
+        with self.lock:
+            return self._append_locked(ride_id, ride, now_ms() if completed_at is None else completed_at)
+
+    def append_many(self, rides):
+        # Archive several (ride_id, ride, completed_at) triples under one lock acquisition
+        with self.lock:
+            for ride_id, ride, completed_at in rides:
+                self._append_locked(ride_id, ride, completed_at)
+
+    def _append_locked(self, ride_id, ride, completed_at):
+        row = self.header.items[0]
+        rider = self.owners[RIDER]
+        driver = self.owners[DRIVER]
+        rider_code = rider.code(ride.rider_id)
+        driver_code = driver.code(ride.driver_id or "")
+        # New dictionary entries reach the file before a row refers to them
+        rider.dictionary.flush()
+        driver.dictionary.flush()
+        for column in (self.ride_ids, self.requested_at, self.completed_at, self.pickup_lat, self.pickup_lng):
+            column.reserve(row + 1)
+        offset = row * RIDE_ID_BYTES
+        self.ride_ids.map[offset:offset + RIDE_ID_BYTES] = ride_id
+        self.requested_at.items[row] = ride.requested_at
+        self.completed_at.items[row] = completed_at
+        self.pickup_lat.items[row] = math.nan if ride.pickup_lat is None else ride.pickup_lat
+        self.pickup_lng.items[row] = math.nan if ride.pickup_lng is None else ride.pickup_lng
+        rider.link(row, rider_code)
+        driver.link(row, driver_code)
+        # Commit the row, then make it the newest ride of its rider and driver
+        self.header.items[0] = row + 1
+        rider.newest.items[rider_code] = row + 1
+        driver.newest.items[driver_code] = row + 1
+        return row
+
+    def read(self, row):
+        # (ride_id, rider_id, driver_id, pickup, requested_at, completed_at) of a row; caller holds the lock
+        offset = row * RIDE_ID_BYTES
+        lat = self.pickup_lat.items[row]
+        return (self.ride_ids.map[offset:offset + RIDE_ID_BYTES],
+                self.owners[RIDER].names[self.owners[RIDER].owner.items[row]],
+                self.owners[DRIVER].names[self.owners[DRIVER].owner.items[row]],
+                None if math.isnan(lat) else (lat, self.pickup_lng.items[row]),
+                self.requested_at.items[row], self.completed_at.items[row])
+
+    def history(self, kind, owner_id, limit, page_token=0):
+        # Up to `limit` archived rides of a rider or driver, newest first, and the token of the
+        # next page: 0 when there are no older rides. page_token 0 starts at the newest ride.
+        # Raises ValueError for a token that is not from this owner's history.
+        index = self.owners[kind]
+        with self.lock:
+            code = index.codes.get(owner_id)
+            if page_token and (code is None or page_token > len(self) or index.owner.items[page_token - 1] != code):
+                raise ValueError(f"Page token {page_token} is not part of the history of {kind} {owner_id}")
+            if code is None:
+                return [], 0
+            link = page_token or index.newest.items[code]
+            rides = []
+            while link and len(rides) < limit:
+                rides.append(self.read(link - 1))
+                link = index.previous.items[link - 1]
+            return rides, link
+
+    def count(self, kind):
+        # Number of distinct riders or drivers with archived rides
+        return len(self.owners[kind].names)
+
+    def ride_columns(self):
+        return (self.header, self.ride_ids, self.requested_at, self.completed_at, self.pickup_lat, self.pickup_lng)
+
+    def flush(self):
+        # Write the mapped pages to disk
+        with self.lock:
+            for column in self.ride_columns():
+                column.flush()
+            for index in self.owners.values():
+                for column in index.files():
+                    column.flush()
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            for column in self.ride_columns():
+                column.close()
+            for index in self.owners.values():
+                index.close()
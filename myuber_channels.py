@@ -0,0 +1,106 @@
+import asyncio
+import functools
+import itertools
+import threading
+import grpc
+
+# Keepalive pings on idle connections, so a dead connection (NAT timeout, restarted server) is noticed
+# before the next RPC fails on it and quiet watch streams stay open. The server accepts pings this
+# often (see SERVER_OPTIONS in myuber_server.py).
+KEEPALIVE_OPTIONS = [
+    ("grpc.keepalive_time_ms", 30000),
+    ("grpc.keepalive_timeout_ms", 10000),
+    ("grpc.keepalive_permit_without_calls", 1),
+    ("grpc.http2.max_pings_without_data", 0),
+]
+# Channels with identical settings share one connection; pooled channels each get their own
+POOLED_OPTIONS = [("grpc.use_local_subchannel_pool", 1)]
+
+@functools.lru_cache(maxsize=None)
+def client_credentials():
+    # Load the SSL certificates once per process; every secure channel reuses the same credentials
+    with open('ca.crt', 'rb') as f:
+        root_certificates = f.read()
+    with open('client.key', 'rb') as f:
+        private_key = f.read()
+    with open('client.crt', 'rb') as f:
+        certificate_chain = f.read()
+    return grpc.ssl_channel_credentials(
+        root_certificates=root_certificates,
+        private_key=private_key,
+        certificate_chain=certificate_chain
+    )
+
+def create_channel(target, insecure=False, options=()):
+    # Open a channel to the server; plaintext only when insecure is set (local benchmarks)
+    options = KEEPALIVE_OPTIONS + list(options)
+    if insecure:
+        return grpc.insecure_channel(target, options=options)
+    return grpc.secure_channel(target, client_credentials(), options=options)
+
+def create_aio_channel(target, insecure=False, options=(), interceptors=None):
+    # grpc.aio version of create_channel; must be called on the event loop that will use the channel
+    options = KEEPALIVE_OPTIONS + list(options)
+    if insecure:
+        return grpc.aio.insecure_channel(target, options=options, interceptors=interceptors)
+    return grpc.aio.secure_channel(target, client_credentials(), options=options, interceptors=interceptors)
+
+class InFlightLimiter(grpc.aio.UnaryUnaryClientInterceptor):
+    # Let at most `limit` unary calls wait for an answer at once; the rest queue in the client.
+    # A burst of thousands of calls otherwise reaches the server at once, and the asyncio server
+    # cancels part of them. Streams are not limited: they stay open for the life of a ride.
+    def __init__(self, limit):
+        self.semaphore = asyncio.Semaphore(limit)
+
+    async def intercept_unary_unary(self, continuation, client_call_details, request):
+        async with self.semaphore:
+            call = await continuation(client_call_details, request)
+            return await call
+
+class ChannelPool:
+    def __init__(self, channels_per_target=4):
+        # A few connections per server, shared by every client and driver object that is given the
+        # pool; each channel multiplexes many concurrent RPCs over one HTTP/2 connection
+        self.channels_per_target = channels_per_target
+        self.channels = {}  # (target, insecure) -> channels
+        self.cursors = {}  # (target, insecure) -> round-robin iterator over them
+        self.lock = threading.Lock()
+
+    def open_channel(self, target, insecure):
+        return create_channel(target, insecure, POOLED_OPTIONS)
+
+    def channel(self, target, insecure=False):
+        # Return the next shared channel to a target, round robin, opening the target's channels on first use
+        key = (target, insecure)
+        with self.lock:
+            if key not in self.channels:
+                channels = [self.open_channel(target, insecure) for _ in range(self.channels_per_target)]
+                self.channels[key] = channels
+                self.cursors[key] = itertools.cycle(channels)
+            return next(self.cursors[key])
+
+    def take_all(self):
+        # Forget every channel and return them, for close()
+        with self.lock:
+            channels = [channel for target_channels in self.channels.values() for channel in target_channels]
+            self.channels.clear()
+            self.cursors.clear()
+            return channels
+
+    def close(self):
+        for channel in self.take_all():
+            channel.close()
+
+class AsyncChannelPool(ChannelPool):
+    # grpc.aio channels; create and close the pool on the event loop that runs the clients
+    def __init__(self, channels_per_target=4, max_in_flight=512):
+        super().__init__(channels_per_target)
+        # Shared by every channel of the pool (0: no limit)
+        self.interceptors = [InFlightLimiter(max_in_flight)] if max_in_flight else None
+
+    def open_channel(self, target, insecure):
+        return create_aio_channel(target, insecure, POOLED_OPTIONS, self.interceptors)
+
+    async def close(self):
+        for channel in self.take_all():
+            await channel.close()
@@ -1,93 +1,263 @@
+import heapq
+import itertools
+import random
+import time
 import grpc
 import myuber_pb2
 import myuber_pb2_grpc
+from myuber_channels import create_aio_channel, create_channel
 from myuber_logger import logger
-import time
+from myuber_sharding import ShardRouter, parse_targets
+
+# Trailing metadata the server sends with RESOURCE_EXHAUSTED (same key as myuber_server.RETRY_AFTER_KEY)
+RETRY_AFTER_KEY = "retry-after-ms"
+# Shard lists verify_shards has found to match their servers
+_verified_shard_lists = set()
+
+def verify_shards(targets, insecure=False, timeout=5.0):
+    # Check, once per process and shard list, that every server was started with its position in the list as
+    # --shard-id. Ride IDs carry the shard that created them, so with a server that has another or no shard ID
+    # every later call about its rides would go to the wrong server. Raises ValueError on a mismatch; a list
+    # with a server that cannot be reached is checked again by the next client.
+    if len(targets) == 1 or tuple(targets) in _verified_shard_lists:
+        return
+    wrong = []
+    for shard, target in enumerate(targets):
+        # A short-lived blocking channel, so the asyncio classes can check the list too
+        channel = create_channel(target, insecure)
+        try:
+            shard_id = myuber_pb2_grpc.RideSharingStub(channel).GetStats(myuber_pb2.StatsRequest(),
+                                                                         timeout=timeout).shard_id
+        except grpc.RpcError as e:
+            logger.warning("Could not check the shard ID of %s: %s", target, e.code())
+            return
+        finally:
+            channel.close()
+        if shard_id != shard:
+            wrong.append(f"{target} has {f'--shard-id {shard_id}' if shard_id >= 0 else 'no --shard-id'}, "
+                         f"expected --shard-id {shard}")
+    if wrong:
+        raise ValueError(f"Servers do not match their positions in the shard list: {'; '.join(wrong)}")
+    _verified_shard_lists.add(tuple(targets))
+
+def create_router(target, insecure=False, channel_pool=None, aio=False):
+    # Shard router with a channel per server in target: taken from channel_pool and shared with other
+    # clients when given, otherwise opened for this client alone (grpc.aio channels if aio is set).
+    # Raises ValueError if the servers were not started with matching --shard-id options.
+    targets = parse_targets(target)
+    verify_shards(targets, insecure)
+    if channel_pool is not None:
+        return ShardRouter(targets, lambda shard_target: channel_pool.channel(shard_target, insecure),
+                           owns_channels=False)
+    open_channel = create_aio_channel if aio else create_channel
+    return ShardRouter(targets, lambda shard_target: open_channel(shard_target, insecure))
+
+def build_ride_request(rider_id, pickup=None, max_wait=None):
+    # RideRequest with the (lat, lng) pickup and the longest wait for a driver if given
+    request = myuber_pb2.RideRequest(rider_id=rider_id)
+    if pickup is not None:
+        request.pickup.latitude, request.pickup.longitude = pickup
+    if max_wait is not None:
+        request.max_wait_seconds = max_wait
+    return request
+
+def build_ride_batches(router, rides):
+    # Split (rider_id, pickup) pairs into one RequestRidesRequest per shard: [(shard, group, request)],
+    # where group lists the (position, ride) pairs the request covers
+    batches = []
+    groups = router.group(rides, lambda ride: router.shard_for_location(ride[1], ride[0]))
+    for shard, group in groups.items():
+        request = myuber_pb2.RequestRidesRequest()
+        for _, (rider_id, pickup) in group:
+            ride_request = request.requests.add(rider_id=rider_id)
+            if pickup is not None:
+                ride_request.pickup.latitude, ride_request.pickup.longitude = pickup
+        batches.append((shard, group, request))
+    return batches
+
+def build_status_batches(router, ride_ids):
+    # Split ride IDs into one GetRideStatusesRequest per shard: [(shard, group, request)]
+    return [(shard, group, myuber_pb2.GetRideStatusesRequest(ride_ids=[ride_id for _, ride_id in group]))
+            for shard, group in router.group(ride_ids, router.shard_for_ride).items()]
+
+def merge_history_pages(calls, max_rides=0):
+    # Merge HistoryPage streams from several shards into one stream of ArchivedRide, newest first;
+    # each shard's pages are only fetched as the merge reaches them
+    streams = [(ride for page in call for ride in page.rides) for call in calls]
+    rides = heapq.merge(*streams, key=lambda ride: ride.completed_at_ms, reverse=True)
+    return itertools.islice(rides, max_rides or None)
+
+def retry_delay(error, attempt, base, cap):
+    # Exponential backoff with full jitter, added on top of the server's retry-after hint so
+    # riders shed together do not all come back at the same moment
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    for key, value in error.trailing_metadata() or ():
+        if key == RETRY_AFTER_KEY:
+            delay += int(value) / 1000
+    return delay
 
 class MyUberClient:
-    def __init__(self, target='localhost:50051'):
-        # Load SSL certificates
-        with open('ca.crt', 'rb') as f:
-            root_certificates = f.read()
-        with open('client.key', 'rb') as f:
-            private_key = f.read()
-        with open('client.crt', 'rb') as f:
-            certificate_chain = f.read()
-
-        # Create SSL credentials
-        credentials = grpc.ssl_channel_credentials(
-            root_certificates=root_certificates,
-            private_key=private_key,
-            certificate_chain=certificate_chain
-        )
-        # Establish a secure channel to the server
-        self.channel = grpc.secure_channel(target, credentials)
-        # Create a stub (client) for the RideSharing service
-        self.stub = myuber_pb2_grpc.RideSharingStub(self.channel)
-
-    def request_ride(self, rider_id):
+    def __init__(self, target='localhost:50051', insecure=False, max_attempts=5, backoff_base=0.2,
+                 backoff_cap=10.0, channel_pool=None):
+        # One channel per shard when target lists several servers; rides go to the shard owning their pickup.
+        # Pass a ChannelPool to share connections between many client objects.
+        self.router = create_router(target, insecure, channel_pool)
+        # Stub (client) for the RideSharing service of the first, usually only, shard
+        self.stub = self.router.stubs[0]
+        # Retry policy for ride requests shed by an overloaded server
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+    def close(self):
+        # Close the channels to every shard
+        self.router.close()
+
+    def request_ride(self, rider_id, pickup=None, max_wait=None, timeout=None):
         # Log the ride request
-        logger.info(f"Requesting ride for rider {rider_id}")
+        logger.info("Requesting ride for rider %s", rider_id)
         # Create a RideRequest message
-        request = myuber_pb2.RideRequest(rider_id=rider_id)
-        try:
-            # Send the ride request to the server
-            response = self.stub.RequestRide(request)
-            logger.info(f"Ride request response: {response}")
-            return response
-        except grpc.RpcError as e:
-            # Log any RPC errors
-            logger.error(f"RPC error occurred: {e}")
-            return None
+        request = build_ride_request(rider_id, pickup, max_wait)
+        stub = self.router.for_location(pickup, rider_id)
+        for attempt in range(self.max_attempts):
+            try:
+                # Send the ride request to the server, with an optional per-attempt deadline
+                response = stub.RequestRide(request, timeout=timeout)
+                logger.info("Ride request response: %s", response)
+                return response
+            except grpc.RpcError as e:
+                # Only shed requests are retried: the server created no ride, so a retry cannot duplicate it
+                if e.code() != grpc.StatusCode.RESOURCE_EXHAUSTED or attempt + 1 == self.max_attempts:
+                    # Log any RPC errors
+                    logger.error("RPC error occurred: %s", e)
+                    return None
+                delay = retry_delay(e, attempt, self.backoff_base, self.backoff_cap)
+                logger.warning("Ride request shed by the server, retrying in %.2fs", delay)
+                time.sleep(delay)
 
     def get_ride_status(self, ride_id):
         # Log the status request
-        logger.info(f"Getting status for ride {ride_id}")
+        logger.info("Getting status for ride %s", ride_id.hex())
         # Create a RideStatusRequest message
         request = myuber_pb2.RideStatusRequest(ride_id=ride_id)
         try:
             # Send the status request to the server
-            response = self.stub.GetRideStatus(request)
-            logger.info(f"Ride status: {response}")
+            response = self.router.for_ride(ride_id).GetRideStatus(request)
+            logger.info("Ride status: %s", response)
             return response
         except grpc.RpcError as e:
             # Log any RPC errors
-            logger.error(f"RPC error occurred: {e}")
+            logger.error("RPC error occurred: %s", e)
+            return None
+
+    def request_rides(self, rides):
+        # Request several rides in one RPC; rides is a list of (rider_id, pickup) pairs, pickup may be None
+        logger.info("Requesting %s rides", len(rides))
+        # One RPC per shard, sent concurrently
+        calls = [(group, self.router.stubs[shard].RequestRides.future(request))
+                 for shard, group, request in build_ride_batches(self.router, rides)]
+        try:
+            # One RideResponse per ride, in request order
+            results = [None] * len(rides)
+            for group, call in calls:
+                for (position, _), ride in zip(group, call.result().rides):
+                    results[position] = ride
+            return results
+        except grpc.RpcError as e:
+            # Log any RPC errors
+            logger.error("RPC error occurred: %s", e)
+            return None
+
+    def get_ride_statuses(self, ride_ids):
+        # Look up several rides in one RPC; returns a RideStatusResponse, or None if not found, per ride
+        calls = [(group, self.router.stubs[shard].GetRideStatuses.future(request))
+                 for shard, group, request in build_status_batches(self.router, ride_ids)]
+        try:
+            results = [None] * len(ride_ids)
+            for group, call in calls:
+                for (position, _), result in zip(group, call.result().results):
+                    results[position] = result.status if result.found else None
+            return results
+        except grpc.RpcError as e:
+            # Log any RPC errors
+            logger.error("RPC error occurred: %s", e)
             return None
 
+    def get_stats(self, shard=0):
+        # Fetch server metrics and gauges of one shard
+        try:
+            return self.router.stubs[shard].GetStats(myuber_pb2.StatsRequest())
+        except grpc.RpcError as e:
+            # Log any RPC errors
+            logger.error("RPC error occurred: %s", e)
+            return None
+
+    def watch_ride(self, ride_id, timeout=None):
+        # Log the watch request
+        logger.info("Watching ride %s", ride_id.hex())
+        # Create a RideStatusRequest message
+        request = myuber_pb2.RideStatusRequest(ride_id=ride_id)
+        try:
+            # Yield every status change pushed by the server, until the optional deadline
+            for response in self.router.for_ride(ride_id).WatchRide(request, timeout=timeout):
+                logger.info("Ride status update: %s", response)
+                yield response
+        except grpc.RpcError as e:
+            # Log any RPC errors
+            logger.error("RPC error occurred while watching ride: %s", e)
+
+    def get_rider_history(self, rider_id, max_rides=0, page_size=0):
+        # Yield a rider's completed rides (ArchivedRide) from the server archives, newest first. Rides are
+        # archived by the shard of their pickup region, so every shard is asked and the streams merged.
+        logger.info("Getting ride history for rider %s", rider_id)
+        request = myuber_pb2.HistoryRequest(owner_id=rider_id, max_rides=max_rides, page_size=page_size)
+        calls = [stub.GetRiderHistory(request) for stub in self.router.stubs]
+        try:
+            yield from merge_history_pages(calls, max_rides)
+        except grpc.RpcError as e:
+            # Log any RPC errors
+            logger.error("RPC error occurred while reading ride history: %s", e)
+        finally:
+            # Stop the streams when the caller has read enough
+            for call in calls:
+                call.cancel()
+
+def parse_location(text):
+    # Parse 'lat,lng' into a tuple, or return None for empty input
+    if not text.strip():
+        return None
+    latitude, longitude = text.split(",")
+    return (float(latitude), float(longitude))
+
 def run_client():
     # Create a client instance
     client = MyUberClient()
     # Get the rider ID from user input
     rider_id = input("Enter your rider ID: ")
-    
+    pickup = parse_location(input("Enter your pickup location as 'lat,lng' (leave empty to skip): "))
+
     # Request a ride
-    response = client.request_ride(rider_id)
+    response = client.request_ride(rider_id, pickup)
     if response:
         ride_id = response.ride_id
-        print(f"Ride requested. Ride ID: {ride_id}")
+        print(f"Ride requested. Ride ID: {ride_id.hex()}")
         
-        # Continuously check ride status
-        while True:
-            status = client.get_ride_status(ride_id)
-            if status:
-                print(f"Ride status: {status.status}")
-                if status.status == "COMPLETED":
-                    print("Ride completed. Exiting.")
-                    break
-                elif status.status == "DRIVER_ASSIGNED":
-                    print(f"Driver assigned: {status.driver_id}")
-                elif status.status == "REJECTED":
-                    print("Ride was rejected by the driver. Requesting a new ride...")
-                    # Request a new ride if the current one was rejected
-                    response = client.request_ride(rider_id)
-                    if response:
-                        ride_id = response.ride_id
-                        print(f"New ride requested. Ride ID: {ride_id}")
-                    else:
-                        print("Failed to request a new ride. Exiting.")
-                        break
-            time.sleep(5)  # Wait for 5 seconds before checking again
+        # Follow ride status changes as the server pushes them
+        for status in client.watch_ride(ride_id):
+            print(f"Ride status: {myuber_pb2.RideStatus.Name(status.status)}")
+            if status.status == myuber_pb2.COMPLETED:
+                print("Ride completed. Exiting.")
+                break
+            elif status.status == myuber_pb2.EXPIRED:
+                print("No driver was found in time. Exiting.")
+                break
+            elif status.status == myuber_pb2.DRIVER_ASSIGNED:
+                print(f"Driver assigned: {status.driver_id}")
+            elif status.status == myuber_pb2.REJECTED:
+                # The server puts rejected rides back in the queue for another driver
+                print("Ride was rejected by the driver. Waiting for reassignment...")
+        else:
+            print("Lost connection to the server. Exiting.")
 
 if __name__ == '__main__':
     run_client()
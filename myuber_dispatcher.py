@@ -0,0 +1,263 @@
+import heapq
+import itertools
+import threading
+import time
+from myuber_matching import build_cost_matrix, require_numpy, solve_assignment
+from myuber_metrics import LatencyHistogram
+from myuber_ride_store import now_ms
+
+# Dispatch modes: assign rides one by one in arrival order, or solve a batch at once
+GREEDY = "greedy"
+BATCH = "batch"
+# Batch mode: extra cost of offering a ride to a driver who declined it, large enough to never be chosen
+DECLINED_COST = 1e6
+
+class PendingRide:
+    # A ride waiting for a driver. Rides are served by priority: the wall-clock time of the
+    # original request, moved earlier by requeue_boost for every driver who declined the ride,
+    # so waiting rides age ahead of new ones and a re-queued ride does not start over at the back.
+    __slots__ = ("priority", "sequence", "ride_id", "pickup", "enqueued_at", "deadline", "declined",
+                 "exclude_until")
+
+    def __init__(self, priority, sequence, ride_id, pickup, enqueued_at, deadline, declined, exclude_until):
+        self.priority = priority
+        self.sequence = sequence  # Breaks priority ties in arrival order
+        self.ride_id = ride_id
+        self.pickup = pickup
+        self.enqueued_at = enqueued_at  # Monotonic time the ride entered the queue, for assignment latency
+        self.deadline = deadline  # Wall-clock ms, 0 for none
+        self.declined = declined  # Drivers who declined the ride, skipped until exclude_until
+        self.exclude_until = exclude_until
+
+    def __lt__(self, other):
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+    def excluded(self, now):
+        # Drivers this ride must not be offered to right now, or None
+        return self.declined if self.declined and now < self.exclude_until else None
+
+class Dispatcher:
+    def __init__(self, driver_manager, mode=GREEDY, batch_window=0.2, wait_penalty=0.1, max_optimal_batch=400,
+                 requeue_boost=10.0, decline_cooldown=30.0):
+        if mode not in (GREEDY, BATCH):
+            raise ValueError(f"Unknown dispatch mode: {mode}")
+        if mode == BATCH:
+            require_numpy()
+        self.driver_manager = driver_manager
+        self.mode = mode
+        # Batch mode: how long to collect rides and drivers before matching them
+        self.batch_window = batch_window
+        # Batch mode: km of pickup distance worth one second of rider wait
+        self.wait_penalty = wait_penalty
+        # Batch mode: larger batches are matched greedily instead of optimally
+        self.max_optimal_batch = max_optimal_batch
+        # Seconds of waiting credited to a ride for every decline
+        self.requeue_boost = requeue_boost
+        # Seconds during which a ride is not offered again to the drivers who declined it (0: never excluded)
+        self.decline_cooldown = decline_cooldown
+        # Pending rides: ride_id -> PendingRide, plus a priority heap and a (deadline, sequence, ride_id)
+        # heap over them. Both heaps use lazy deletion: entries of rides that were matched, expired or
+        # queued again are skipped when they come up and dropped when the heaps are rebuilt.
+        self.pending = {}
+        self.queue = []
+        self.deadlines = []
+        self.sequence = itertools.count()
+        # Places held by admitted rides that are not queued yet (see reserve())
+        self.reserved = 0
+        # Signalled whenever a ride or a driver becomes available
+        self.condition = threading.Condition()
+        self.closed = False
+        # Optional extra wakeup hook, used by the asyncio allocator task
+        self.wakeup_callback = None
+        # Time from entering the queue to getting a driver
+        self.assignment_latency = LatencyHistogram()
+
+    def reserve(self, count, limit):
+        # Admission control: check that `count` more rides fit in a queue of at most `limit` (0: unbounded)
+        # and hold places for them, in one step so concurrent requests cannot all pass the check.
+        # Queue the rides with reserved=True, or give the places back with release().
+        with self.condition:
+            if limit and len(self.pending) + self.reserved + count > limit:
+                return False
+            self.reserved += count
+            return True
+
+    def release(self, count):
+        # Give back places held by reserve() for rides that will not be queued
+        with self.condition:
+            self.reserved -= count
+
+    def add_ride(self, ride_id, pickup=None, deadline=0, requested_at=None, declined=(), reserved=False):
+        # Queue a ride, with an optional (lat, lng) pickup and deadline, and wake up the allocator.
+        # A re-queued ride passes its original request time (wall-clock ms) and the drivers who declined it.
+        with self.condition:
+            if reserved:
+                self.reserved -= 1
+            self._push_locked(ride_id, pickup, deadline, requested_at, declined, time.monotonic())
+            self._wake_locked()
+
+    def add_rides(self, rides, reserved=False):
+        # Queue several (ride_id, pickup, deadline) tuples with a single wakeup
+        now = time.monotonic()
+        requested_at = now_ms()
+        with self.condition:
+            if reserved:
+                self.reserved -= len(rides)
+            for ride_id, pickup, deadline in rides:
+                self._push_locked(ride_id, pickup, deadline, requested_at, (), now)
+            self._wake_locked()
+
+    def expire_rides(self, now):
+        # Drop pending rides whose deadline is at or before `now` (wall-clock ms) and return their IDs
+        with self.condition:
+            expired = []
+            while self.deadlines and self.deadlines[0][0] <= now:
+                _, sequence, ride_id = heapq.heappop(self.deadlines)
+                entry = self.pending.get(ride_id)
+                if entry is not None and entry.sequence == sequence:
+                    del self.pending[ride_id]
+                    expired.append(ride_id)
+            return expired
+
+    def add_driver(self, driver_id):
+        # Make a driver available and wake up the allocator
+        with self.condition:
+            self.driver_manager.add_available_driver(driver_id)
+            self._wake_locked()
+
+    def notify(self):
+        # Wake up the allocator after drivers were added elsewhere
+        with self.condition:
+            self._wake_locked()
+
+    def pending_count(self):
+        # Return the number of rides waiting for a driver
+        return len(self.pending)
+
+    def close(self):
+        # Stop the allocator
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def match(self):
+        # Pair as many pending rides with free drivers as possible without waiting
+        with self.condition:
+            return self._match_locked()
+
+    def next_batch(self, timeout=None):
+        # Block until at least one ride can be matched, then match all that can be
+        with self.condition:
+            while not self.closed:
+                if self._can_match():
+                    if self.mode == BATCH:
+                        # Keep collecting rides and drivers until the window closes
+                        window_end = time.monotonic() + self.batch_window
+                        remaining = self.batch_window
+                        while not self.closed and remaining > 0:
+                            self.condition.wait(remaining)
+                            remaining = window_end - time.monotonic()
+                    pairs = self._match_locked()
+                    if pairs:
+                        return pairs
+                # Nothing to do, or every free driver declined every pending ride: wait for a change
+                if not self.condition.wait(timeout):
+                    return []
+            return []
+
+    def can_match(self):
+        # Whether at least one pending ride could get a driver right now
+        with self.condition:
+            return self._can_match()
+
+    def _wake_locked(self):
+        self.condition.notify()
+        if self.wakeup_callback is not None:
+            self.wakeup_callback()
+
+    def _can_match(self):
+        return bool(self.pending) and self.driver_manager.get_available_drivers_count() > 0
+
+    def _match_locked(self):
+        if self.mode == BATCH:
+            return self._match_batch_locked()
+        return self._match_greedy_locked()
+
+    def _push_locked(self, ride_id, pickup, deadline, requested_at, declined, now):
+        if requested_at is None:
+            requested_at = now_ms()
+        priority = requested_at - int(self.requeue_boost * 1000) * len(declined)
+        exclude_until = now + self.decline_cooldown if declined else 0.0
+        entry = PendingRide(priority, next(self.sequence), ride_id, pickup, now, deadline, declined, exclude_until)
+        # A ride queued again replaces its old entry, which the heaps then skip
+        self.pending[ride_id] = entry
+        heapq.heappush(self.queue, entry)
+        if deadline:
+            heapq.heappush(self.deadlines, (deadline, entry.sequence, ride_id))
+        if len(self.queue) + len(self.deadlines) > 4 * len(self.pending) + 64:
+            self._compact_locked()
+
+    def _compact_locked(self):
+        # Rebuild both heaps from the live entries once stale ones dominate
+        self.queue = list(self.pending.values())
+        heapq.heapify(self.queue)
+        self.deadlines = [(entry.deadline, entry.sequence, entry.ride_id) for entry in self.queue if entry.deadline]
+        heapq.heapify(self.deadlines)
+
+    def _match_batch_locked(self):
+        # Match every pending ride against every free driver with one cost matrix
+        drivers = self.driver_manager.available_driver_locations()
+        if not self.pending or not drivers:
+            return []
+        now = time.monotonic()
+        wall_now = now_ms()
+        rides = list(self.pending.values())
+        # Rides wait longer in the cost matrix by their original request time and declines
+        cost = build_cost_matrix(
+            [entry.pickup for entry in rides],
+            [location for _, location in drivers],
+            [(wall_now - entry.priority) / 1000 for entry in rides],
+            wait_penalty=self.wait_penalty)
+        driver_columns = {driver_id: column for column, (driver_id, _) in enumerate(drivers)}
+        for ride_index, entry in enumerate(rides):
+            for driver_id in entry.excluded(now) or ():
+                column = driver_columns.get(driver_id)
+                if column is not None:
+                    cost[ride_index, column] += DECLINED_COST
+        pairs = []
+        for ride_index, driver_index in solve_assignment(cost, self.max_optimal_batch):
+            entry = rides[ride_index]
+            driver_id = drivers[driver_index][0]
+            if cost[ride_index, driver_index] >= DECLINED_COST / 2:
+                # Only a driver who declined this ride was left for it
+                continue
+            if not self.driver_manager.take_driver(driver_id):
+                continue
+            del self.pending[entry.ride_id]
+            self.assignment_latency.record(now - entry.enqueued_at)
+            pairs.append((entry.ride_id, driver_id))
+        if pairs:
+            self._compact_locked()
+        return pairs
+
+    def _match_greedy_locked(self):
+        # Rides in priority order each take the nearest free driver who has not declined them
+        pairs = []
+        skipped = []
+        now = time.monotonic()
+        while self.queue and self.driver_manager.get_available_drivers_count() > 0:
+            entry = heapq.heappop(self.queue)
+            if self.pending.get(entry.ride_id) is not entry:
+                # Lazy deletion: the ride was matched, expired or queued again since
+                continue
+            driver_id = self.driver_manager.assign_driver(entry.pickup, entry.excluded(now))
+            if driver_id is None:
+                # Every free driver declined this ride; it keeps its place for the next match
+                skipped.append(entry)
+                continue
+            del self.pending[entry.ride_id]
+            self.assignment_latency.record(now - entry.enqueued_at)
+            pairs.append((entry.ride_id, driver_id))
+        for entry in skipped:
+            heapq.heappush(self.queue, entry)
+        return pairs
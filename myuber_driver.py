@@ -1,77 +1,159 @@
 import grpc
 import myuber_pb2
-import myuber_pb2_grpc
+from myuber_client import create_router, merge_history_pages, parse_location
 from myuber_logger import logger
-import time
 import threading
 
+def build_registration(driver_id, location=None):
+    # DriverRegistrationRequest with the (lat, lng) location if given
+    request = myuber_pb2.DriverRegistrationRequest(driver_id=driver_id)
+    if location is not None:
+        request.location.latitude, request.location.longitude = location
+    return request
+
+def build_registration_batches(router, drivers):
+    # Split (driver_id, location) pairs into one RegisterDriversRequest per shard: [(shard, group, request)],
+    # each driver going to the shard that owns its region
+    batches = []
+    groups = router.group(drivers, lambda driver: router.shard_for_location(driver[1], driver[0]))
+    for shard, group in groups.items():
+        request = myuber_pb2.RegisterDriversRequest()
+        for _, (driver_id, location) in group:
+            registration = request.drivers.add(driver_id=driver_id)
+            if location is not None:
+                registration.location.latitude, registration.location.longitude = location
+        batches.append((shard, group, request))
+    return batches
+
+def build_heartbeat(driver_id, location=None):
+    # HeartbeatRequest with the driver's current (lat, lng) position if given
+    request = myuber_pb2.HeartbeatRequest(driver_id=driver_id)
+    if location is not None:
+        request.location.latitude, request.location.longitude = location
+    return request
+
 class MyUberDriver:
-    def __init__(self, driver_id, target='localhost:50051'):
+    def __init__(self, driver_id, target='localhost:50051', insecure=False, channel_pool=None):
         self.driver_id = driver_id
-        # Load SSL certificates
-        with open('ca.crt', 'rb') as f:
-            root_certificates = f.read()
-        with open('client.key', 'rb') as f:
-            private_key = f.read()
-        with open('client.crt', 'rb') as f:
-            certificate_chain = f.read()
-
-        # Create SSL credentials
-        credentials = grpc.ssl_channel_credentials(
-            root_certificates=root_certificates,
-            private_key=private_key,
-            certificate_chain=certificate_chain
-        )
-        # Establish a secure channel to the server
-        self.channel = grpc.secure_channel(target, credentials)
-        # Create a stub (client) for the RideSharing service
-        self.stub = myuber_pb2_grpc.RideSharingStub(self.channel)
+        # One channel per shard when target lists several servers; pass a ChannelPool to share
+        # connections between many driver objects
+        self.router = create_router(target, insecure, channel_pool)
+        # Stub (client) for the RideSharing service of the driver's home shard, which is chosen by the
+        # region the driver registers in and serves all of its presence and assignment calls
+        self.stub = self.router.for_location(None, driver_id)
         self.current_ride_id = None
 
-    def register_driver(self):
+    def close(self):
+        # Close the channels to every shard
+        self.router.close()
+
+    def register_driver(self, location=None):
         # Log the driver registration attempt
-        logger.info(f"Registering driver {self.driver_id}")
+        logger.info("Registering driver %s", self.driver_id)
         # Create a DriverRegistrationRequest message
-        request = myuber_pb2.DriverRegistrationRequest(driver_id=self.driver_id)
+        request = build_registration(self.driver_id, location)
+        self.stub = self.router.for_location(location, self.driver_id)
         try:
             # Send the registration request to the server
             response = self.stub.RegisterDriver(request)
-            logger.info(f"Driver registration response: {response}")
+            logger.info("Driver registration response: %s", response)
             return response
         except grpc.RpcError as e:
             # Log any RPC errors
-            logger.error(f"RPC error occurred: {e}")
+            logger.error("RPC error occurred: %s", e)
+            return None
+
+    def register_drivers(self, drivers):
+        # Register a whole fleet in one RPC; drivers is a list of (driver_id, location) pairs,
+        # location may be None. Returns one DriverRegistrationResponse per driver.
+        logger.info("Registering %s drivers", len(drivers))
+        # One RPC per shard, sent concurrently
+        calls = [(group, self.router.stubs[shard].RegisterDrivers.future(request))
+                 for shard, group, request in build_registration_batches(self.router, drivers)]
+        try:
+            results = [None] * len(drivers)
+            for group, call in calls:
+                for (position, _), result in zip(group, call.result().results):
+                    results[position] = result
+            return results
+        except grpc.RpcError as e:
+            # Log any RPC errors
+            logger.error("RPC error occurred: %s", e)
+            return None
+
+    def heartbeat(self, location=None):
+        # Renew the driver's presence lease, optionally with its current (lat, lng) position
+        try:
+            return self.stub.Heartbeat(build_heartbeat(self.driver_id, location))
+        except grpc.RpcError as e:
+            # Log any RPC errors
+            logger.error("RPC error occurred while sending heartbeat: %s", e)
+            return None
+
+    def start_heartbeats(self, interval=None):
+        # Send heartbeats from a background thread, by default three per lease period
+        stop = threading.Event()
+
+        def run():
+            delay = interval
+            while True:
+                response = self.heartbeat()
+                if delay is None:
+                    delay = response.lease_seconds / 3 if response is not None and response.lease_seconds else 5.0
+                if stop.wait(delay):
+                    return
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        # Set the returned event to stop sending heartbeats
+        return stop
+
+    def update_location(self, latitude, longitude):
+        # Send the driver's current position to its home shard. A driver does not change shards by
+        # moving: call register_driver with the new location to move to the shard of the new region.
+        if self.router.for_location((latitude, longitude), self.driver_id) is not self.stub:
+            logger.warning("Driver %s moved to a region of another shard; register again to be offered its rides",
+                           self.driver_id)
+        request = myuber_pb2.DriverLocationUpdate(driver_id=self.driver_id)
+        request.location.latitude = latitude
+        request.location.longitude = longitude
+        try:
+            return self.stub.UpdateDriverLocation(request)
+        except grpc.RpcError as e:
+            # Log any RPC errors
+            logger.error("RPC error occurred while updating location: %s", e)
             return None
 
     def accept_ride(self, ride_id):
         # Log the ride acceptance attempt
-        logger.info(f"Driver {self.driver_id} accepting ride {ride_id}")
+        logger.info("Driver %s accepting ride %s", self.driver_id, ride_id.hex())
         # Create an AcceptRideRequest message
         request = myuber_pb2.AcceptRideRequest(ride_id=ride_id, driver_id=self.driver_id)
         try:
             # Send the accept ride request to the server
-            response = self.stub.AcceptRide(request)
-            logger.info(f"Ride acceptance response: {response}")
+            response = self.router.for_ride(ride_id).AcceptRide(request)
+            logger.info("Ride acceptance response: %s", response)
             self.current_ride_id = ride_id
             return response
         except grpc.RpcError as e:
             # Log any RPC errors
-            logger.error(f"RPC error occurred: {e}")
+            logger.error("RPC error occurred: %s", e)
             return None
 
     def reject_ride(self, ride_id):
         # Log the ride rejection attempt
-        logger.info(f"Driver {self.driver_id} rejecting ride {ride_id}")
+        logger.info("Driver %s rejecting ride %s", self.driver_id, ride_id.hex())
         # Create a RejectRideRequest message
         request = myuber_pb2.RejectRideRequest(ride_id=ride_id, driver_id=self.driver_id)
         try:
             # Send the reject ride request to the server
-            response = self.stub.RejectRide(request)
-            logger.info(f"Ride rejection response: {response}")
+            response = self.router.for_ride(ride_id).RejectRide(request)
+            logger.info("Ride rejection response: %s", response)
             return response
         except grpc.RpcError as e:
             # Log any RPC errors
-            logger.error(f"RPC error occurred: {e}")
+            logger.error("RPC error occurred: %s", e)
             return None
 
     def complete_ride(self):
@@ -80,18 +162,18 @@ class MyUberDriver:
             return None
 
         # Log the ride completion attempt
-        logger.info(f"Driver {self.driver_id} completing ride {self.current_ride_id}")
+        logger.info("Driver %s completing ride %s", self.driver_id, self.current_ride_id.hex())
         # Create a RideCompletionRequest message
         request = myuber_pb2.RideCompletionRequest(ride_id=self.current_ride_id, driver_id=self.driver_id)
         try:
             # Send the complete ride request to the server
-            response = self.stub.CompleteRide(request)
-            logger.info(f"Ride completion response: {response}")
+            response = self.router.for_ride(self.current_ride_id).CompleteRide(request)
+            logger.info("Ride completion response: %s", response)
             self.current_ride_id = None
             return response
         except grpc.RpcError as e:
             # Log any RPC errors
-            logger.error(f"RPC error occurred: {e}")
+            logger.error("RPC error occurred: %s", e)
             return None
 
     def check_for_ride(self):
@@ -101,28 +183,64 @@ class MyUberDriver:
             return response.ride_id if response.has_ride else None
         except grpc.RpcError as e:
             # Log any RPC errors
-            logger.error(f"RPC error occurred while checking for ride: {e}")
+            logger.error("RPC error occurred while checking for ride: %s", e)
             return None
 
+    def watch_assignments(self):
+        # Log the watch request
+        logger.info("Driver %s watching for assignments", self.driver_id)
+        request = myuber_pb2.WatchAssignmentsRequest(driver_id=self.driver_id)
+        try:
+            # Yield every assignment change pushed by the server
+            for assignment in self.stub.WatchAssignments(request):
+                logger.info("Assignment update: %s", assignment)
+                yield assignment
+        except grpc.RpcError as e:
+            # Log any RPC errors
+            logger.error("RPC error occurred while watching for assignments: %s", e)
+
+    def get_driver_history(self, max_rides=0, page_size=0):
+        # Yield the driver's completed rides (ArchivedRide) from the server archives, newest first,
+        # merged across shards like MyUberClient.get_rider_history
+        logger.info("Getting ride history for driver %s", self.driver_id)
+        request = myuber_pb2.HistoryRequest(owner_id=self.driver_id, max_rides=max_rides, page_size=page_size)
+        calls = [stub.GetDriverHistory(request) for stub in self.router.stubs]
+        try:
+            yield from merge_history_pages(calls, max_rides)
+        except grpc.RpcError as e:
+            # Log any RPC errors
+            logger.error("RPC error occurred while reading ride history: %s", e)
+        finally:
+            # Stop the streams when the caller has read enough
+            for call in calls:
+                call.cancel()
+
 def run_driver():
     # Get the driver ID from user input
     driver_id = input("Enter your driver ID: ")
+    location = parse_location(input("Enter your location as 'lat,lng' (leave empty to skip): "))
     driver = MyUberDriver(driver_id)
-    
+
     # Register the driver
-    registration_response = driver.register_driver()
+    registration_response = driver.register_driver(location)
     if not registration_response or not registration_response.success:
         print("Failed to register driver. Exiting.")
         return
 
     print(f"Driver {driver_id} registered successfully.")
+    # The server decides how long an offer stays open; servers that do not say use the old 10 seconds
+    acceptance_timeout = registration_response.acceptance_timeout_seconds or 10.0
+    # Stay online between assignment streams
+    driver.start_heartbeats()
 
-    while True:
-        print("\nChecking for ride assignment...")
-        ride_id = driver.check_for_ride()
-        
-        if ride_id:
-            print(f"Ride {ride_id} assigned. You have 10 seconds to accept.")
+    print("\nWaiting for ride assignment...")
+    for assignment in driver.watch_assignments():
+        ride_id = assignment.ride_id
+        if assignment.status != myuber_pb2.DRIVER_ASSIGNED:
+            # The offer was withdrawn by the server (e.g. after the acceptance timeout)
+            print(f"Ride {ride_id.hex()} is no longer assigned to you.")
+        else:
+            print(f"Ride {ride_id.hex()} assigned. You have {acceptance_timeout:g} seconds to accept.")
             
             def timed_input():
                 choice[0] = input("Enter 'a' to accept or 'r' to reject: ")
@@ -131,7 +249,7 @@ def run_driver():
             # Start a thread to get user input with a timeout
             input_thread = threading.Thread(target=timed_input)
             input_thread.start()
-            input_thread.join(timeout=10)
+            input_thread.join(timeout=acceptance_timeout)
 
             if choice[0] is None:
                 print("\nTime's up! Ride automatically rejected.")
@@ -161,10 +279,9 @@ def run_driver():
                     print("Failed to reject ride. It may have been automatically rejected.")
             else:
                 print("Invalid choice. Ride may be reassigned.")
-        else:
-            print("No ride assigned. Waiting...")
-        
-        time.sleep(5)  # Wait for 5 seconds before checking again
+        print("\nWaiting for ride assignment...")
+    else:
+        print("Lost connection to the server. Exiting.")
 
 if __name__ == '__main__':
     run_driver()
@@ -0,0 +1,39 @@
+import queue
+import threading
+
+class RideEventBroker:
+    def __init__(self):
+        # Subscriber queues keyed by topic (driver ID or ride ID)
+        self.subscribers = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, topic, subscriber=None):
+        # Register a queue that will receive every event published on the topic
+        if subscriber is None:
+            subscriber = queue.Queue()
+        with self.lock:
+            self.subscribers.setdefault(topic, []).append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, topic, subscriber):
+        # Remove a queue from the topic and drop the topic once it is empty
+        with self.lock:
+            topic_subscribers = self.subscribers.get(topic)
+            if not topic_subscribers:
+                return
+            if subscriber in topic_subscribers:
+                topic_subscribers.remove(subscriber)
+            if not topic_subscribers:
+                del self.subscribers[topic]
+
+    def publish(self, topic, event):
+        # Push an event to every subscriber of the topic without blocking
+        with self.lock:
+            topic_subscribers = list(self.subscribers.get(topic, ()))
+        for subscriber in topic_subscribers:
+            subscriber.put_nowait(event)
+
+    def close(self, topic, subscriber):
+        # Wake up a subscriber so its stream can finish
+        subscriber.put_nowait(None)
+        self.unsubscribe(topic, subscriber)
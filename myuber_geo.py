@@ -0,0 +1,104 @@
+import heapq
+import math
+
+# Kilometres per degree of latitude
+KM_PER_DEGREE = 111.2
+
+def distance_km(lat1, lng1, lat2, lng2):
+    # Equirectangular approximation, accurate enough at city scale
+    x = math.radians(lng2 - lng1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return math.hypot(x, y) * 6371.0
+
+class GridIndex:
+    def __init__(self, cell_size=0.01):
+        # Uniform grid of cell_size x cell_size degree cells (about 1 km at 0.01)
+        self.cell_size = cell_size
+        self.cells = {}  # (row, col) -> set of ids
+        self.positions = {}  # id -> (lat, lng, cell)
+        # Bounding box of every cell ever used, to stop the ring search
+        self.min_cell = None
+        self.max_cell = None
+
+    def __contains__(self, item_id):
+        return item_id in self.positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def cell_of(self, lat, lng):
+        return (math.floor(lat / self.cell_size), math.floor(lng / self.cell_size))
+
+    def update(self, item_id, lat, lng):
+        # Insert an item or move it; only touches the grid if the cell changed
+        cell = self.cell_of(lat, lng)
+        previous = self.positions.get(item_id)
+        if previous is not None and previous[2] != cell:
+            self._remove_from_cell(item_id, previous[2])
+        if previous is None or previous[2] != cell:
+            self.cells.setdefault(cell, set()).add(item_id)
+            self._extend_bounds(cell)
+        self.positions[item_id] = (lat, lng, cell)
+
+    def remove(self, item_id):
+        # Remove an item if it is indexed
+        previous = self.positions.pop(item_id, None)
+        if previous is not None:
+            self._remove_from_cell(item_id, previous[2])
+
+    def position(self, item_id):
+        # Return the (lat, lng) of an item, or None
+        previous = self.positions.get(item_id)
+        return None if previous is None else previous[:2]
+
+    def nearest(self, lat, lng, k=1, exclude=None):
+        # Return up to k (distance_km, id) pairs, closest first, searching rings of cells outward
+        if not self.positions:
+            return []
+        row, col = self.cell_of(lat, lng)
+        max_ring = max(abs(row - self.min_cell[0]), abs(row - self.max_cell[0]),
+                       abs(col - self.min_cell[1]), abs(col - self.max_cell[1]))
+        # A cell r rings away is at least (r - 1) cells away along some axis
+        ring_km = self.cell_size * KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01)
+        best = []  # max-heap of (-distance, id)
+        for ring in range(max_ring + 1):
+            if len(best) >= k and (ring - 1) * ring_km > -best[0][0]:
+                break
+            for cell in self._ring_cells(row, col, ring):
+                for item_id in self.cells.get(cell, ()):
+                    if exclude is not None and item_id in exclude:
+                        continue
+                    item_lat, item_lng, _ = self.positions[item_id]
+                    distance = distance_km(lat, lng, item_lat, item_lng)
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, item_id))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, item_id))
+        return sorted((-negative, item_id) for negative, item_id in best)
+
+    def _ring_cells(self, row, col, ring):
+        # Cells whose Chebyshev distance from (row, col) is exactly `ring`
+        if ring == 0:
+            yield (row, col)
+            return
+        for d in range(-ring, ring + 1):
+            yield (row - ring, col + d)
+            yield (row + ring, col + d)
+        for d in range(-ring + 1, ring):
+            yield (row + d, col - ring)
+            yield (row + d, col + ring)
+
+    def _remove_from_cell(self, item_id, cell):
+        items = self.cells.get(cell)
+        if items is not None:
+            items.discard(item_id)
+            if not items:
+                del self.cells[cell]
+
+    def _extend_bounds(self, cell):
+        if self.min_cell is None:
+            self.min_cell = cell
+            self.max_cell = cell
+        else:
+            self.min_cell = (min(self.min_cell[0], cell[0]), min(self.min_cell[1], cell[1]))
+            self.max_cell = (max(self.max_cell[0], cell[0]), max(self.max_cell[1], cell[1]))
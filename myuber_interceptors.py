@@ -1,13 +1,203 @@
+import asyncio
+import time
 import grpc
-from myuber_logger import logger
+from myuber_logger import logger, current_method
+
+def wrap_rpc_handler(handler, wrap):
+    # Return a copy of an RPC method handler with its behavior passed through
+    # wrap(behavior, response_streaming)
+    if handler is None:
+        return None
+    for kind in ("unary_unary", "unary_stream", "stream_unary", "stream_stream"):
+        behavior = getattr(handler, kind)
+        if behavior is not None:
+            return handler._replace(**{kind: wrap(behavior, handler.response_streaming)})
+    return handler
+
+def log_under_method(behavior, method):
+    # Tag every record the handler logs with its RPC method. The threaded server runs
+    # interceptors and handlers on different threads, so this is set in the handler itself.
+    def wrapper(request, context):
+        current_method.set(method)
+        return behavior(request, context)
+    return wrapper
+
+def call_cancelled(context):
+    # Whether the client went away; grpc.aio contexts have cancelled(), threaded ones is_active()
+    if hasattr(context, "cancelled"):
+        return context.cancelled()
+    return not context.is_active()
+
+def call_code(context, failed):
+    # Name of the status code an RPC finished with
+    code = context.code()
+    if code is not None:
+        return code.name
+    if call_cancelled(context):
+        return "CANCELLED"
+    return "UNKNOWN" if failed else "OK"
+
+def deadline_passed(context):
+    # Whether the client's deadline ran out before the handler started (time_remaining() is None without one)
+    remaining = context.time_remaining()
+    return remaining is not None and remaining <= 0
+
+def enforce_deadline(behavior, streaming):
+    # Skip the work of requests that waited in the thread pool queue past their deadline
+    if streaming:
+        def stream_wrapper(request, context):
+            if deadline_passed(context):
+                context.abort(grpc.StatusCode.DEADLINE_EXCEEDED, "Deadline exceeded before the request was handled")
+            yield from behavior(request, context)
+        return stream_wrapper
+
+    def wrapper(request, context):
+        if deadline_passed(context):
+            context.abort(grpc.StatusCode.DEADLINE_EXCEEDED, "Deadline exceeded before the request was handled")
+        return behavior(request, context)
+    return wrapper
+
+def enforce_deadline_async(behavior, streaming):
+    # enforce_deadline() for grpc.aio handlers, which may start late on a busy event loop
+    if streaming:
+        async def stream_wrapper(request, context):
+            if deadline_passed(context):
+                await context.abort(grpc.StatusCode.DEADLINE_EXCEEDED,
+                                    "Deadline exceeded before the request was handled")
+            async for response in behavior(request, context):
+                yield response
+        return stream_wrapper
+
+    async def wrapper(request, context):
+        if deadline_passed(context):
+            await context.abort(grpc.StatusCode.DEADLINE_EXCEEDED, "Deadline exceeded before the request was handled")
+        return await behavior(request, context)
+    return wrapper
+
+def measure_calls(behavior, streaming, method, metrics):
+    # Record the status code and latency of every call; streams are timed until they end
+    if streaming:
+        def stream_wrapper(request, context):
+            start = time.perf_counter()
+            failed = True
+            try:
+                yield from behavior(request, context)
+                failed = False
+            finally:
+                metrics.record_call(method, call_code(context, failed), time.perf_counter() - start)
+        return stream_wrapper
+
+    def wrapper(request, context):
+        start = time.perf_counter()
+        failed = True
+        try:
+            response = behavior(request, context)
+            failed = False
+            return response
+        finally:
+            metrics.record_call(method, call_code(context, failed), time.perf_counter() - start)
+    return wrapper
+
+def measure_calls_async(behavior, streaming, method, metrics):
+    # measure_calls() for grpc.aio handlers
+    if streaming:
+        async def stream_wrapper(request, context):
+            start = time.perf_counter()
+            failed = True
+            cancelled = False
+            try:
+                async for response in behavior(request, context):
+                    yield response
+                failed = False
+            except asyncio.CancelledError:
+                # The handler task is cancelled before the context reports it
+                cancelled = True
+                raise
+            finally:
+                code = "CANCELLED" if cancelled else call_code(context, failed)
+                metrics.record_call(method, code, time.perf_counter() - start)
+        return stream_wrapper
+
+    async def wrapper(request, context):
+        start = time.perf_counter()
+        failed = True
+        cancelled = False
+        try:
+            response = await behavior(request, context)
+            failed = False
+            return response
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            code = "CANCELLED" if cancelled else call_code(context, failed)
+            metrics.record_call(method, code, time.perf_counter() - start)
+    return wrapper
 
 class LoggingInterceptor(grpc.ServerInterceptor):
     def intercept_service(self, continuation, handler_call_details):
         # Log incoming requests
-        logger.info(f"Received request: {handler_call_details.method}")
+        method = handler_call_details.method
+        logger.info("Received request: %s", method, extra={"method": method})
+        # Continue with the normal request processing
+        handler = continuation(handler_call_details)
+        return wrap_rpc_handler(handler, lambda behavior, streaming: log_under_method(behavior, method))
+
+class AsyncLoggingInterceptor(grpc.aio.ServerInterceptor):
+    async def intercept_service(self, continuation, handler_call_details):
+        # Log incoming requests on the asyncio server
+        method = handler_call_details.method
+        logger.info("Received request: %s", method, extra={"method": method})
+        # The handler runs in this task, so it sees the method through the context variable
+        current_method.set(method)
         # Continue with the normal request processing
-        return continuation(handler_call_details)
+        return await continuation(handler_call_details)
+
+class DeadlineInterceptor(grpc.ServerInterceptor):
+    def intercept_service(self, continuation, handler_call_details):
+        # Fail requests whose gRPC deadline has already passed instead of running them
+        handler = continuation(handler_call_details)
+        return wrap_rpc_handler(handler, enforce_deadline)
+
+class AsyncDeadlineInterceptor(grpc.aio.ServerInterceptor):
+    async def intercept_service(self, continuation, handler_call_details):
+        # DeadlineInterceptor for the asyncio server
+        handler = await continuation(handler_call_details)
+        return wrap_rpc_handler(handler, enforce_deadline_async)
+
+class MetricsInterceptor(grpc.ServerInterceptor):
+    def __init__(self, metrics):
+        # metrics is a ServerMetrics that collects per-method counts, codes and latencies
+        self.metrics = metrics
+
+    def intercept_service(self, continuation, handler_call_details):
+        method = handler_call_details.method
+        handler = continuation(handler_call_details)
+        return wrap_rpc_handler(
+            handler, lambda behavior, streaming: measure_calls(behavior, streaming, method, self.metrics))
+
+class AsyncMetricsInterceptor(grpc.aio.ServerInterceptor):
+    def __init__(self, metrics):
+        # MetricsInterceptor for the asyncio server
+        self.metrics = metrics
+
+    async def intercept_service(self, continuation, handler_call_details):
+        method = handler_call_details.method
+        handler = await continuation(handler_call_details)
+        return wrap_rpc_handler(
+            handler, lambda behavior, streaming: measure_calls_async(behavior, streaming, method, self.metrics))
+
+def get_interceptors(metrics=None):
+    # Return a list of interceptors to be used by the server; metrics wraps the others so it
+    # also times them and counts the requests turned away by the deadline check
+    interceptors = [DeadlineInterceptor(), LoggingInterceptor()]
+    if metrics is not None:
+        interceptors.insert(0, MetricsInterceptor(metrics))
+    return interceptors
 
-def get_interceptors():
-    # Return a list of interceptors to be used by the server
-    return [LoggingInterceptor()]
+def get_async_interceptors(metrics=None):
+    # Return the interceptors to be used by the asyncio server
+    interceptors = [AsyncDeadlineInterceptor(), AsyncLoggingInterceptor()]
+    if metrics is not None:
+        interceptors.insert(0, AsyncMetricsInterceptor(metrics))
+    return interceptors
@@ -1,12 +1,240 @@
+import atexit
+import contextvars
+import json
 import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
 
-# Configure logging
-logging.basicConfig(level=logging.INFO,
-                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                    handlers=[
-                        logging.FileHandler("myuber.log"),  # Log to file
-                        logging.StreamHandler()  # Log to console
-                    ])
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# RPC method being served, set by the logging interceptor for per-method sampling
+current_method = contextvars.ContextVar("current_method", default="")
+
+class MethodFilter(logging.Filter):
+    def filter(self, record):
+        # Tag every record with the RPC method it was logged under
+        if not hasattr(record, "method"):
+            record.method = current_method.get()
+        return True
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates):
+        # rates maps an RPC method to the fraction of its INFO/DEBUG records to keep
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        # Never drop warnings and errors
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(getattr(record, "method", ""), 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, per_second, burst=None):
+        # Token bucket per RPC method; records over the limit are dropped and counted
+        super().__init__()
+        self.per_second = per_second
+        self.burst = burst or per_second
+        self.buckets = {}  # method -> [tokens, last_refill]
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.setdefault(getattr(record, "method", ""), [self.burst, now])
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.per_second)
+            bucket[1] = now
+            if bucket[0] < 1:
+                self.dropped += 1
+                return False
+            bucket[0] -= 1
+            return True
+
+class StructuredFormatter(logging.Formatter):
+    def format(self, record):
+        # One JSON object per line, including any `extra` fields passed to the logger
+        entry = {
+            "time": self.formatTime(record),
+            "logger": record.name,
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "method": getattr(record, "method", ""),
+        }
+        for key, value in record.__dict__.items():
+            if key not in STANDARD_RECORD_FIELDS and key not in entry:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+# Attributes every LogRecord has; anything else came from `extra`
+STANDARD_RECORD_FIELDS = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime"}
+
+class FanOutHandler(logging.Handler):
+    def __init__(self, handlers):
+        # Front handler of sync mode: the filters decide once per record, then every sink writes it,
+        # so the file and the console keep the same records
+        super().__init__()
+        self.handlers = handlers
+
+    def emit(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def close(self):
+        for handler in self.handlers:
+            handler.close()
+        super().close()
+
+class LazyQueueHandler(logging.Handler):
+    def __init__(self, record_queue):
+        # Hand records to the writer thread without formatting them on the request thread
+        super().__init__()
+        self.queue = record_queue
+        self.dropped = 0  # Records lost because the writer fell behind
+
+    def emit(self, record):
+        if record.exc_info:
+            # Tracebacks must be rendered before the frames go away
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        try:
+            if record.levelno >= logging.WARNING:
+                # Warnings and errors wait briefly for room instead of being lost
+                self.queue.put(record, timeout=0.1)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            # Never block a request on routine logging
+            self.dropped += 1
+
+class BatchingLogWriter:
+    def __init__(self, record_queue, handlers, batch_size=512, flush_interval=0.2):
+        # Background thread that formats queued records and writes them in batches
+        self.queue = record_queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                batch = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            # Drain whatever else is already waiting, up to one batch
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.write([item for item in batch if isinstance(item, logging.LogRecord)])
+            # Wake flush() callers once everything queued before their marker is written
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+            # Records logged after stop() can land behind the marker in the same batch
+            if any(item is None for item in batch):
+                return
+
+    def write(self, records):
+        # One write and one flush per stream for the whole batch
+        for handler in self.handlers:
+            lines = [handler.format(record) for record in records if record.levelno >= handler.level]
+            if lines:
+                handler.stream.write("\n".join(lines) + "\n")
+                handler.flush()
+
+    def flush(self, timeout=5.0):
+        # Block until every record queued so far has been written
+        marker = threading.Event()
+        self.queue.put(marker)
+        marker.wait(timeout)
+
+    def stop(self):
+        # Write what is queued and stop the thread
+        self.queue.put(None)
+        self.thread.join()
+
+# Writer of the current async configuration, if any
+_writer = None
+
+def parse_sample_rates(text):
+    # Parse "Method=rate,Method=rate" into a dict
+    rates = {}
+    for item in filter(None, (part.strip() for part in (text or "").split(","))):
+        method, rate = item.rsplit("=", 1)
+        rates[method] = float(rate)
+    return rates
+
+def configure_logging(mode="sync", log_file="myuber.log", structured=False, sample_rates=None,
+                      rate_limit=None, stream=None, level=logging.INFO, queue_size=100000):
+    # (Re)configure the root logger. "sync" writes on the calling thread, "async" hands records
+    # to a background writer that formats and writes them in batches.
+    global _writer
+    old_writer = _writer
+    _writer = None
+    formatter = StructuredFormatter() if structured else logging.Formatter(LOG_FORMAT)
+    handlers = [logging.FileHandler(log_file), logging.StreamHandler(stream)]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    filters = [MethodFilter()]
+    if sample_rates:
+        filters.append(SamplingFilter(sample_rates))
+    if rate_limit:
+        filters.append(RateLimitFilter(rate_limit))
+
+    # A single front handler runs the filters, so sampling and rate limiting decide once for all sinks
+    if mode == "async":
+        record_queue = queue.Queue(maxsize=queue_size)
+        _writer = BatchingLogWriter(record_queue, handlers)
+        front = LazyQueueHandler(record_queue)
+    else:
+        front = FanOutHandler(handlers)
+    for log_filter in filters:
+        front.addFilter(log_filter)
+    logging.basicConfig(level=level, handlers=[front], force=True)
+    # Stop the previous writer only once its queue handler is off the root logger, so no record
+    # is queued behind its stop marker
+    if old_writer is not None:
+        old_writer.stop()
+        # Its file and stream handlers were never on the root logger, so basicConfig did not close them
+        for handler in old_writer.handlers:
+            handler.close()
+
+def flush_logging():
+    # Wait until the async writer has written everything queued so far
+    if _writer is not None:
+        _writer.flush()
+
+def dropped_log_records():
+    # Records the async handler discarded because its queue was full
+    return sum(getattr(handler, "dropped", 0) for handler in logging.getLogger().handlers)
+
+# Write out queued records when the process exits
+atexit.register(flush_logging)
+
+# Configure logging from the environment: MYUBER_LOG_MODE=sync|async, MYUBER_LOG_FORMAT=text|json,
+# MYUBER_LOG_SAMPLE="/myuber.RideSharing/GetRideStatus=0.01", MYUBER_LOG_RATE_LIMIT=<records/s per method>
+configure_logging(mode=os.environ.get("MYUBER_LOG_MODE", "sync"),
+                  structured=os.environ.get("MYUBER_LOG_FORMAT", "text") == "json",
+                  sample_rates=parse_sample_rates(os.environ.get("MYUBER_LOG_SAMPLE")),
+                  rate_limit=float(os.environ.get("MYUBER_LOG_RATE_LIMIT", 0)) or None,
+                  stream=sys.stderr)
 
 # Create a logger instance for MyUber
 logger = logging.getLogger("MyUber")
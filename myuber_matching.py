@@ -0,0 +1,99 @@
+try:
+    import numpy as np
+except ImportError:  # Batch dispatch is optional; FIFO dispatch does not need numpy
+    np = None
+
+# Earth radius used by the vectorized equirectangular distance
+EARTH_RADIUS_KM = 6371.0
+
+def require_numpy():
+    if np is None:
+        raise RuntimeError("Batch dispatch requires numpy (pip install numpy)")
+
+def build_cost_matrix(pickups, driver_locations, wait_times, wait_penalty=0.1, unknown_distance=10.0):
+    # Cost of ride i taking driver j: pickup distance in km minus a bonus for rides that waited long
+    # pickups / driver_locations are lists of (lat, lng) or None, wait_times are seconds
+    require_numpy()
+    ride_known = np.array([p is not None for p in pickups])
+    driver_known = np.array([d is not None for d in driver_locations])
+    ride_points = np.array([p if p is not None else (0.0, 0.0) for p in pickups], dtype=float).reshape(-1, 2)
+    driver_points = np.array([d if d is not None else (0.0, 0.0) for d in driver_locations],
+                             dtype=float).reshape(-1, 2)
+
+    ride_lat = np.radians(ride_points[:, 0])[:, None]
+    ride_lng = np.radians(ride_points[:, 1])[:, None]
+    driver_lat = np.radians(driver_points[:, 0])[None, :]
+    driver_lng = np.radians(driver_points[:, 1])[None, :]
+    x = (driver_lng - ride_lng) * np.cos((ride_lat + driver_lat) / 2)
+    y = driver_lat - ride_lat
+    cost = np.hypot(x, y) * EARTH_RADIUS_KM
+
+    # Rides without a pickup can take any driver; drivers without a location are a last resort
+    cost[~ride_known, :] = 0.0
+    cost[np.ix_(ride_known, ~driver_known)] = unknown_distance
+    cost -= wait_penalty * np.asarray(wait_times, dtype=float)[:, None]
+    return cost
+
+def solve_assignment(cost, max_optimal_size=400):
+    # Return (row, col) pairs of a minimum-cost matching, greedy for very large batches
+    require_numpy()
+    rows, cols = cost.shape
+    if rows == 0 or cols == 0:
+        return []
+    if min(rows, cols) > max_optimal_size:
+        return greedy_assignment(cost)
+    if rows > cols:
+        return [(r, c) for c, r in hungarian(cost.T)]
+    return hungarian(cost)
+
+def hungarian(cost):
+    # Hungarian algorithm with potentials for rows <= cols, inner loop vectorized over columns
+    n, m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    owner = np.zeros(m + 1, dtype=int)  # owner[j]: 1-based row matched to column j
+    way = np.zeros(m + 1, dtype=int)
+    for i in range(1, n + 1):
+        owner[0] = i
+        j0 = 0
+        min_slack = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = owner[j0]
+            free = ~used[1:]
+            slack = cost[i0 - 1] - u[i0] - v[1:]
+            improve = free & (slack < min_slack[1:])
+            min_slack[1:][improve] = slack[improve]
+            way[1:][improve] = j0
+            candidates = np.where(free, min_slack[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+            u[owner[used]] += delta
+            v[used] -= delta
+            min_slack[1:][free] -= delta
+            j0 = j1
+            if owner[j0] == 0:
+                break
+        # Flip the augmenting path
+        while j0:
+            j1 = way[j0]
+            owner[j0] = owner[j1]
+            j0 = j1
+    return [(owner[j] - 1, j - 1) for j in range(1, m + 1) if owner[j]]
+
+def greedy_assignment(cost):
+    # Take the cheapest remaining pair until rides or drivers run out
+    rows, cols = cost.shape
+    used_rows = np.zeros(rows, dtype=bool)
+    used_cols = np.zeros(cols, dtype=bool)
+    pairs = []
+    for flat in np.argsort(cost, axis=None, kind="stable"):
+        r, c = divmod(int(flat), cols)
+        if used_rows[r] or used_cols[c]:
+            continue
+        used_rows[r] = used_cols[c] = True
+        pairs.append((r, c))
+        if len(pairs) == min(rows, cols):
+            break
+    return pairs
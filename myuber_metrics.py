@@ -0,0 +1,156 @@
+import bisect
+import threading
+
+def make_bucket_bounds(lowest=1e-6, highest=100.0, growth=1.1):
+    # Geometric bucket upper bounds (in seconds), about 10% relative error
+    bounds = []
+    bound = lowest
+    while bound < highest:
+        bounds.append(bound)
+        bound *= growth
+    bounds.append(highest)
+    return bounds
+
+# Shared by every histogram so recording only needs a bisect
+DEFAULT_BUCKET_BOUNDS = make_bucket_bounds()
+
+class LatencyHistogram:
+    def __init__(self, bounds=DEFAULT_BUCKET_BOUNDS):
+        # Fixed buckets: counts[i] holds samples <= bounds[i], the last one overflows
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        # Record one latency sample
+        index = bisect.bisect_left(self.bounds, seconds)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def merge(self, other):
+        # Add the samples of another histogram with the same buckets
+        with self.lock:
+            self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+            self.count += other.count
+            self.total += other.total
+            self.max = max(self.max, other.max)
+
+    def __getstate__(self):
+        # Histograms are sent between benchmark processes; locks cannot be pickled
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def percentile(self, p):
+        # Return the upper bound of the bucket holding the p-th percentile
+        with self.lock:
+            if self.count == 0:
+                return 0.0
+            rank = p / 100.0 * self.count
+            seen = 0
+            for index, bucket_count in enumerate(self.counts):
+                seen += bucket_count
+                if seen >= rank and bucket_count:
+                    if index < len(self.bounds):
+                        return min(self.bounds[index], self.max)
+                    return self.max
+            return self.max
+
+    def snapshot(self):
+        # Return a summary of the recorded samples
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+class MethodMetrics:
+    def __init__(self):
+        # Calls, status codes and latency of one RPC method
+        self.calls = 0
+        self.codes = {}  # status code name -> count
+        self.latency = LatencyHistogram()
+
+class ServerMetrics:
+    def __init__(self):
+        # Per-method RPC metrics, filled in by the metrics interceptor
+        self.methods = {}
+        self.lock = threading.Lock()
+
+    def record_call(self, method, code, seconds):
+        # Count one finished RPC
+        with self.lock:
+            metrics = self.methods.get(method)
+            if metrics is None:
+                metrics = self.methods[method] = MethodMetrics()
+            metrics.calls += 1
+            metrics.codes[code] = metrics.codes.get(code, 0) + 1
+        metrics.latency.record(seconds)
+
+    def method_snapshots(self):
+        # Return (method, calls, codes, latency summary) for every method seen so far
+        with self.lock:
+            methods = list(self.methods.items())
+        return [(method, metrics.calls, dict(metrics.codes), metrics.latency.snapshot())
+                for method, metrics in sorted(methods)]
+
+# Snapshot keys of the exported quantiles and their values, written as Prometheus labels ("0.5", "0.99")
+QUANTILES = (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))
+
+def render_text(method_snapshots, gauges, histograms):
+    # Prometheus-style text exposition of RPC metrics, gauges and latency summaries
+    lines = []
+    for method, calls, codes, latency in method_snapshots:
+        for code, count in sorted(codes.items()):
+            lines.append(f'myuber_rpc_calls_total{{method="{method}",code="{code}"}} {count}')
+        for key, quantile in QUANTILES:
+            lines.append(f'myuber_rpc_latency_seconds{{method="{method}",quantile="{quantile:g}"}} {latency[key]:.6f}')
+        lines.append(f'myuber_rpc_latency_seconds_sum{{method="{method}"}} {latency["mean"] * calls:.6f}')
+        lines.append(f'myuber_rpc_latency_seconds_count{{method="{method}"}} {calls}')
+    for name, value in gauges.items():
+        lines.append(f"myuber_{name} {value}")
+    for name, summary in histograms.items():
+        for key, quantile in QUANTILES:
+            lines.append(f'myuber_{name}_seconds{{quantile="{quantile:g}"}} {summary[key]:.6f}')
+        lines.append(f"myuber_{name}_seconds_count {summary['count']}")
+    return "\n".join(lines) + "\n"
+
+def start_metrics_http_server(port, render):
+    # Serve render() as plain text on http://0.0.0.0:port/metrics from a background thread
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Scrapes are not worth a log line each
+            pass
+
+    server = ThreadingHTTPServer(("", port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
@@ -0,0 +1,207 @@
+import glob
+import json
+import os
+import threading
+import time
+from myuber_logger import logger
+
+class RideJournal:
+    def __init__(self, directory, group_commit=True, commit_interval=0.0, snapshot_every=50000):
+        # Write-ahead log split into numbered segments, plus one snapshot file
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.snapshot_path = os.path.join(directory, "snapshot.jsonl")
+        # Group commit: one fsync covers every record appended while the previous one ran
+        self.group_commit = group_commit
+        self.commit_interval = commit_interval
+        # Take a snapshot after this many records so restarts only replay the tail
+        self.snapshot_every = snapshot_every
+        self.snapshot_source = None  # Callable returning an iterable of state records
+        # io_lock serializes file writes and rotation; condition guards the buffer and LSNs.
+        # When both are needed, io_lock is taken first.
+        self.io_lock = threading.Lock()
+        self.condition = threading.Condition()
+        self.buffer = []
+        self.last_lsn = 0  # Last record appended
+        self.durable_lsn = 0  # Last record known to be on disk
+        # Called with the new durable LSN after every commit, on the committing thread; must not block
+        self.durable_listeners = []
+        self.records_since_snapshot = 0
+        self.closed = False
+        segments = self.segment_numbers()
+        self.segment = segments[-1] if segments else 1
+        self.log_file = open(self.segment_path(self.segment), "ab")
+        self.snapshot_requested = threading.Event()
+        if group_commit:
+            self.flush_thread = threading.Thread(target=self.run_flusher)
+            self.flush_thread.daemon = True
+            self.flush_thread.start()
+        self.snapshot_thread = threading.Thread(target=self.run_snapshotter)
+        self.snapshot_thread.daemon = True
+        self.snapshot_thread.start()
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, f"wal-{segment:08d}.log")
+
+    def segment_numbers(self):
+        # Return the numbers of the log segments on disk, oldest first
+        paths = glob.glob(os.path.join(self.directory, "wal-*.log"))
+        return sorted(int(os.path.basename(path)[4:12]) for path in paths)
+
+    def append(self, record):
+        # Queue a record for the log and return its LSN; use wait_durable() to wait for the fsync
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+        if not self.group_commit:
+            # One write and fsync per record
+            with self.io_lock:
+                lsn = self._next_lsn()
+                self.log_file.write(line)
+                self.log_file.flush()
+                os.fsync(self.log_file.fileno())
+            self._mark_durable(lsn)
+            return lsn
+        with self.condition:
+            lsn = self._next_lsn()
+            self.buffer.append(line)
+            self.condition.notify_all()
+        return lsn
+
+    def append_many(self, records):
+        # Queue several records and return the LSN of the last one; one fsync covers them all
+        lines = [(json.dumps(record, separators=(",", ":")) + "\n").encode() for record in records]
+        if not lines:
+            return 0
+        if not self.group_commit:
+            with self.io_lock:
+                for _ in lines:
+                    lsn = self._next_lsn()
+                self.log_file.write(b"".join(lines))
+                self.log_file.flush()
+                os.fsync(self.log_file.fileno())
+            self._mark_durable(lsn)
+            return lsn
+        with self.condition:
+            for _ in lines:
+                lsn = self._next_lsn()
+            self.buffer.extend(lines)
+            self.condition.notify_all()
+        return lsn
+
+    def _next_lsn(self):
+        with self.condition:
+            self.last_lsn += 1
+            self.records_since_snapshot += 1
+            if self.records_since_snapshot >= self.snapshot_every and self.snapshot_source is not None:
+                self.records_since_snapshot = 0
+                self.snapshot_requested.set()
+            return self.last_lsn
+
+    def _mark_durable(self, lsn):
+        with self.condition:
+            self.durable_lsn = max(self.durable_lsn, lsn)
+            durable_lsn = self.durable_lsn
+            self.condition.notify_all()
+        for listener in self.durable_listeners:
+            listener(durable_lsn)
+
+    def _write_buffer(self):
+        # Move buffered records to the current segment and fsync it; caller holds io_lock
+        with self.condition:
+            batch = self.buffer
+            self.buffer = []
+            batch_lsn = self.last_lsn
+        if batch:
+            self.log_file.write(b"".join(batch))
+        self.log_file.flush()
+        os.fsync(self.log_file.fileno())
+        return batch_lsn
+
+    def wait_durable(self, lsn, timeout=None):
+        # Block until the record with this LSN has been fsynced; False if the timeout ran out first
+        with self.condition:
+            return self.condition.wait_for(lambda: self.durable_lsn >= lsn or self.closed, timeout)
+
+    def run_flusher(self):
+        # Write and fsync everything that accumulated since the last commit
+        while True:
+            with self.condition:
+                while not self.buffer and not self.closed:
+                    self.condition.wait()
+                if self.closed and not self.buffer:
+                    return
+            # Give concurrent writers a moment to join this commit
+            if self.commit_interval:
+                time.sleep(self.commit_interval)
+            with self.io_lock:
+                batch_lsn = self._write_buffer()
+            self._mark_durable(batch_lsn)
+
+    def run_snapshotter(self):
+        # Write snapshots in the background so commits do not wait for them
+        while not self.closed:
+            self.snapshot_requested.wait()
+            self.snapshot_requested.clear()
+            if not self.closed:
+                self.snapshot()
+
+    def snapshot(self):
+        # Rotate the log, dump the current state and drop the segments it covers
+        with self.io_lock:
+            # Flush what is buffered into the old segment, then start a new one
+            batch_lsn = self._write_buffer()
+            self.log_file.close()
+            self.segment += 1
+            self.log_file = open(self.segment_path(self.segment), "ab")
+            first_segment = self.segment
+        self._mark_durable(batch_lsn)
+        # State changes are applied before they are logged, so every record in the old
+        # segments is already part of this state. Records replay as idempotent upserts,
+        # so later records that also made it into the snapshot are harmless.
+        start = time.monotonic()
+        temp_path = self.snapshot_path + ".tmp"
+        count = 0
+        with open(temp_path, "w") as f:
+            f.write(json.dumps({"first_segment": first_segment}) + "\n")
+            for record in self.snapshot_source():
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+                count += 1
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.snapshot_path)
+        for segment in self.segment_numbers():
+            if segment < first_segment:
+                os.remove(self.segment_path(segment))
+        logger.info("Snapshot of %s records written in %.2fs", count, time.monotonic() - start)
+
+    def load(self):
+        # Yield every record to replay: the snapshot first, then the log tail
+        first_segment = 0
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path) as f:
+                first_segment = json.loads(f.readline())["first_segment"]
+                for line in f:
+                    yield json.loads(line)
+        for segment in self.segment_numbers():
+            if segment < first_segment:
+                continue
+            with open(self.segment_path(segment)) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn write at the end of the log; everything after it is lost
+                        logger.warning("Ignoring truncated record in WAL segment %s", segment)
+                        break
+                    yield record
+
+    def close(self):
+        # Flush outstanding records and stop the background threads
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.snapshot_requested.set()
+        if self.group_commit:
+            self.flush_thread.join()
+        with self.io_lock:
+            self._mark_durable(self._write_buffer())
+            self.log_file.close()
@@ -0,0 +1,231 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from myuber_pb2 import ACCEPTED, COMPLETED, DRIVER_ASSIGNED, EXPIRED, PENDING, REJECTED, RideStatus
+
+# Statuses after which a ride leaves the hot map
+TERMINAL_STATUSES = {COMPLETED, EXPIRED}
+# Statuses during which a ride is bound to its driver
+ACTIVE_STATUSES = {DRIVER_ASSIGNED, ACCEPTED}
+# Legal status transitions of the ride state machine
+TRANSITIONS = {
+    PENDING: {DRIVER_ASSIGNED, EXPIRED},
+    DRIVER_ASSIGNED: {ACCEPTED, REJECTED},
+    ACCEPTED: {COMPLETED, REJECTED},
+    REJECTED: {DRIVER_ASSIGNED, EXPIRED},
+    COMPLETED: set(),
+    EXPIRED: set(),
+}
+# Passed as expected_driver to skip the driver check
+ANY_DRIVER = object()
+
+def status_name(status):
+    # Name of a RideStatus number, for logs and error messages
+    return RideStatus.Name(status)
+
+def now_ms():
+    # Wall-clock time in integer milliseconds, as stored in ride records
+    return int(time.time() * 1000)
+
+class Ride:
+    # One ride, kept small because the store holds every live and recently finished ride:
+    # slots instead of a per-instance dict, the status as a RideStatus number, interned
+    # rider/driver IDs shared by all rides of the same person and the pickup as two floats.
+    # Times are wall-clock milliseconds; a deadline of 0 means the rider waits indefinitely.
+    # `declined` is a short tuple of the drivers who declined the ride, shared empty tuple otherwise.
+    # A stored ride is never changed in place: RideStore.update swaps in a new record, so a ride
+    # read from the store is a consistent snapshot of one state.
+    __slots__ = ("status", "rider_id", "driver_id", "pickup_lat", "pickup_lng", "requested_at", "deadline",
+                 "declined")
+
+    def __init__(self, rider_id, pickup=None, status=PENDING, driver_id=None, requested_at=None, deadline=0,
+                 declined=()):
+        self.status = status
+        self.rider_id = sys.intern(rider_id)
+        self.driver_id = sys.intern(driver_id) if driver_id else None
+        self.pickup_lat, self.pickup_lng = pickup if pickup is not None else (None, None)
+        self.requested_at = now_ms() if requested_at is None else requested_at
+        self.deadline = deadline
+        self.declined = tuple(sys.intern(driver) for driver in declined)
+
+    @property
+    def pickup(self):
+        # (lat, lng) tuple, or None if the rider did not send a position
+        if self.pickup_lat is None:
+            return None
+        return (self.pickup_lat, self.pickup_lng)
+
+    def copy(self):
+        ride = Ride.__new__(Ride)
+        for name in Ride.__slots__:
+            setattr(ride, name, getattr(self, name))
+        return ride
+
+    def to_record(self):
+        # JSON-friendly form for the write-ahead log; the status is stored by name
+        return {"status": status_name(self.status), "rider_id": self.rider_id, "driver_id": self.driver_id,
+                "pickup": self.pickup, "requested_at": self.requested_at, "deadline": self.deadline,
+                "declined": list(self.declined)}
+
+    @classmethod
+    def from_record(cls, record):
+        # Inverse of to_record; fields missing from older records load as 0
+        pickup = record["pickup"]
+        return cls(record["rider_id"], tuple(pickup) if pickup is not None else None,
+                   RideStatus.Value(record["status"]), record["driver_id"], record.get("requested_at", 0),
+                   record.get("deadline", 0), record.get("declined", ()))
+
+    def __repr__(self):
+        return (f"Ride({status_name(self.status)}, rider={self.rider_id}, driver={self.driver_id}, "
+                f"pickup={self.pickup})")
+
+class RideTransitionError(Exception):
+    def __init__(self, ride_id, current=None, target=None):
+        super().__init__(ride_id, current, target)
+        self.ride_id = ride_id
+        self.current = current  # Status the ride had, None if it does not exist
+        self.target = target
+
+class RideNotFound(RideTransitionError):
+    pass
+
+class WrongDriver(RideTransitionError):
+    pass
+
+class IllegalTransition(RideTransitionError):
+    pass
+
+class RideStore:
+    def __init__(self, finished_ttl=3600.0, max_finished=100000, lock_stripes=64):
+        # Rides that can still change state
+        self.active = {}
+        # Finished rides kept for status lookups, oldest first
+        self.finished = OrderedDict()
+        # Secondary index
+        self.driver_index = {}  # driver_id -> active ride_id
+        # Eviction policy for finished rides
+        self.finished_ttl = finished_ttl
+        self.max_finished = max_finished
+        self.lock = threading.RLock()
+        # Striped per-ride locks: transitions of different rides rarely share one, and the
+        # global lock above is only held to swap the new record in and update the indexes
+        self.ride_locks = [threading.RLock() for _ in range(lock_stripes)]
+
+    def __contains__(self, ride_id):
+        return ride_id in self.active or ride_id in self.finished
+
+    def __getitem__(self, ride_id):
+        # Return the ride record from the hot map or the finished map
+        ride = self.active.get(ride_id)
+        if ride is not None:
+            return ride
+        return self.finished[ride_id][1]
+
+    def __len__(self):
+        return len(self.active) + len(self.finished)
+
+    def get(self, ride_id, default=None):
+        try:
+            return self[ride_id]
+        except KeyError:
+            return default
+
+    def add(self, ride_id, ride):
+        # Store a new ride and index it
+        with self.lock:
+            self.active[ride_id] = ride
+            self._index_driver(ride_id, ride)
+            self.evict_expired()
+
+    def add_many(self, rides):
+        # Store and index several (ride_id, ride) pairs under one lock acquisition
+        with self.lock:
+            for ride_id, ride in rides:
+                self.active[ride_id] = ride
+                self._index_driver(ride_id, ride)
+            self.evict_expired()
+
+    def remove_many(self, ride_ids):
+        # Take new rides back out of the store, when a request fails before they are queued
+        with self.lock:
+            for ride_id in ride_ids:
+                ride = self.active.pop(ride_id, None)
+                if ride is not None:
+                    self._unindex_driver(ride_id, ride)
+
+    def restore(self, ride_id, ride):
+        # Put back a ride recovered from disk, straight into the finished map if it is over
+        if ride.status not in TERMINAL_STATUSES:
+            self.add(ride_id, ride)
+            return
+        with self.lock:
+            self.finished[ride_id] = (time.monotonic(), ride)
+            self.evict_expired()
+
+    def update(self, ride_id, **fields):
+        # Change fields of an active ride while keeping every index consistent. The new record is
+        # built under the ride's lock; the store lock is only taken to swap it in and re-index it.
+        with self.ride_lock(ride_id):
+            old = self.active[ride_id]
+            ride = old.copy()
+            if fields.get("driver_id"):
+                fields["driver_id"] = sys.intern(fields["driver_id"])
+            if "declined" in fields:
+                fields["declined"] = tuple(sys.intern(driver) for driver in fields["declined"])
+            for name, value in fields.items():
+                setattr(ride, name, value)
+            with self.lock:
+                self._unindex_driver(ride_id, old)
+                if ride.status in TERMINAL_STATUSES:
+                    # Move the ride out of the hot map; readers find it in one map or the other
+                    self.finished[ride_id] = (time.monotonic(), ride)
+                    del self.active[ride_id]
+                    self.evict_expired()
+                else:
+                    self.active[ride_id] = ride
+                    self._index_driver(ride_id, ride)
+            return ride
+
+    def ride_lock(self, ride_id):
+        # Lock guarding state changes of one ride; hold it to make several steps atomic
+        return self.ride_locks[hash(ride_id) % len(self.ride_locks)]
+
+    def transition(self, ride_id, status, expected_status=None, expected_driver=ANY_DRIVER, **fields):
+        # Compare-and-set: move a ride to `status` if the state machine allows it and the ride
+        # still has one of the expected statuses and the expected driver. Returns the updated
+        # ride, or raises a RideTransitionError and leaves the ride untouched.
+        with self.ride_lock(ride_id):
+            ride = self.get(ride_id)
+            if ride is None:
+                raise RideNotFound(ride_id, None, status)
+            if expected_driver is not ANY_DRIVER and ride.driver_id != expected_driver:
+                raise WrongDriver(ride_id, ride.status, status)
+            if status not in TRANSITIONS[ride.status] or (
+                    expected_status is not None and ride.status not in expected_status):
+                raise IllegalTransition(ride_id, ride.status, status)
+            return self.update(ride_id, status=status, **fields)
+
+    def active_ride_for_driver(self, driver_id):
+        # Return the ride currently bound to a driver, if any
+        return self.driver_index.get(driver_id)
+
+    def evict_expired(self, now=None):
+        # Drop finished rides that are past the TTL or over the size limit
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            while self.finished:
+                ride_id, (finished_at, _) = next(iter(self.finished.items()))
+                over_size = self.max_finished is not None and len(self.finished) > self.max_finished
+                expired = self.finished_ttl is not None and now - finished_at > self.finished_ttl
+                if not (over_size or expired):
+                    break
+                del self.finished[ride_id]
+
+    def _index_driver(self, ride_id, ride):
+        if ride.driver_id and ride.status in ACTIVE_STATUSES:
+            self.driver_index[ride.driver_id] = ride_id
+
+    def _unindex_driver(self, ride_id, ride):
+        if ride.driver_id and self.driver_index.get(ride.driver_id) == ride_id:
+            del self.driver_index[ride.driver_id]
@@ -0,0 +1,113 @@
+import itertools
+import math
+import threading
+import time
+from myuber_logger import logger
+
+class TimeoutScheduler:
+    def __init__(self, tick=0.05, wheel_size=1024):
+        # Hashed timing wheel: each slot maps timer handles to (due_tick, callback, args)
+        self.tick = tick
+        self.wheel = [{} for _ in range(wheel_size)]
+        self.slots = {}  # handle -> slot index, for O(1) cancel
+        self.handles = itertools.count(1)
+        self.current_tick = 0
+        self.started_at = time.monotonic()
+        self.lock = threading.Lock()
+        self.closed = False
+        # A single thread drives every timer
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def schedule(self, delay, callback, *args):
+        # Run callback(*args) after roughly `delay` seconds and return a handle for cancel()
+        handle = next(self.handles)
+        with self.lock:
+            elapsed_ticks = (time.monotonic() - self.started_at) / self.tick
+            due_tick = max(self.current_tick + 1, math.ceil(elapsed_ticks + delay / self.tick))
+            slot = due_tick % len(self.wheel)
+            self.wheel[slot][handle] = (due_tick, callback, args)
+            self.slots[handle] = slot
+        return handle
+
+    def cancel(self, handle):
+        # Cancel a timer; return False if it already fired or was cancelled
+        with self.lock:
+            slot = self.slots.pop(handle, None)
+            if slot is None:
+                return False
+            del self.wheel[slot][handle]
+            return True
+
+    def pending_count(self):
+        # Return the number of outstanding timers
+        return len(self.slots)
+
+    def close(self):
+        # Stop the scheduler thread; outstanding timers never fire
+        self.closed = True
+
+    def run(self):
+        # Advance the wheel one tick at a time and fire due timers
+        while not self.closed:
+            next_tick_at = self.started_at + (self.current_tick + 1) * self.tick
+            delay = next_tick_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            for callback, args in self.advance():
+                try:
+                    callback(*args)
+                except Exception:
+                    logger.exception("Timeout callback failed")
+
+    def advance(self):
+        # Move to the next tick and collect the timers that are due
+        with self.lock:
+            self.current_tick += 1
+            bucket = self.wheel[self.current_tick % len(self.wheel)]
+            due = [handle for handle, (due_tick, _, _) in bucket.items() if due_tick <= self.current_tick]
+            fired = []
+            for handle in due:
+                _, callback, args = bucket.pop(handle)
+                del self.slots[handle]
+                fired.append((callback, args))
+            return fired
+
+class AsyncTimeoutScheduler:
+    def __init__(self, loop):
+        # Timers on the asyncio event loop, with the same interface as TimeoutScheduler
+        self.loop = loop
+        self.timers = {}  # handle -> asyncio.TimerHandle
+        self.handles = itertools.count(1)
+
+    def schedule(self, delay, callback, *args):
+        # Run callback(*args) on the loop after `delay` seconds and return a handle for cancel()
+        handle = next(self.handles)
+        self.timers[handle] = self.loop.call_later(delay, self._fire, handle, callback, args)
+        return handle
+
+    def cancel(self, handle):
+        # Cancel a timer; return False if it already fired or was cancelled
+        timer = self.timers.pop(handle, None)
+        if timer is None:
+            return False
+        timer.cancel()
+        return True
+
+    def pending_count(self):
+        # Return the number of outstanding timers
+        return len(self.timers)
+
+    def close(self):
+        # Cancel every outstanding timer
+        for timer in self.timers.values():
+            timer.cancel()
+        self.timers.clear()
+
+    def _fire(self, handle, callback, args):
+        self.timers.pop(handle, None)
+        try:
+            callback(*args)
+        except Exception:
+            logger.exception("Timeout callback failed")
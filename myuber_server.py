@@ -1,130 +1,670 @@
+import argparse
+import asyncio
 import grpc
+import itertools
+import os
 from concurrent import futures
 import time
 import uuid
 import queue
 import threading
+from collections import OrderedDict
 import myuber_pb2
+from myuber_pb2 import ACCEPTED, COMPLETED, DRIVER_ASSIGNED, EXPIRED, PENDING, REJECTED
 import myuber_pb2_grpc
+from myuber_archive import DRIVER, RIDER, RideArchive
+from myuber_dispatcher import BATCH, GREEDY, Dispatcher
+from myuber_events import RideEventBroker
+from myuber_geo import GridIndex
 from myuber_interceptors import get_interceptors
-from myuber_logger import logger
+from myuber_logger import configure_logging, logger, parse_sample_rates
+from myuber_metrics import LatencyHistogram, ServerMetrics, render_text, start_metrics_http_server
+from myuber_persistence import RideJournal
+from myuber_ride_store import (ANY_DRIVER, TERMINAL_STATUSES, IllegalTransition, Ride, RideNotFound, RideStore,
+                               RideTransitionError, now_ms, status_name)
+from myuber_scheduler import TimeoutScheduler
+from myuber_sharding import MAX_SHARDS, new_ride_id
+
+# Largest number of items accepted by one batch RPC
+MAX_BATCH_SIZE = 10000
+# Rides per streamed history page when the request does not say, and at most
+DEFAULT_HISTORY_PAGE = 100
+MAX_HISTORY_PAGE = 1000
+# Drivers who declined a ride that the ride remembers, most recent last
+MAX_DECLINED = 8
+# Let clients ping idle connections as often as myuber_channels.KEEPALIVE_OPTIONS does instead of
+# answering with GOAWAY, and ping idle clients so connections of vanished clients are closed
+SERVER_OPTIONS = [
+    ("grpc.keepalive_time_ms", 60000),
+    ("grpc.keepalive_timeout_ms", 10000),
+    ("grpc.keepalive_permit_without_calls", 1),
+    ("grpc.http2.min_ping_interval_without_data_ms", 10000),
+    ("grpc.http2.max_pings_without_data", 0),
+]
+# Trailing metadata key with the milliseconds a shed rider should wait before retrying
+RETRY_AFTER_KEY = "retry-after-ms"
+# Thread pool size of the threaded mode. Every open WatchAssignments/WatchRide stream holds a worker
+# until it ends, so the pool must be larger than the number of drivers and riders watching at once
+# or unary calls queue behind the streams
+DEFAULT_MAX_WORKERS = 1000
 
 class DriverManager:
-    def __init__(self):
-        # Queue to store available drivers
-        self.available_drivers = queue.Queue()
-        self.lock = threading.Lock()
+    def __init__(self, cell_size=0.01, lease_duration=30.0):
+        # Every driver that ever registered
+        self.registered_drivers = set()
+        # Available drivers in the order they became available, each with its arrival number; a dict,
+        # so a driver is in it at most once
+        self.available_drivers = OrderedDict()
+        self.arrivals = itertools.count()
+        # The available drivers without a known location, in the same order
+        self.unlocated_drivers = OrderedDict()
+        # Last known location of every driver, available or not
+        self.driver_locations = {}
+        # Spatial index over available drivers with a known location
+        self.available_index = GridIndex(cell_size)
+        # Presence leases: driver_id -> monotonic expiry time, renewed by heartbeats.
+        # Drivers whose lease ran out are offline and kept out of the pool until they come back.
+        self.lease_duration = lease_duration
+        self.leases = {}
+        self.offline_drivers = set()
+        self.watchers = {}  # driver_id -> open assignment streams, which keep the lease alive
+        # Reentrant so batch operations can reuse the single-driver methods
+        self.lock = threading.RLock()
 
     def add_available_driver(self, driver_id):
-        # Add a driver to the available drivers queue
-        self.available_drivers.put(driver_id)
+        # Add a driver to the available drivers pool, unless it went offline
+        with self.lock:
+            if driver_id in self.offline_drivers:
+                return False
+            if driver_id not in self.available_drivers:
+                self.available_drivers[driver_id] = next(self.arrivals)
+            location = self.driver_locations.get(driver_id)
+            if location is not None:
+                self.available_index.update(driver_id, *location)
+            else:
+                self.unlocated_drivers[driver_id] = None
+            return True
 
-    def assign_driver(self):
-        # Attempt to get an available driver
-        try:
-            return self.available_drivers.get_nowait()
-        except queue.Empty:
-            return None
+    def _remove_available(self, driver_id):
+        # Take a driver out of the pool and its indexes; caller holds the lock
+        self.available_drivers.pop(driver_id, None)
+        self.unlocated_drivers.pop(driver_id, None)
+        self.available_index.remove(driver_id)
+
+    def renew_lease(self, driver_id, now=None):
+        # Extend a driver's lease; returns True if the driver was offline and is now back
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.leases[driver_id] = now + self.lease_duration
+            if driver_id not in self.offline_drivers:
+                return False
+            self.offline_drivers.discard(driver_id)
+            return True
+
+    def expire_lease(self, driver_id, now=None):
+        # Check a driver's lease: returns the seconds left if it is still valid, 0 after taking
+        # the driver offline and out of the pool, or None if it had no lease
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if self.watchers.get(driver_id):
+                self.leases[driver_id] = now + self.lease_duration
+            expires_at = self.leases.get(driver_id)
+            if expires_at is None:
+                return None
+            if expires_at > now:
+                return expires_at - now
+            del self.leases[driver_id]
+            self.offline_drivers.add(driver_id)
+            self._remove_available(driver_id)
+            return 0
+
+    def add_watcher(self, driver_id):
+        with self.lock:
+            self.watchers[driver_id] = self.watchers.get(driver_id, 0) + 1
+
+    def remove_watcher(self, driver_id):
+        with self.lock:
+            count = self.watchers.pop(driver_id, 0) - 1
+            if count > 0:
+                self.watchers[driver_id] = count
+
+    def online_count(self):
+        # Return the number of drivers holding a lease
+        return len(self.leases)
+
+    def update_location(self, driver_id, latitude, longitude):
+        # Record a driver's position and move it in the index if it is available
+        with self.lock:
+            self.driver_locations[driver_id] = (latitude, longitude)
+            if driver_id in self.available_drivers:
+                self.available_index.update(driver_id, latitude, longitude)
+                self.unlocated_drivers.pop(driver_id, None)
+
+    def assign_driver(self, pickup=None, exclude=None):
+        # Take the nearest available driver to the pickup, or the longest-waiting one, skipping the
+        # drivers in `exclude`. Drivers without a known location cannot be ranked by distance; the
+        # longest-waiting of them gets the ride instead if it has waited longer than the nearest
+        # driver, so a steady flow of pickups does not starve them.
+        with self.lock:
+            if pickup is None:
+                driver_id = first_available(self.available_drivers, exclude)
+            else:
+                driver_id = first_available(self.unlocated_drivers, exclude)
+                nearest = self.available_index.nearest(pickup[0], pickup[1], k=1, exclude=exclude)
+                if nearest and (driver_id is None or
+                                self.available_drivers[nearest[0][1]] < self.available_drivers[driver_id]):
+                    driver_id = nearest[0][1]
+            if driver_id is None:
+                return None
+            self._remove_available(driver_id)
+            return driver_id
+
+    def available_driver_locations(self):
+        # Return (driver_id, location or None) for every available driver
+        with self.lock:
+            return [(driver_id, self.driver_locations.get(driver_id)) for driver_id in self.available_drivers]
+
+    def take_driver(self, driver_id):
+        # Remove a specific driver from the pool; False if it is no longer available
+        with self.lock:
+            if driver_id not in self.available_drivers:
+                return False
+            self._remove_available(driver_id)
+            return True
 
     def get_available_drivers_count(self):
         # Return the number of available drivers
-        return self.available_drivers.qsize()
+        return len(self.available_drivers)
 
-    def register_driver(self, driver_id):
-        # Register a new driver
-        self.add_available_driver(driver_id)
+    def register_driver(self, driver_id, location=None, available=True):
+        # Register a driver, optionally with its current location, and grant it a lease.
+        # Registering again refreshes the lease; a driver that is busy stays out of the pool.
+        with self.lock:
+            self.registered_drivers.add(driver_id)
+            self.renew_lease(driver_id)
+            if location is not None:
+                self.update_location(driver_id, *location)
+            if available:
+                self.add_available_driver(driver_id)
         return True
 
+    def register_drivers(self, drivers, busy=()):
+        # Register several (driver_id, location) pairs under one lock acquisition
+        with self.lock:
+            for driver_id, location in drivers:
+                self.register_driver(driver_id, location, available=driver_id not in busy)
+        return [True] * len(drivers)
+
 class MyUberServicer(myuber_pb2_grpc.RideSharingServicer):
-    def __init__(self):
-        self.driver_manager = DriverManager()
-        self.rides = {}  # Store ride information
-        self.ride_queue = queue.Queue()  # Queue for pending rides
+    def __init__(self, finished_ride_ttl=3600.0, max_finished_rides=100000, acceptance_timeout=10.0,
+                 dispatch_mode=GREEDY, batch_window=0.2, timeout_scheduler=None, journal=None, driver_lease=30.0,
+                 max_pending_rides=10000, max_ride_wait=300.0, expiry_interval=1.0, requeue_boost=10.0,
+                 decline_cooldown=30.0, shard_id=None, archive=None):
+        self.driver_manager = DriverManager(lease_duration=driver_lease)
+        # Index of this server in a sharded deployment, stored in every ride ID it creates; None when unsharded
+        self.shard_id = shard_id
+        # Store ride information, indexed by driver
+        self.rides = RideStore(finished_ttl=finished_ride_ttl, max_finished=max_finished_rides)
+        # Priority queue of pending rides, woken up when rides or drivers become available
+        self.dispatcher = Dispatcher(self.driver_manager, mode=dispatch_mode, batch_window=batch_window,
+                                     requeue_boost=requeue_boost, decline_cooldown=decline_cooldown)
+        self.events = RideEventBroker()  # Push ride changes to watching drivers and riders
+        # Single-threaded timing wheel for ride acceptance timeouts
+        self.acceptance_timeout = acceptance_timeout
+        self.timeout_scheduler = timeout_scheduler or TimeoutScheduler()
+        self.ride_timers = {}  # Store timer handles for ride timeouts
+        self.lease_timers = {}  # driver_id -> handle of the next lease check
+        # Admission control: new rides are shed once this many are waiting (0: unbounded), and
+        # rides still waiting after max_ride_wait seconds (0: forever) expire
+        self.max_pending_rides = max_pending_rides
+        self.max_ride_wait = max_ride_wait
+        self.expiry_interval = expiry_interval
+        # Per-method RPC metrics (filled in by the metrics interceptor) and ride latencies
+        self.metrics = ServerMetrics()
+        self.assigned_at = {}  # ride_id -> time the current driver was assigned
+        self.accept_latency = LatencyHistogram()
+        # Optional columnar archive of completed rides, for rider and driver histories
+        self.archive = archive
+        # Optional write-ahead log of every ride state transition
+        self.journal = journal
+        if journal is not None:
+            self.recover()
+            journal.snapshot_source = self.snapshot_records
+        self.timeout_scheduler.schedule(self.expiry_interval, self.expire_rides)
+        self.start_background_tasks()
+
+    def recover(self):
+        # Rebuild rides and drivers from the last snapshot and the log tail
+        start = time.monotonic()
+        rides = {}
+        drivers = {}
+        for record in self.journal.load():
+            if "ride_id" in record:
+                # UUID() also reads the dashed string IDs of logs written before IDs were bytes
+                rides[uuid.UUID(record["ride_id"]).bytes] = record["ride"]
+            else:
+                drivers[record["driver_id"]] = record["location"]
+        busy_drivers = set()
+        for ride_id, record in rides.items():
+            ride = Ride.from_record(record)
+            self.rides.restore(ride_id, ride)
+            if ride.status in (PENDING, REJECTED):
+                self.requeue_ride(ride_id, ride)
+            elif ride.status == DRIVER_ASSIGNED:
+                # Give the driver a fresh acceptance window
+                self.start_ride_timer(ride_id, ride.driver_id)
+                busy_drivers.add(ride.driver_id)
+            elif ride.status == ACCEPTED:
+                busy_drivers.add(ride.driver_id)
+        for driver_id, location in drivers.items():
+            # Every recovered driver gets a fresh lease to reconnect within
+            self.driver_manager.register_driver(driver_id, tuple(location) if location else None,
+                                                available=driver_id not in busy_drivers)
+            self.start_lease_timer(driver_id)
+        logger.info("Recovered %s rides and %s drivers in %.2fs", len(rides), len(drivers), time.monotonic() - start)
+
+    def snapshot_records(self):
+        # Yield the current state as journal records, for a snapshot
+        for driver_id in list(self.driver_manager.registered_drivers):
+            yield {"event": "RegisterDriver", "driver_id": driver_id,
+                   "location": self.driver_manager.driver_locations.get(driver_id)}
+        with self.rides.lock:
+            ride_ids = list(self.rides.active) + list(self.rides.finished)
+        for ride_id in ride_ids:
+            ride = self.rides.get(ride_id)
+            if ride is not None:
+                yield {"event": "Snapshot", "ride_id": ride_id.hex(), "ride": ride.to_record()}
+
+    def log_transition(self, event, ride_id, ride=None):
+        # Append the new state of a ride to the write-ahead log; apply the change first
+        if self.journal is None:
+            return 0
+        ride = ride or self.rides[ride_id]
+        return self.journal.append({"event": event, "ride_id": ride_id.hex(), "ride": ride.to_record()})
+
+    def log_transitions(self, event, ride_ids):
+        # Append the new state of several rides with one journal call; returns the last LSN
+        if self.journal is None:
+            return 0
+        return self.journal.append_many([{"event": event, "ride_id": ride_id.hex(),
+                                          "ride": self.rides[ride_id].to_record()} for ride_id in ride_ids])
+
+    def add_new_rides(self, rides):
+        # Store and log new (ride_id, ride) pairs; returns the LSN. Rides whose journal write fails
+        # leave the store again, or they would stay PENDING without ever being queued or expired.
+        self.rides.add_many(rides)
+        try:
+            return self.log_transitions("RequestRide", [ride_id for ride_id, _ in rides])
+        except Exception:
+            self.rides.remove_many([ride_id for ride_id, _ in rides])
+            raise
+
+    def log_driver(self, driver_id):
+        # Append a driver registration to the write-ahead log
+        if self.journal is None:
+            return 0
+        return self.journal.append({"event": "RegisterDriver", "driver_id": driver_id,
+                                    "location": self.driver_manager.driver_locations.get(driver_id)})
+
+    def log_drivers(self, driver_ids):
+        # Append several driver registrations with one journal call; returns the last LSN
+        if self.journal is None:
+            return 0
+        return self.journal.append_many([{"event": "RegisterDriver", "driver_id": driver_id,
+                                          "location": self.driver_manager.driver_locations.get(driver_id)}
+                                         for driver_id in driver_ids])
+
+    def wait_durable(self, lsn, context=None):
+        # Block until a logged transition is on disk before answering the client, but not past
+        # the client's deadline: by then nobody is waiting for the answer
+        if self.journal is None or not lsn:
+            return
+        if not self.journal.wait_durable(lsn, durable_wait_timeout(context)):
+            context.abort(grpc.StatusCode.DEADLINE_EXCEEDED, "Deadline exceeded before the change was durable")
+
+    def start_background_tasks(self):
         # Start a thread to allocate rides
         self.ride_allocation_thread = threading.Thread(target=self.allocate_rides)
         self.ride_allocation_thread.daemon = True
         self.ride_allocation_thread.start()
-        self.ride_timers = {}  # Store timers for ride timeouts
 
     def allocate_rides(self):
-        # Continuously allocate rides to available drivers
+        # Wait until rides and drivers are both available, then assign every match at once
         while True:
-            ride_id = self.ride_queue.get()
-            while True:
-                assigned_driver = self.driver_manager.assign_driver()
-                if assigned_driver:
-                    self.rides[ride_id]["driver_id"] = assigned_driver
-                    self.rides[ride_id]["status"] = "DRIVER_ASSIGNED"
-                    logger.info(f"Driver {assigned_driver} assigned to ride {ride_id}")
-                    
-                    # Start a timer for this ride
-                    self.start_ride_timer(ride_id, assigned_driver)
-                    break
-                time.sleep(1)  # Wait for 1 second before trying again
-            self.ride_queue.task_done()
+            for ride_id, assigned_driver in self.dispatcher.next_batch():
+                self.assign_ride(ride_id, assigned_driver)
+
+    def transition_ride(self, event, ride_id, status, expected_status=None, expected_driver=ANY_DRIVER, **fields):
+        # Apply a state machine transition, then log and publish it while still holding the
+        # ride's lock so the journal and watchers see each ride's changes in order.
+        # Returns (ride, LSN); raises RideTransitionError if the transition is refused.
+        with self.rides.ride_lock(ride_id):
+            ride = self.rides.transition(ride_id, status, expected_status, expected_driver, **fields)
+            lsn = self.log_transition(event, ride_id, ride)
+            self.publish_ride_status(ride_id, ride)
+            return ride, lsn
+
+    def abort_transition(self, context, error, driver_id, action):
+        # Turn a refused transition into the matching gRPC error
+        if isinstance(error, RideNotFound):
+            logger.warning("Ride %s not found during %s", error.ride_id.hex(), action)
+            context.abort(grpc.StatusCode.NOT_FOUND, "Ride not found")
+        if not isinstance(error, IllegalTransition):
+            logger.warning("Driver %s not assigned to ride %s", driver_id, error.ride_id.hex())
+            context.abort(grpc.StatusCode.PERMISSION_DENIED, "Driver not assigned to this ride")
+        if error.current == COMPLETED:
+            logger.warning("Ride %s is already completed", error.ride_id.hex())
+            context.abort(grpc.StatusCode.FAILED_PRECONDITION, "Ride already completed")
+        logger.warning("Ride %s cannot go from %s to %s", error.ride_id.hex(), status_name(error.current),
+                       status_name(error.target))
+        context.abort(grpc.StatusCode.FAILED_PRECONDITION, f"Ride is {status_name(error.current)}")
+
+    def assign_ride(self, ride_id, assigned_driver):
+        # Bind a ride to a driver and notify both sides
+        try:
+            with self.rides.ride_lock(ride_id):
+                self.transition_ride("Assign", ride_id, DRIVER_ASSIGNED, driver_id=assigned_driver)
+                self.publish_assignment(ride_id, assigned_driver, DRIVER_ASSIGNED)
+                # Start a timer for this ride
+                self.start_ride_timer(ride_id, assigned_driver)
+        except RideTransitionError:
+            # The ride changed while it was queued; give the driver back
+            self.dispatcher.add_driver(assigned_driver)
+            return
+        logger.info("Driver %s assigned to ride %s", assigned_driver, ride_id.hex())
 
     def start_ride_timer(self, ride_id, driver_id):
         # Start a timer for ride acceptance
-        timer = threading.Timer(10.0, self.handle_ride_timeout, args=[ride_id, driver_id])
-        self.ride_timers[ride_id] = timer
-        timer.start()
+        self.assigned_at[ride_id] = time.monotonic()
+        self.ride_timers[ride_id] = self.timeout_scheduler.schedule(
+            self.acceptance_timeout, self.handle_ride_timeout, ride_id, driver_id)
+
+    def cancel_ride_timer(self, ride_id):
+        # Cancel the acceptance timer of a ride, if any
+        self.assigned_at.pop(ride_id, None)
+        handle = self.ride_timers.pop(ride_id, None)
+        if handle is not None:
+            self.timeout_scheduler.cancel(handle)
 
     def handle_ride_timeout(self, ride_id, driver_id):
-        # Handle ride timeout if not accepted within 10 seconds
-        if ride_id in self.rides and self.rides[ride_id]["status"] == "DRIVER_ASSIGNED":
-            logger.info(f"Ride {ride_id} timed out for driver {driver_id}")
-            self.rides[ride_id]["status"] = "REJECTED"
-            self.rides[ride_id]["driver_id"] = None
-            self.driver_manager.add_available_driver(driver_id)
-            self.ride_queue.put(ride_id)
+        # Handle ride timeout if not accepted within the acceptance window
+        try:
+            with self.rides.ride_lock(ride_id):
+                # Only if the ride is still waiting for this driver's answer
+                ride, _ = self.decline_ride("Timeout", ride_id, driver_id, expected_status=(DRIVER_ASSIGNED,))
+                self.publish_assignment(ride_id, driver_id, REJECTED)
+        except RideTransitionError:
+            # Accepted, rejected or completed in the meantime
+            return
+        logger.info("Ride %s timed out for driver %s", ride_id.hex(), driver_id)
+        self.dispatcher.add_driver(driver_id)
+        self.requeue_ride(ride_id, ride)
+
+    def decline_ride(self, event, ride_id, driver_id, expected_status=None):
+        # Take a ride back from its driver and remember that driver, so the ride is not offered to it
+        # again right away. Returns (ride, LSN); raises RideTransitionError like transition_ride.
+        with self.rides.ride_lock(ride_id):
+            ride = self.rides.get(ride_id)
+            declined = ride.declined if ride is not None else ()
+            if driver_id not in declined:
+                declined = (declined + (driver_id,))[-MAX_DECLINED:]
+            result = self.transition_ride(event, ride_id, REJECTED, expected_status=expected_status,
+                                          expected_driver=driver_id, driver_id=None, declined=declined)
+            self.cancel_ride_timer(ride_id)
+            return result
+
+    def requeue_ride(self, ride_id, ride):
+        # Queue a ride again with its original request time and the drivers who declined it, so it is
+        # served ahead of newer rides and offered to someone else first
+        self.dispatcher.add_ride(ride_id, ride.pickup, ride.deadline, ride.requested_at, ride.declined)
+        if ride.declined and self.dispatcher.decline_cooldown:
+            # Look again once the drivers who declined it may get it, in case nobody else turns up
+            self.timeout_scheduler.schedule(self.dispatcher.decline_cooldown, self.dispatcher.notify)
+
+    def admit_rides(self, count, context):
+        # Shed new rides once the pending queue is full, telling the rider when to come back. Admitted
+        # rides hold their places until they are queued with reserved=True or released.
+        if self.dispatcher.reserve(count, self.max_pending_rides):
+            return
+        retry_after = self.retry_after()
+        logger.info("Pending queue full, shedding %s ride requests (retry after %.1fs)", count, retry_after)
+        context.set_trailing_metadata(((RETRY_AFTER_KEY, str(int(retry_after * 1000))),))
+        context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, "Too many rides waiting for a driver, retry later")
+
+    def retry_after(self):
+        # Retry hint for shed riders: how long queued rides typically wait for a driver, within 0.5-30s
+        snapshot = self.dispatcher.assignment_latency.snapshot()
+        if not snapshot["count"]:
+            return 1.0
+        return min(30.0, max(0.5, snapshot["p50"]))
+
+    def ride_deadline(self, ride_request, now):
+        # Wall-clock ms after which a new ride expires: the rider's wait capped by the server's, 0 for none
+        wait = ride_request.max_wait_seconds
+        if self.max_ride_wait and (wait <= 0 or wait > self.max_ride_wait):
+            wait = self.max_ride_wait
+        return now + int(wait * 1000) if wait > 0 else 0
+
+    def expire_rides(self):
+        # Periodic sweep: rides still waiting for a driver after their deadline leave the queue as EXPIRED
+        try:
+            for ride_id in self.dispatcher.expire_rides(now_ms()):
+                try:
+                    self.transition_ride("Expire", ride_id, EXPIRED)
+                except RideTransitionError:
+                    continue
+                logger.info("Ride %s expired before a driver was found", ride_id.hex())
+        finally:
+            self.timeout_scheduler.schedule(self.expiry_interval, self.expire_rides)
+
+    def start_lease_timer(self, driver_id, delay=None):
+        # One pending lease check per driver; heartbeats only move the expiry time forward
+        with self.driver_manager.lock:
+            if driver_id not in self.lease_timers:
+                self.lease_timers[driver_id] = self.timeout_scheduler.schedule(
+                    self.driver_manager.lease_duration if delay is None else delay, self.check_driver_lease, driver_id)
+
+    def check_driver_lease(self, driver_id):
+        # Lease timer: check again later if the driver renewed in the meantime, otherwise it is offline
+        with self.driver_manager.lock:
+            self.lease_timers.pop(driver_id, None)
+            remaining = self.driver_manager.expire_lease(driver_id)
+            if remaining is None:
+                return
+            if remaining > 0:
+                self.start_lease_timer(driver_id, remaining)
+                return
+        logger.info("Driver %s lease expired, taking it offline", driver_id)
+        # Withdraw an offer the driver will not answer instead of waiting out the acceptance timeout
+        ride_id = self.rides.active_ride_for_driver(driver_id)
+        ride = self.rides.get(ride_id)
+        if ride is not None and ride.status == DRIVER_ASSIGNED:
+            self.handle_ride_timeout(ride_id, driver_id)
+
+    def touch_driver(self, driver_id):
+        # Renew the lease of a registered driver; a driver coming back online rejoins the pool if it is free.
+        # Returns False for unknown drivers.
+        if driver_id not in self.driver_manager.registered_drivers:
+            return False
+        if self.driver_manager.renew_lease(driver_id):
+            logger.info("Driver %s is back online", driver_id)
+            if self.rides.active_ride_for_driver(driver_id) is None:
+                self.dispatcher.add_driver(driver_id)
+        self.start_lease_timer(driver_id)
+        return True
+
+    def publish_assignment(self, ride_id, driver_id, status):
+        # Push an assignment change to the driver's watch stream
+        self.events.publish(("driver", driver_id), myuber_pb2.RideAssignment(ride_id=ride_id, status=status))
+
+    def publish_ride_status(self, ride_id, ride=None):
+        # Push the current ride status to the rider's watch stream
+        self.events.publish(("ride", ride_id), self.build_ride_status(ride_id, ride))
+
+    def build_ride_status(self, ride_id, ride=None):
+        # Build the status message for a ride, from the store unless a ride record is given
+        ride = ride or self.rides[ride_id]
+        return myuber_pb2.RideStatusResponse(
+            ride_id=ride_id,
+            status=ride.status,
+            driver_id=ride.driver_id or ""
+        )
+
+    def current_assignment(self, driver_id):
+        # The offer a driver has not answered yet, as the event that announced it, or None
+        ride_id = self.rides.active_ride_for_driver(driver_id)
+        ride = self.rides.get(ride_id)
+        if ride is not None and ride.status == DRIVER_ASSIGNED:
+            return myuber_pb2.RideAssignment(ride_id=ride_id, status=DRIVER_ASSIGNED)
+        return None
+
+    def stream_events(self, topic, subscriber, context):
+        # Yield events from a subscriber queue until the stream is closed or cancelled
+        context.add_callback(lambda: self.events.close(topic, subscriber))
+        while context.is_active():
+            try:
+                event = subscriber.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            if event is None:
+                break
+            yield event
 
     def RequestRide(self, request, context):
         # Handle a new ride request
-        ride_id = str(uuid.uuid4())
-        logger.info(f"New ride request: {ride_id} from rider {request.rider_id}")
-        self.rides[ride_id] = {
-            "status": "PENDING",
-            "rider_id": request.rider_id,
-            "driver_id": None
-        }
-        self.ride_queue.put(ride_id)
-        return myuber_pb2.RideResponse(ride_id=ride_id, status="PENDING")
+        self.admit_rides(1, context)
+        try:
+            # 16 random bytes instead of the 36-character UUID string, in memory and on the wire
+            ride_id = new_ride_id(self.shard_id)
+            logger.info("New ride request: %s from rider %s", ride_id.hex(), request.rider_id)
+            pickup = None
+            if request.HasField("pickup"):
+                pickup = (request.pickup.latitude, request.pickup.longitude)
+            now = now_ms()
+            ride = Ride(request.rider_id, pickup, requested_at=now, deadline=self.ride_deadline(request, now))
+            lsn = self.add_new_rides([(ride_id, ride)])
+        except Exception:
+            self.dispatcher.release(1)
+            raise
+        self.dispatcher.add_ride(ride_id, pickup, ride.deadline, ride.requested_at, reserved=True)
+        self.wait_durable(lsn, context)
+        return myuber_pb2.RideResponse(ride_id=ride_id, status=PENDING)
+
+    def RequestRides(self, request, context):
+        # Handle many ride requests at once: one store update, one journal write, one wakeup
+        check_batch_size(request.requests, context)
+        # The whole batch is admitted or shed
+        self.admit_rides(len(request.requests), context)
+        try:
+            rides = []
+            now = now_ms()
+            for ride_request in request.requests:
+                pickup = None
+                if ride_request.HasField("pickup"):
+                    pickup = (ride_request.pickup.latitude, ride_request.pickup.longitude)
+                rides.append((new_ride_id(self.shard_id), Ride(ride_request.rider_id, pickup, requested_at=now,
+                                                       deadline=self.ride_deadline(ride_request, now))))
+            lsn = self.add_new_rides(rides)
+        except Exception:
+            self.dispatcher.release(len(request.requests))
+            raise
+        self.dispatcher.add_rides([(ride_id, ride.pickup, ride.deadline) for ride_id, ride in rides], reserved=True)
+        self.wait_durable(lsn, context)
+        logger.info("Batch of %s ride requests accepted", len(rides))
+        return myuber_pb2.RequestRidesResponse(
+            rides=[myuber_pb2.RideResponse(ride_id=ride_id, status=PENDING) for ride_id, _ in rides])
 
     def GetRideStatus(self, request, context):
         # Get the status of a specific ride
         ride_id = request.ride_id
-        if ride_id not in self.rides:
-            logger.warning(f"Ride {ride_id} not found")
+        # One lookup: the ride may be evicted between a membership test and a read
+        ride = self.rides.get(ride_id)
+        if ride is None:
+            logger.warning("Ride %s not found", ride_id.hex())
             context.abort(grpc.StatusCode.NOT_FOUND, "Ride not found")
 
-        ride = self.rides[ride_id]
-        logger.info(f"Status request for ride {ride_id}: {ride['status']}")
-        return myuber_pb2.RideStatusResponse(
-            ride_id=ride_id,
-            status=ride["status"],
-            driver_id=ride["driver_id"] or ""
-        )
+        logger.info("Status request for ride %s: %s", ride_id.hex(), status_name(ride.status))
+        return self.build_ride_status(ride_id, ride)
 
-    def AcceptRide(self, request, context):
-        # Handle a driver accepting a ride
-        ride_id = request.ride_id
-        driver_id = request.driver_id
+    def GetRideStatuses(self, request, context):
+        # Look up many rides at once; unknown rides are reported per item instead of aborting
+        check_batch_size(request.ride_ids, context)
+        results = []
+        for ride_id in request.ride_ids:
+            # One lookup per ride, as in GetRideStatus
+            ride = self.rides.get(ride_id)
+            if ride is not None:
+                results.append(myuber_pb2.RideStatusResult(found=True, status=self.build_ride_status(ride_id, ride)))
+            else:
+                results.append(myuber_pb2.RideStatusResult(found=False))
+        logger.info("Batch status request for %s rides", len(results))
+        return myuber_pb2.GetRideStatusesResponse(results=results)
 
-        if ride_id not in self.rides:
-            logger.warning(f"Ride {ride_id} not found during acceptance")
+    def WatchRide(self, request, context):
+        # Stream status changes of a ride until it is completed or expired
+        ride_id = request.ride_id
+        topic = ("ride", ride_id)
+        # Subscribe before reading the current status so no change is missed, and read the ride
+        # once: it may be evicted between a membership test and a read
+        subscriber = self.events.subscribe(topic)
+        ride = self.rides.get(ride_id)
+        if ride is None:
+            self.events.unsubscribe(topic, subscriber)
+            logger.warning("Ride %s not found", ride_id.hex())
             context.abort(grpc.StatusCode.NOT_FOUND, "Ride not found")
 
-        if self.rides[ride_id]["driver_id"] != driver_id:
-            logger.warning(f"Driver {driver_id} not assigned to ride {ride_id}")
-            context.abort(grpc.StatusCode.PERMISSION_DENIED, "Driver not assigned to this ride")
+        logger.info("Rider watching ride %s", ride_id.hex())
+        yield self.build_ride_status(ride_id, ride)
+        for status in self.stream_events(topic, subscriber, context):
+            yield status
+            if status.status in TERMINAL_STATUSES:
+                break
+        self.events.unsubscribe(topic, subscriber)
 
-        # Cancel the timer for this ride
-        if ride_id in self.ride_timers:
-            self.ride_timers[ride_id].cancel()
-            del self.ride_timers[ride_id]
+    def WatchAssignments(self, request, context):
+        # Stream ride assignments for a driver as they happen
+        driver_id = request.driver_id
+        topic = ("driver", driver_id)
+        # Subscribe before looking for a pending assignment so no change is missed
+        subscriber = self.events.subscribe(topic)
+        logger.info("Driver %s watching for assignments", driver_id)
+        # An open assignment stream keeps the driver's lease alive
+        self.driver_manager.add_watcher(driver_id)
+        self.touch_driver(driver_id)
+        try:
+            initial = self.current_assignment(driver_id)
+            if initial is not None:
+                yield initial
+            for assignment in self.stream_events(topic, subscriber, context):
+                if initial is not None and assignment.ride_id == initial.ride_id:
+                    # The first event about that ride may be the offer itself, published between
+                    # subscribing and the check above; the driver already has it
+                    repeat = assignment.status == initial.status
+                    initial = None
+                    if repeat:
+                        continue
+                yield assignment
+        finally:
+            self.driver_manager.remove_watcher(driver_id)
+            self.events.unsubscribe(topic, subscriber)
 
-        self.rides[ride_id]["status"] = "ACCEPTED"
-        logger.info(f"Ride {ride_id} accepted by driver {driver_id}")
+    def AcceptRide(self, request, context):
+        # Handle a driver accepting a ride
+        ride_id = request.ride_id
+        driver_id = request.driver_id
+
+        try:
+            with self.rides.ride_lock(ride_id):
+                _, lsn = self.transition_ride("Accept", ride_id, ACCEPTED, expected_driver=driver_id)
+                # Cancel the timer for this ride
+                assigned_at = self.assigned_at.get(ride_id)
+                self.cancel_ride_timer(ride_id)
+        except RideTransitionError as error:
+            self.abort_transition(context, error, driver_id, "acceptance")
+        if assigned_at is not None:
+            self.accept_latency.record(time.monotonic() - assigned_at)
+        self.wait_durable(lsn, context)
+        logger.info("Ride %s accepted by driver %s", ride_id.hex(), driver_id)
         return myuber_pb2.AcceptRideResponse(success=True, message="Ride accepted")
 
     def RejectRide(self, request, context):
@@ -132,32 +672,25 @@ class MyUberServicer(myuber_pb2_grpc.RideSharingServicer):
         ride_id = request.ride_id
         driver_id = request.driver_id
 
-        if ride_id not in self.rides:
-            logger.warning(f"Ride {ride_id} not found during rejection")
-            context.abort(grpc.StatusCode.NOT_FOUND, "Ride not found")
-
-        if self.rides[ride_id]["driver_id"] != driver_id:
-            logger.warning(f"Driver {driver_id} not assigned to ride {ride_id}")
-            context.abort(grpc.StatusCode.PERMISSION_DENIED, "Driver not assigned to this ride")
-
-        # Cancel the timer for this ride
-        if ride_id in self.ride_timers:
-            self.ride_timers[ride_id].cancel()
-            del self.ride_timers[ride_id]
-
-        self.rides[ride_id]["status"] = "REJECTED"
-        self.rides[ride_id]["driver_id"] = None
-        self.driver_manager.add_available_driver(driver_id)
-        self.ride_queue.put(ride_id)
-        logger.info(f"Ride {ride_id} rejected by driver {driver_id}")
+        try:
+            # Also cancels the acceptance timer of the ride
+            ride, lsn = self.decline_ride("Reject", ride_id, driver_id)
+        except RideTransitionError as error:
+            self.abort_transition(context, error, driver_id, "rejection")
+        self.dispatcher.add_driver(driver_id)
+        self.requeue_ride(ride_id, ride)
+        self.wait_durable(lsn, context)
+        logger.info("Ride %s rejected by driver %s", ride_id.hex(), driver_id)
         return myuber_pb2.RejectRideResponse(success=True, message="Ride rejected")
 
     def CheckForRide(self, request, context):
-        # Check if a driver has been assigned a ride
+        # Check if a driver has been assigned a ride; polling also renews the driver's lease
         driver_id = request.driver_id
-        for ride_id, ride in self.rides.items():
-            if ride['status'] == 'DRIVER_ASSIGNED' and ride['driver_id'] == driver_id:
-                return myuber_pb2.CheckRideResponse(has_ride=True, ride_id=ride_id)
+        self.touch_driver(driver_id)
+        ride_id = self.rides.active_ride_for_driver(driver_id)
+        ride = self.rides.get(ride_id)
+        if ride is not None and ride.status == DRIVER_ASSIGNED:
+            return myuber_pb2.CheckRideResponse(has_ride=True, ride_id=ride_id)
         return myuber_pb2.CheckRideResponse(has_ride=False)
 
     def CompleteRide(self, request, context):
@@ -165,49 +698,282 @@ class MyUberServicer(myuber_pb2_grpc.RideSharingServicer):
         ride_id = request.ride_id
         driver_id = request.driver_id
 
-        if ride_id not in self.rides:
-            logger.warning(f"Ride {ride_id} not found during completion")
-            context.abort(grpc.StatusCode.NOT_FOUND, "Ride not found")
-
-        if self.rides[ride_id]["driver_id"] != driver_id:
-            logger.warning(f"Driver {driver_id} not assigned to ride {ride_id}")
-            context.abort(grpc.StatusCode.PERMISSION_DENIED, "Driver not assigned to this ride")
-
-        self.rides[ride_id]["status"] = "COMPLETED"
-        self.driver_manager.add_available_driver(driver_id)
-        logger.info(f"Ride {ride_id} completed by driver {driver_id}")
+        try:
+            ride, lsn = self.transition_ride("Complete", ride_id, COMPLETED, expected_driver=driver_id)
+        except RideTransitionError as error:
+            self.abort_transition(context, error, driver_id, "completion")
+        if self.archive is not None:
+            self.archive.append(ride_id, ride)
+        self.dispatcher.add_driver(driver_id)
+        self.wait_durable(lsn, context)
+        logger.info("Ride %s completed by driver %s", ride_id.hex(), driver_id)
         return myuber_pb2.RideCompletionResponse(success=True, message="Ride completed")
 
     def RegisterDriver(self, request, context):
         # Register a new driver
         driver_id = request.driver_id
-        success = self.driver_manager.register_driver(driver_id)
+        location = None
+        if request.HasField("location"):
+            location = (request.location.latitude, request.location.longitude)
+        # A driver registering again while on a ride must not be offered a second one
+        busy = self.rides.active_ride_for_driver(driver_id) is not None
+        success = self.driver_manager.register_driver(driver_id, location, available=not busy)
         if success:
-            logger.info(f"Driver {driver_id} registered successfully")
-            return myuber_pb2.DriverRegistrationResponse(success=True, message="Driver registered successfully")
+            self.start_lease_timer(driver_id)
+            self.wait_durable(self.log_driver(driver_id), context)
+            self.dispatcher.notify()
+            logger.info("Driver %s registered successfully", driver_id)
+            return myuber_pb2.DriverRegistrationResponse(success=True, message="Driver registered successfully",
+                                                         acceptance_timeout_seconds=self.acceptance_timeout)
         else:
-            logger.warning(f"Failed to register driver {driver_id}")
+            logger.warning("Failed to register driver %s", driver_id)
             return myuber_pb2.DriverRegistrationResponse(success=False, message="Failed to register driver")
 
-def serve():
+    def RegisterDrivers(self, request, context):
+        # Register many drivers at once: one driver manager update, one journal write, one wakeup
+        check_batch_size(request.drivers, context)
+        drivers = []
+        for registration in request.drivers:
+            location = None
+            if registration.HasField("location"):
+                location = (registration.location.latitude, registration.location.longitude)
+            drivers.append((registration.driver_id, location))
+        busy = {driver_id for driver_id, _ in drivers if self.rides.active_ride_for_driver(driver_id) is not None}
+        successes = self.driver_manager.register_drivers(drivers, busy)
+        for (driver_id, _), success in zip(drivers, successes):
+            if success:
+                self.start_lease_timer(driver_id)
+        self.wait_durable(self.log_drivers([driver_id for (driver_id, _), success in zip(drivers, successes)
+                                            if success]), context)
+        self.dispatcher.notify()
+        logger.info("Batch of %s drivers registered", sum(successes))
+        return myuber_pb2.RegisterDriversResponse(results=[
+            myuber_pb2.DriverRegistrationResponse(
+                success=success, message="Driver registered successfully" if success else "Failed to register driver",
+                acceptance_timeout_seconds=self.acceptance_timeout if success else 0)
+            for success in successes])
+
+    def UpdateDriverLocation(self, request, context):
+        # Record a driver's current position
+        driver_id = request.driver_id
+        if not request.HasField("location"):
+            logger.warning("Location update from driver %s without a location", driver_id)
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "Location is required")
+        self.driver_manager.update_location(driver_id, request.location.latitude, request.location.longitude)
+        self.touch_driver(driver_id)
+        return myuber_pb2.DriverLocationResponse(success=True, message="Location updated")
+
+    def Heartbeat(self, request, context):
+        # Renew a driver's presence lease, optionally with its current position
+        driver_id = request.driver_id
+        if not self.touch_driver(driver_id):
+            logger.warning("Heartbeat from unregistered driver %s", driver_id)
+            context.abort(grpc.StatusCode.NOT_FOUND, "Driver not registered")
+        if request.HasField("location"):
+            self.driver_manager.update_location(driver_id, request.location.latitude, request.location.longitude)
+        return myuber_pb2.HeartbeatResponse(success=True, message="Lease renewed",
+                                            lease_seconds=self.driver_manager.lease_duration)
+
+    def history_pages(self, kind, request, context):
+        # Page through the archived rides of a rider or driver, newest first, reading one page
+        # from the archive per streamed message
+        if self.archive is None:
+            context.abort(grpc.StatusCode.FAILED_PRECONDITION, "Ride history is not archived on this server")
+        page_size = min(request.page_size or DEFAULT_HISTORY_PAGE, MAX_HISTORY_PAGE)
+        remaining = request.max_rides or None
+        token = request.page_token
+        logger.info("History request for %s %s", kind, request.owner_id)
+        while True:
+            limit = page_size if remaining is None else min(page_size, remaining)
+            try:
+                rides, token = self.archive.history(kind, request.owner_id, limit, token)
+            except ValueError as error:
+                context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(error))
+            yield build_history_page(rides, token)
+            if remaining is not None:
+                remaining -= len(rides)
+            if not token or remaining == 0:
+                break
+
+    def GetRiderHistory(self, request, context):
+        # Stream a rider's completed rides from the archive
+        return self.history_pages(RIDER, request, context)
+
+    def GetDriverHistory(self, request, context):
+        # Stream a driver's completed rides from the archive
+        return self.history_pages(DRIVER, request, context)
+
+    def gauges(self):
+        # Current values of the dispatcher and driver gauges
+        return {
+            "pending_rides": self.dispatcher.pending_count(),
+            "available_drivers": self.driver_manager.get_available_drivers_count(),
+            "online_drivers": self.driver_manager.online_count(),
+            # Acceptance timeouts only; lease checks, expiry sweeps and cooldown wakeups share the wheel
+            "active_timers": len(self.ride_timers),
+            "archived_rides": len(self.archive) if self.archive is not None else 0,
+        }
+
+    def render_metrics(self):
+        # Text exposition of every metric, for the HTTP endpoint
+        return render_text(self.metrics.method_snapshots(), self.gauges(), {
+            "request_to_assignment": self.dispatcher.assignment_latency.snapshot(),
+            "assignment_to_accept": self.accept_latency.snapshot(),
+        })
+
+    def GetStats(self, request, context):
+        # Report per-method RPC metrics and dispatcher gauges
+        methods = [
+            myuber_pb2.MethodStats(method=method, calls=calls, codes=codes, latency=latency_summary(latency))
+            for method, calls, codes, latency in self.metrics.method_snapshots()
+        ]
+        return myuber_pb2.StatsResponse(
+            methods=methods,
+            request_to_assignment=latency_summary(self.dispatcher.assignment_latency.snapshot()),
+            assignment_to_accept=latency_summary(self.accept_latency.snapshot()),
+            # Clients check this against the server's position in their shard list
+            shard_id=self.shard_id if self.shard_id is not None else -1,
+            **self.gauges()
+        )
+
+def first_available(drivers, exclude):
+    # Longest-waiting driver of an ordered pool that is not in `exclude`
+    return next((driver_id for driver_id in drivers if exclude is None or driver_id not in exclude), None)
+
+def durable_wait_timeout(context):
+    # Seconds left until the client's deadline, or None to wait without one
+    timeout = context.time_remaining() if context is not None else None
+    if timeout is not None and timeout >= threading.TIMEOUT_MAX:
+        # Calls without a deadline report an effectively infinite time remaining
+        timeout = None
+    return timeout
+
+def check_batch_size(items, context):
+    # Reject batches too large to handle in one state update
+    if len(items) > MAX_BATCH_SIZE:
+        context.abort(grpc.StatusCode.INVALID_ARGUMENT, f"At most {MAX_BATCH_SIZE} items per batch")
+
+def build_history_page(rides, next_page_token):
+    # HistoryPage message from the ride tuples of RideArchive.history
+    page = myuber_pb2.HistoryPage(next_page_token=next_page_token)
+    for ride_id, rider_id, driver_id, pickup, requested_at, completed_at in rides:
+        ride = page.rides.add(ride_id=ride_id, rider_id=rider_id, driver_id=driver_id, requested_at_ms=requested_at,
+                              completed_at_ms=completed_at)
+        if pickup is not None:
+            ride.pickup.latitude, ride.pickup.longitude = pickup
+    return page
+
+def latency_summary(snapshot):
+    # Convert a LatencyHistogram snapshot to a LatencySummary message
+    return myuber_pb2.LatencySummary(
+        count=snapshot["count"],
+        mean_ms=snapshot["mean"] * 1000,
+        p50_ms=snapshot["p50"] * 1000,
+        p90_ms=snapshot["p90"] * 1000,
+        p99_ms=snapshot["p99"] * 1000,
+        max_ms=snapshot["max"] * 1000,
+    )
+
+def load_server_credentials():
     # Set up SSL credentials for the server
-    server_credentials = grpc.ssl_server_credentials(
+    return grpc.ssl_server_credentials(
         [(open('server.key', 'rb').read(), open('server.crt', 'rb').read())],
         root_certificates=open('ca.crt', 'rb').read(),
         require_client_auth=True
     )
+
+def servicer_options(args):
+    # MyUberServicer keyword arguments taken from the command line
+    return {
+        "acceptance_timeout": args.acceptance_timeout,
+        "dispatch_mode": args.dispatch_mode,
+        "batch_window": args.batch_window,
+        "requeue_boost": args.requeue_boost,
+        "decline_cooldown": args.decline_cooldown,
+        "driver_lease": args.driver_lease,
+        "max_pending_rides": args.max_pending_rides,
+        "max_ride_wait": args.max_ride_wait,
+        "shard_id": args.shard_id,
+        "archive": RideArchive(args.archive_dir) if args.archive_dir else None,
+        "journal": RideJournal(args.data_dir, snapshot_every=args.snapshot_every) if args.data_dir else None,
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="MyUber ride-sharing server")
+    parser.add_argument("--mode", choices=["threaded", "asyncio"], default="threaded",
+                        help="Serve with a thread pool or with grpc.aio on an event loop")
+    parser.add_argument("--port", type=int, default=50051)
+    parser.add_argument("--max-workers", type=int, default=DEFAULT_MAX_WORKERS,
+                        help="Thread pool size in threaded mode; must exceed the number of open watch streams")
+    parser.add_argument("--insecure", action="store_true", help="Serve plaintext instead of SSL (benchmarks only)")
+    parser.add_argument("--acceptance-timeout", type=float, default=10.0)
+    parser.add_argument("--dispatch-mode", choices=[GREEDY, BATCH], default=GREEDY)
+    parser.add_argument("--batch-window", type=float, default=0.2)
+    parser.add_argument("--requeue-boost", type=float, default=10.0,
+                        help="Seconds of waiting credited to a ride each time a driver declines it")
+    parser.add_argument("--decline-cooldown", type=float, default=30.0,
+                        help="Seconds before a ride may be offered again to a driver who declined it (0: right away)")
+    parser.add_argument("--max-pending-rides", type=int, default=10000,
+                        help="Shed new rides with RESOURCE_EXHAUSTED once this many are waiting (0: unbounded)")
+    parser.add_argument("--max-ride-wait", type=float, default=300.0,
+                        help="Seconds a ride may wait for a driver before it expires (0: forever)")
+    parser.add_argument("--driver-lease", type=float, default=30.0,
+                        help="Seconds a driver stays online without a heartbeat or an open assignment stream")
+    parser.add_argument("--shard-id", type=int,
+                        help="Position of this server in the shard list given to clients, for a sharded deployment")
+    parser.add_argument("--data-dir", help="Directory for the ride write-ahead log; rides survive restarts when set")
+    parser.add_argument("--archive-dir",
+                        help="Directory of the columnar archive of completed rides, for GetRiderHistory and "
+                             "GetDriverHistory")
+    parser.add_argument("--snapshot-every", type=int, default=50000, help="Log records between snapshots")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="Serve text metrics on http://0.0.0.0:PORT/metrics (0 to disable)")
+    parser.add_argument("--log-level", default="INFO")
+    parser.add_argument("--log-mode", choices=["sync", "async"], default=os.environ.get("MYUBER_LOG_MODE", "sync"),
+                        help="Write log records on the request thread or from a background batching writer")
+    parser.add_argument("--log-format", choices=["text", "json"], default=os.environ.get("MYUBER_LOG_FORMAT", "text"))
+    parser.add_argument("--log-sample", default=os.environ.get("MYUBER_LOG_SAMPLE", ""),
+                        help="Per-method fraction of INFO records to keep, e.g. /myuber.RideSharing/GetRideStatus=0.01")
+    parser.add_argument("--log-rate-limit", type=float, default=float(os.environ.get("MYUBER_LOG_RATE_LIMIT", 0)),
+                        help="Maximum INFO records per second per method (0 for no limit)")
+    args = parser.parse_args(argv)
+    if args.shard_id is not None and not 0 <= args.shard_id < MAX_SHARDS:
+        parser.error(f"--shard-id must be between 0 and {MAX_SHARDS - 1}")
+    return args
+
+def serve(argv=None):
+    args = parse_args(argv)
+    configure_logging(mode=args.log_mode, structured=args.log_format == "json",
+                      sample_rates=parse_sample_rates(args.log_sample), rate_limit=args.log_rate_limit or None)
+    logger.setLevel(args.log_level)
+    if args.mode == "asyncio":
+        # Imported here because the asyncio server builds on this module
+        from myuber_aio_server import serve_async
+        try:
+            asyncio.run(serve_async(args))
+        except KeyboardInterrupt:
+            print("Server stopped")
+        return
+
+    servicer = MyUberServicer(**servicer_options(args))
+    if args.metrics_port:
+        start_metrics_http_server(args.metrics_port, servicer.render_metrics)
     # Create a gRPC server
     server = grpc.server(
-        futures.ThreadPoolExecutor(max_workers=10),
-        interceptors=get_interceptors()
+        futures.ThreadPoolExecutor(max_workers=args.max_workers),
+        interceptors=get_interceptors(servicer.metrics),
+        options=SERVER_OPTIONS
     )
     # Add the MyUber service to the server
-    myuber_pb2_grpc.add_RideSharingServicer_to_server(MyUberServicer(), server)
-    # Add a secure port with SSL credentials
-    server.add_secure_port('[::]:50051', server_credentials)
+    myuber_pb2_grpc.add_RideSharingServicer_to_server(servicer, server)
+    if args.insecure:
+        server.add_insecure_port(f'[::]:{args.port}')
+    else:
+        # Add a secure port with SSL credentials
+        server.add_secure_port(f'[::]:{args.port}', load_server_credentials())
     # Start the server
     server.start()
-    print("MyUber Server started on port 50051 (SSL enabled)")
+    print(f"MyUber Server started on port {args.port} ({'plaintext' if args.insecure else 'SSL enabled'}, threaded)")
     print("Press Ctrl+C to stop the server")
     try:
         # Keep the server running
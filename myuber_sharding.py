@@ -0,0 +1,96 @@
+import bisect
+import hashlib
+import math
+import uuid
+import myuber_pb2_grpc
+
+# Degrees per side of a dispatch region (about 5 km); a region's rides and drivers live on one shard
+REGION_SIZE = 0.05
+# Points per shard on the hash ring; more points spread regions more evenly
+VIRTUAL_NODES = 128
+# The owning shard is stored in the first byte of every ride ID
+MAX_SHARDS = 256
+
+def parse_targets(target):
+    # 'host:port' or a comma-separated shard list 'host:port,host:port,...', in shard order
+    targets = [part.strip() for part in target.split(",") if part.strip()]
+    if not targets or len(targets) > MAX_SHARDS:
+        raise ValueError(f"Expected 1 to {MAX_SHARDS} server addresses, got {target!r}")
+    return targets
+
+def region_of(location, region_size=REGION_SIZE):
+    # Key of the grid region containing a (lat, lng) pair
+    return f"{math.floor(location[0] / region_size)}:{math.floor(location[1] / region_size)}"
+
+def ring_hash(key):
+    # Stable 64-bit hash; Python's hash() differs between processes
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+def new_ride_id(shard_id=None):
+    # Random 16-byte ride ID; in a sharded deployment the first byte is replaced by the shard that
+    # owns the ride, so clients route GetRideStatus, AcceptRide, ... without a lookup
+    ride_id = uuid.uuid4().bytes
+    if shard_id is None:
+        return ride_id
+    return bytes((shard_id,)) + ride_id[1:]
+
+class HashRing:
+    def __init__(self, shard_count, virtual_nodes=VIRTUAL_NODES):
+        # Consistent hashing: each shard owns the arcs before its points, so adding a shard only
+        # moves the keys that land on the new shard's arcs
+        points = sorted((ring_hash(f"shard-{shard}#{replica}"), shard)
+                        for shard in range(shard_count) for replica in range(virtual_nodes))
+        self.hashes = [point for point, _ in points]
+        self.shards = [shard for _, shard in points]
+
+    def shard_for(self, key):
+        # Index of the shard owning a key
+        index = bisect.bisect(self.hashes, ring_hash(key))
+        return self.shards[index % len(self.shards)]
+
+class ShardRouter:
+    def __init__(self, targets, channel_factory, region_size=REGION_SIZE, owns_channels=True):
+        # One channel and stub per shard, in shard order; channel_factory(target) opens a channel, or
+        # takes one from a shared pool (owns_channels=False), in which case close() leaves it open
+        self.targets = targets
+        self.owns_channels = owns_channels
+        self.channels = [channel_factory(target) for target in targets]
+        self.stubs = [myuber_pb2_grpc.RideSharingStub(channel) for channel in self.channels]
+        self.ring = HashRing(len(targets))
+        self.region_size = region_size
+
+    def __len__(self):
+        return len(self.stubs)
+
+    def shard_for_location(self, location, fallback_key):
+        # Shard owning the region of a (lat, lng) location, or of fallback_key (a rider or driver ID)
+        # when there is no location
+        if len(self.stubs) == 1:
+            return 0
+        key = region_of(location, self.region_size) if location is not None else fallback_key
+        return self.ring.shard_for(key)
+
+    def shard_for_ride(self, ride_id):
+        # Shard that created a ride, read from the ride ID itself
+        if len(self.stubs) == 1 or not ride_id:
+            return 0
+        return ride_id[0] % len(self.stubs)
+
+    def for_location(self, location, fallback_key):
+        return self.stubs[self.shard_for_location(location, fallback_key)]
+
+    def for_ride(self, ride_id):
+        return self.stubs[self.shard_for_ride(ride_id)]
+
+    def group(self, items, shard_of):
+        # Split items by shard: {shard: [(position, item), ...]}, to fan a batch RPC out and put the
+        # answers back in request order
+        groups = {}
+        for position, item in enumerate(items):
+            groups.setdefault(shard_of(item), []).append((position, item))
+        return groups
+
+    def close(self):
+        if self.owns_channels:
+            for channel in self.channels:
+                channel.close()